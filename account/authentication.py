@@ -0,0 +1,124 @@
+"""
+Stateless JWT authentication.
+
+Access tokens issued by RoleRefreshToken carry the username and role of
+their user, so the user of a request is built from the token without a
+query. The claims are checked against a small in-process LRU cache of
+full users, kept for a few seconds only, so a deactivated or demoted user
+loses access within USER_CACHE_TTL rather than when their token expires.
+Fields missing from the token are loaded on demand from the same cache.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from cafebackend.replicas import primary_reads
+from .models import ClaimsUser
+from .tokens import USER_CLAIMS
+
+User = get_user_model()
+
+# how long and how many full users are kept in memory
+USER_CACHE_TTL = 30
+USER_CACHE_SIZE = 1024
+
+
+class UserCache:
+    """
+    LRU cache of full users with a time to live.
+
+    Attributes:
+        ttl (float): the seconds a user is kept.
+        maxsize (int): the number of users kept at most.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, maxsize=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        Returns a user, loading it from the database if it isn't cached.
+
+        Raises:
+            User.DoesNotExist: if there is no such user.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and cached[0] > now:
+                self._users.move_to_end(user_id)
+                return cached[1]
+
+        # cached past the request, so never read from a lagging replica
+        with primary_reads():
+            user = User.objects.get(pk=user_id)
+
+        with self._lock:
+            self._users[user_id] = (now + self.ttl, user)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+
+        return user
+
+    def discard(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication building the request user from the token claims.
+
+    Tokens issued before the claims were added are authenticated against
+    the database as before.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if not all(claim in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+
+        claims = {claim: validated_token[claim] for claim in USER_CLAIMS}
+        claims[api_settings.USER_ID_FIELD] = user_id
+
+        user = ClaimsUser.from_claims(claims)
+
+        if user.pk is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        try:
+            current = user_cache.get(user.pk)
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not current.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # e.g a demoted admin, a refresh issues a token with the current claims
+        if any(getattr(current, claim) != claims[claim] for claim in USER_CLAIMS):
+            raise InvalidToken(_("Token claims are out of date"))
+
+        return user
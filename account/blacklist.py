@@ -0,0 +1,123 @@
+"""
+In-memory token blacklist.
+
+Every process keeps the jtis of the blacklisted refresh tokens that have
+not expired yet, loaded once on the first check and kept up to date from
+then on, so refreshing a token doesn't query the blacklist table.
+
+Processes learn about tokens blacklisted elsewhere through a generation
+counter in the cache, bumped on every logout: when it moved, the
+unexpired rows are read again. Logouts running at the same time can
+commit out of id order, so reading only the rows after the last one
+loaded could skip a row for good. Without a shared cache (see
+SHARED_CACHE) other processes can't be told, so every check queries the
+blacklist table instead.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+
+GENERATION_KEY = "token-blacklist:generation"
+
+
+def current_generation():
+    """
+    Returns the blacklist generation shared by every process.
+    """
+    generation = cache.get(GENERATION_KEY)
+
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+
+    return generation
+
+
+def bump_generation():
+    """
+    Tells every process a token was blacklisted.
+
+    Returns:
+        int: the new generation, None if the counter had to be recreated.
+    """
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        return None
+
+
+class JTIBlacklist:
+    """
+    The jtis of the unexpired blacklisted tokens, with their expiry.
+
+    Attributes:
+        generation (int): the blacklist generation the jtis are in sync
+            with, None until they are loaded.
+    """
+
+    def __init__(self):
+        self.generation = None
+        self._jtis = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        Forgets every jti, they are loaded again on the next check.
+        """
+        with self._lock:
+            self.generation = None
+            self._jtis = {}
+
+    def sync(self, generation):
+        """
+        Loads the jtis of every unexpired blacklisted token.
+        """
+        self._jtis = dict(
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            .values_list("token__jti", "token__expires_at")
+        )
+        self.generation = generation
+
+    def contains(self, jti):
+        """
+        Returns whether a token is blacklisted, querying the database only
+        when a token was blacklisted since the last check.
+        """
+        if not settings.SHARED_CACHE:
+            return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+        generation = current_generation()
+
+        with self._lock:
+            if self.generation != generation:
+                self.sync(generation)
+
+            return jti in self._jtis
+
+    def add(self, blacklisted):
+        """
+        Adds a token blacklisted by this process. Must be called once its
+        blacklist row is committed, so other processes reloading the
+        blacklist find it.
+
+        Args:
+            blacklisted (BlacklistedToken): the blacklist row, with its token.
+        """
+        with self._lock:
+            self._jtis[blacklisted.token.jti] = blacklisted.token.expires_at
+
+        generation = bump_generation()
+
+        with self._lock:
+            # nothing else was blacklisted in between, no need to reload
+            if generation is not None and self.generation == generation - 1:
+                self.generation = generation
+
+
+jti_blacklist = JTIBlacklist()
@@ -0,0 +1,129 @@
+import asyncio
+import secrets
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+
+from account.views import login_user
+from cafebackend.workers import get_pool
+from cafecustomer.models import Category, FoodItem
+
+User = get_user_model()
+
+# a fresh password every run, the benchmark users are real users while it runs
+PASSWORD = secrets.token_urlsafe(16)
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks login throughput against concurrent menu reads, served
+    in-process by the ASGI handler.
+
+    Each round runs the menu readers for a few seconds: alone, next to
+    logins hashing passwords in the sync request thread as they did
+    before, and next to logins served from the auth pool. The synthetic
+    users and menu are created under unique names and deleted once the
+    benchmark is done.
+    """
+
+    help = "Benchmarks login throughput and menu read latency under login load."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--readers", type=int, default=8, help="Concurrent menu readers.")
+        parser.add_argument("--logins", type=int, default=32, help="Concurrent logins.")
+        parser.add_argument("--items", type=int, default=200)
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:8]
+        self.login_username = f"benchmark-login-{suffix}"
+
+        category = Category.objects.create(name=f"Benchmark {suffix}", description="benchmark")
+        users = []
+
+        try:
+            for i in range(options["items"]):
+                FoodItem.objects.create(
+                    category=category, name=f"Benchmark dish {suffix}-{i}", price=Decimal("100.00"),
+                    description="benchmark", is_available=True,
+                )
+            users.append(User.objects.create_user(username=self.login_username, password=PASSWORD, role="customer"))
+            reader = User.objects.create_user(username=f"benchmark-reader-{suffix}", password=PASSWORD, role="customer")
+            users.append(reader)
+            access = login_user({"username": reader.username, "password": PASSWORD})[0]["access"]
+
+            pool = get_pool("auth")
+            self.stdout.write(f"auth pool workers: {pool.max_workers}, queue: {pool.max_queue}")
+            self.stdout.write(
+                f"{'round':<16} {'menu/s':>8} {'menu p50':>9} {'menu p95':>9} {'logins/s':>9} {'login p95':>10} {'503s':>5}"
+            )
+
+            for name, logins in [("menu only", None), ("blocking login", "blocking"), ("pooled login", "pooled")]:
+                # the test client's requests are sent to "testserver"
+                with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                    menu, login, rejected = asyncio.run(self.run_round(access, logins, options))
+                seconds = options["seconds"]
+
+                self.stdout.write(
+                    f"{name:<16} {len(menu) / seconds:>8.0f} {percentile(menu, 0.5):>9.1f} {percentile(menu, 0.95):>9.1f} "
+                    f"{len(login) / seconds:>9.1f} {percentile(login, 0.95):>10.1f} {rejected:>5}"
+                )
+        finally:
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+            # deletes the fooditems with it
+            category.delete()
+
+    async def run_round(self, access, logins, options):
+        deadline = time.perf_counter() + options["seconds"]
+        menu_timings, login_timings = [], []
+        rejected = 0
+
+        async def read_menu():
+            client = AsyncClient()
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get(reverse("menu-search"), {"q": "dish"}, headers={"Authorization": f"Bearer {access}"})
+                menu_timings.append((time.perf_counter() - start) * 1000)
+
+        async def log_in():
+            nonlocal rejected
+            client = AsyncClient()
+            credentials = {"username": self.login_username, "password": PASSWORD}
+
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+
+                if logins == "blocking":
+                    # what the sync view did: hash in the thread serving the sync views
+                    await sync_to_async(login_user)(credentials)
+                else:
+                    response = await client.post(reverse("login"), credentials, content_type="application/json")
+                    if response.status_code == 503:
+                        rejected += 1
+                        await asyncio.sleep(0.05)
+                        continue
+
+                login_timings.append((time.perf_counter() - start) * 1000)
+
+        tasks = [read_menu() for _ in range(options["readers"])]
+        if logins is not None:
+            tasks += [log_in() for _ in range(options["logins"])]
+
+        await asyncio.gather(*tasks)
+
+        return menu_timings, login_timings, rejected
+
+
+def percentile(timings, fraction):
+    if not timings:
+        return 0.0
+    timings = sorted(timings)
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] if fraction != 0.5 else statistics.median(timings)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    """
+    Deletes the expired outstanding and blacklisted tokens in small
+    batches, a transaction per batch, so the token tables stay compact
+    without locking them for long. Safe to interrupt and run again.
+    """
+
+    help = "Deletes the expired outstanding and blacklisted tokens."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+
+        while True:
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now)
+                .order_by("id").values_list("id", flat=True)[:options["batch_size"]]
+            )
+
+            if not ids:
+                break
+
+            with transaction.atomic():
+                BlacklistedToken.objects.filter(token_id__in=ids).delete()
+                deleted += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+
+            self.stdout.write(f"Deleted {deleted} tokens...")
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens."))
@@ -18,4 +18,46 @@ class CustomUser(AbstractUser):
     role = models.CharField(max_length=200, default=CUSTOMER, choices=ROLE_CHOICES)
 
     def __str__(self) -> str:
-        return self.username
\ No newline at end of file
+        return self.username
+
+
+class ClaimsUser(CustomUser):
+    """
+    The user of an authenticated request, built from the claims of its
+    access token without querying the database.
+
+    Only the fields carried by the token are loaded, the other fields are
+    deferred and loaded on first access from a short-lived in-process
+    cache of full users, so only the views that need the full row pay for it.
+    """
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, claims):
+        """
+        Builds the user from the claims of a validated access token.
+
+        Args:
+            claims (dict): the user claims, keyed by field name.
+        """
+        fields = [field for field in cls._meta.concrete_fields if field.attname in claims]
+        return cls.from_db(
+            "default",
+            [field.attname for field in fields],
+            [field.to_python(claims[field.attname]) for field in fields],
+        )
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+
+        if fields is None or not set(fields) <= deferred:
+            return super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
+        from .authentication import user_cache
+
+        user = user_cache.get(self.pk)
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred:
+                setattr(self, field.attname, getattr(user, field.attname))
@@ -1,18 +1,37 @@
 
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import AsyncMock, patch
+
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.test import override_settings
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework import status
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 from django.contrib.auth import get_user_model
 
+from cafebackend import workers
+from cafebackend.workers import PoolSaturated
+
+from .authentication import StatelessJWTAuthentication, user_cache
+from .blacklist import bump_generation, jti_blacklist
+from .models import ClaimsUser
+
 User = get_user_model()
 
+@override_settings(BACKGROUND_TASKS_EAGER=True)
 class UserManagementTests(APITestCase):
 
     def setUp(self):
         self.admin_user = User.objects.create_user(username='adminuser', password='adminpass', role='admin')
         self.customer_user = User.objects.create_user(username='customeruser', password='customerpass', role='customer')
-        self.admin_token = self.client.post(reverse('login'), {'username': 'adminuser', 'password': 'adminpass'}).response_data['access']
-        self.customer_token = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'customerpass'}).response_data['access']
+        self.admin_token = self.client.post(reverse('login'), {'username': 'adminuser', 'password': 'adminpass'}).json()['access']
+        self.customer_token = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'customerpass'}).json()['access']
 
     def test_register_user(self):
         data = {
@@ -28,7 +47,7 @@ class UserManagementTests(APITestCase):
         data = {'username': 'adminuser', 'password': 'adminpass'}
         response = self.client.post(reverse('login'), data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('access', response.data)
+        self.assertIn('access', response.json())
 
     def test_access_customer_dashboard_with_customer_role(self):
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.customer_token)
@@ -49,3 +68,218 @@ class UserManagementTests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.admin_token)
         response = self.client.get(reverse('customer-home'))
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class StatelessAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.customer = User.objects.create_user(
+            username='customeruser', email='customer@example.com', password='customerpass', role='customer'
+        )
+        self.token = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'customerpass'}).json()['access']
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return StatelessJWTAuthentication().authenticate(request)[0]
+
+    def test_access_token_carries_the_role(self):
+        token = AccessToken(self.token)
+        self.assertEqual((token['username'], token['role']), ('customeruser', 'customer'))
+
+        obtained = self.client.post(reverse('token_obtain_pair'), {'username': 'customeruser', 'password': 'customerpass'})
+        self.assertEqual(AccessToken(obtained.json()['access'])['role'], 'customer')
+
+    def test_requests_are_authorized_without_querying_the_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        # the user is checked once per USER_CACHE_TTL
+        self.client.get(reverse('customer-home'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('customer-home'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # the claims user works as a foreign key value
+        self.assertEqual(self.client.get(reverse('customer-points')).status_code, status.HTTP_200_OK)
+
+    def test_full_row_is_loaded_on_demand_from_the_cache(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate(self.token)
+        self.assertIsInstance(user, ClaimsUser)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(user.email, 'customer@example.com')
+            self.assertTrue(user.is_active)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(self.token).email, 'customer@example.com')
+
+    def test_deactivated_and_demoted_users_are_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.assertEqual(self.client.get(reverse('customer-home')).status_code, status.HTTP_200_OK)
+
+        User.objects.filter(id=self.customer.id).update(is_active=False)
+        user_cache.clear()  # USER_CACHE_TTL ran out
+        self.assertEqual(self.client.get(reverse('customer-home')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        User.objects.filter(id=self.customer.id).update(is_active=True, role='admin')
+        user_cache.clear()
+        self.assertEqual(self.client.get(reverse('customer-home')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_without_claims_are_checked_against_the_database(self):
+        token = str(AccessToken.for_user(self.customer))
+
+        with self.assertNumQueries(1):
+            user = self.authenticate(token)
+
+        self.assertEqual(user.role, 'customer')
+
+    def refresh_token(self):
+        refresh = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'customerpass'}).json()['refresh']
+        return lambda: self.client.post(reverse('token_refresh'), {'refresh': refresh})
+
+    def test_refreshed_tokens_carry_the_current_role(self):
+        refresh = self.refresh_token()
+        User.objects.filter(id=self.customer.id).update(role='admin', username='promoted')
+
+        response = refresh()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        token = AccessToken(response.data['access'])
+        self.assertEqual((token['username'], token['role']), ('promoted', 'admin'))
+
+    def test_inactive_users_get_no_new_tokens(self):
+        refresh = self.refresh_token()
+        User.objects.filter(id=self.customer.id).update(is_active=False)
+
+        self.assertEqual(refresh().status_code, status.HTTP_401_UNAUTHORIZED)
+
+        User.objects.filter(id=self.customer.id).delete()
+        self.assertEqual(refresh().status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+# the test process stands in for every process sharing the cache
+@override_settings(BACKGROUND_TASKS_EAGER=True, SHARED_CACHE=True)
+class TokenBlacklistTests(APITestCase):
+
+    def setUp(self):
+        jti_blacklist.reset()
+        User.objects.create_user(username='customeruser', password='customerpass', role='customer')
+        tokens = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'customerpass'}).json()
+        self.refresh, self.access = tokens['refresh'], tokens['access']
+
+    def refresh_token(self, refresh):
+        return self.client.post(reverse('token_refresh'), {'refresh': refresh})
+
+    def logout(self, refresh):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.access)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('logout'), {'refresh': refresh})
+        self.client.credentials()
+        return response
+
+    def test_refresh_checks_the_blacklist_in_memory(self):
+        self.assertEqual(self.refresh_token(self.refresh).status_code, status.HTTP_200_OK)
+
+        # the blacklist is checked in memory, only the user is read
+        with self.assertNumQueries(1):
+            response = self.refresh_token(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logged_out_tokens_are_rejected_without_a_query(self):
+        self.refresh_token(self.refresh)
+        self.assertEqual(self.logout(self.refresh).status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.refresh_token(self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_blacklisted_by_another_process_are_loaded(self):
+        self.refresh_token(self.refresh)
+
+        # what the logout of another process leaves behind
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=RefreshToken(self.refresh)['jti']))
+        bump_generation()
+
+        self.assertEqual(self.refresh_token(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # a new process loads it on its first check
+        jti_blacklist.reset()
+        self.assertEqual(self.refresh_token(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rows_committed_out_of_id_order_are_loaded(self):
+        other = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'customerpass'}).json()
+        outstanding = OutstandingToken.objects.get(jti=RefreshToken(self.refresh)['jti'])
+        other_outstanding = OutstandingToken.objects.get(jti=RefreshToken(other['refresh'])['jti'])
+
+        # a later logout commits first and is loaded
+        BlacklistedToken.objects.create(id=10, token=other_outstanding)
+        bump_generation()
+        self.assertEqual(self.refresh_token(other['refresh']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # the earlier one commits after it, with a lower id
+        BlacklistedToken.objects.create(id=5, token=outstanding)
+        bump_generation()
+        self.assertEqual(self.refresh_token(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_blacklist_is_checked_in_the_database_without_a_shared_cache(self):
+        self.refresh_token(self.refresh)
+
+        # blacklisted by a process this one can't hear from
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=RefreshToken(self.refresh)['jti']))
+
+        self.assertEqual(self.refresh_token(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_purge_deletes_expired_tokens_in_batches(self):
+        self.logout(self.refresh)
+        for index in range(5):
+            OutstandingToken.objects.create(jti=f'expired-{index}', token='x', expires_at=timezone.now() - timedelta(days=1))
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti='expired-0'))
+
+        out = StringIO()
+        call_command('purge_expired_tokens', batch_size=2, stdout=out)
+
+        self.assertIn('Deleted 5 expired tokens', out.getvalue())
+        self.assertFalse(OutstandingToken.objects.filter(jti__startswith='expired-').exists())
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertEqual(self.refresh_token(self.refresh).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class AuthPoolTests(APITestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='customeruser', password='customerpass', role='customer')
+
+    def test_login_accepts_json(self):
+        response = self.client.post(
+            reverse('login'), {'username': 'customeruser', 'password': 'customerpass'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['redirect_url'], reverse('customer-home'))
+
+    def test_invalid_requests_are_rejected(self):
+        response = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.post(reverse('register'), {'username': 'customeruser'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.json())
+
+        response = self.client.post(reverse('login'), '{', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.client.get(reverse('login')).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_saturated_pool_sheds_load(self):
+        with patch('account.views.workers.run', new=AsyncMock(side_effect=PoolSaturated)):
+            response = self.client.post(reverse('login'), {'username': 'customeruser', 'password': 'customerpass'})
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '2')
+
+    @override_settings(BACKGROUND_TASKS_EAGER=False)
+    def test_handlers_run_off_the_request_thread(self):
+        self.assertNotEqual(async_to_sync(workers.run)('auth', threading.get_ident), threading.get_ident())
@@ -0,0 +1,97 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .blacklist import jti_blacklist
+
+
+User = get_user_model()
+
+# the user fields carried by every token, enough to authorize most requests
+USER_CLAIMS = ("username", "role")
+
+
+class RoleRefreshToken(RefreshToken):
+    """
+    Refresh token carrying the username and role of its user.
+
+    The claims are copied to the access tokens it issues, so requests are
+    authenticated and authorized from the token alone.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+
+        return token
+
+    def check_blacklist(self):
+        """
+        Checks the token against the in-memory blacklist instead of the
+        blacklist table.
+        """
+        if jti_blacklist.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        blacklisted, created = super().blacklist()
+        transaction.on_commit(lambda: jti_blacklist.add(blacklisted))
+
+        return blacklisted, created
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = RoleRefreshToken
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Issues access tokens carrying the current username and role of the
+    user, and none to inactive or deleted users.
+
+    Requests are authorized from the access token alone, so a refresh is
+    where changes to the user are picked up, at the cost of one query.
+    """
+
+    token_class = RoleRefreshToken
+
+    default_error_messages = {
+        "no_active_account": _("No active account found with the given credentials"),
+    }
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        try:
+            user_id = refresh[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        for claim in USER_CLAIMS:
+            refresh[claim] = getattr(user, claim)
+
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+
+            data["refresh"] = str(refresh)
+
+        return data
@@ -1,31 +1,51 @@
+import json
+
 from django.contrib.auth import authenticate
 from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+
+from cafebackend import workers
+from cafebackend.workers import PoolSaturated
+
+from .tokens import RoleRefreshToken
 
 from django.urls import reverse
 
-from .serializers import UserSerializer, RegisterSerializer, LoginSerializer
+from .serializers import RegisterSerializer, LoginSerializer
 
-@api_view(['POST'])
-def register(request):
+# the seconds clients are told to wait when the auth pool is saturated
+AUTH_RETRY_AFTER = 2
+
+
+def register_user(data):
+    """
+    Validates a registration and creates the user, hashing their password.
 
-    serializer = RegisterSerializer(data=request.data)
+    Returns:
+        tuple: the response data and status.
+    """
+    serializer = RegisterSerializer(data=data)
 
     if serializer.is_valid():
         serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return serializer.data, status.HTTP_201_CREATED
 
+    return serializer.errors, status.HTTP_400_BAD_REQUEST
 
-@api_view(['POST'])
-def login(request):
-    
-    serializer = LoginSerializer(data=request.data)
+
+def login_user(data):
+    """
+    Checks a user's credentials and issues their tokens.
+
+    Returns:
+        tuple: the response data and status.
+    """
+    serializer = LoginSerializer(data=data)
 
     if serializer.is_valid():
         username = serializer.validated_data["username"]
@@ -34,7 +54,7 @@ def login(request):
         user = authenticate(username=username, password=password)
 
         if user:
-            refresh = RefreshToken.for_user(user)
+            refresh = RoleRefreshToken.for_user(user)
             response_data = {
                 "refresh": str(refresh),
                 "access": str(refresh.access_token)
@@ -45,11 +65,61 @@ def login(request):
             else:
                 response_data["redirect_url"] = reverse("customer-home")
 
-            return JsonResponse(response_data)
+            return response_data, status.HTTP_200_OK
         else:
-            return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
-        
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            return {'detail': 'Invalid credentials'}, status.HTTP_401_UNAUTHORIZED
+
+    return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+
+def request_data(request):
+    """
+    Returns the JSON or form data of a request.
+
+    Raises:
+        ValueError: if the JSON body is malformed.
+    """
+    if request.content_type == "application/json":
+        return json.loads(request.body or b"{}")
+
+    return request.POST.dict()
+
+
+async def run_on_auth_pool(request, handler):
+    """
+    Runs a login or register handler on the auth pool, so hashing the
+    password doesn't hold the event loop nor a request thread.
+
+    Returns:
+        JsonResponse: the handler's response, or 503 if the pool is saturated.
+    """
+    try:
+        data = request_data(request)
+    except ValueError:
+        return JsonResponse({"detail": "Malformed JSON body."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        response_data, response_status = await workers.run("auth", handler, data)
+    except PoolSaturated:
+        return JsonResponse(
+            {"detail": "Too many login attempts at the moment. Please try again shortly."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(AUTH_RETRY_AFTER)},
+        )
+
+    return JsonResponse(response_data, status=response_status)
+
+
+@csrf_exempt
+@require_POST
+async def register(request):
+    return await run_on_auth_pool(request, register_user)
+
+
+@csrf_exempt
+@require_POST
+async def login(request):
+    return await run_on_auth_pool(request, login_user)
 
 
 @api_view(['POST'])
@@ -61,7 +131,7 @@ def logout(request):
     if refresh_token:
         try:
             # Attempt to blacklist the refresh token
-            token = RefreshToken(refresh_token)
+            token = RoleRefreshToken(refresh_token)
             token.blacklist()
             return Response({"message": "Successfully logged out"}, status=200)
         except Exception as e:
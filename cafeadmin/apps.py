@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CafeadminConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "cafeadmin"
+
+    def ready(self):
+        import cafeadmin.signals
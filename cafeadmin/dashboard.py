@@ -0,0 +1,345 @@
+"""
+Live operational metrics of the admin dashboard.
+
+The metrics are counters in the shared cache, updated by the order,
+payment and table signals once their transaction commits, so reading
+them never queries the orders and every process reports the same
+numbers. They are warmed from the database on the first read, and read
+from it again every REFRESH_SECONDS, so a change missed by the counters
+(e.g an evicted key) can't keep them wrong.
+"""
+
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from cafebackend.replicas import primary_reads
+from cafecustomer.caching import bump_version, get_version
+from cafecustomer.models import DiningTable, Order, PaymentAttempt
+
+
+# the namespace of every dashboard counter, bumped to forget them all
+DASHBOARD = "dashboard"
+
+# the recent activity reported, kept in buckets of a few seconds
+WINDOW_SECONDS = 15 * 60
+BUCKET_SECONDS = 15
+
+# the orders the average prep time is computed from, by the time they got ready
+PREP_WINDOW_SECONDS = 60 * 60
+
+# how often the metrics are read again from the database
+REFRESH_SECONDS = 5 * 60
+
+# how long the time a pending order was placed at is kept, to time its preparation
+PENDING_SECONDS = 24 * 60 * 60
+
+
+def metric_key(*parts):
+    return ":".join([DASHBOARD, str(get_version(DASHBOARD)), *map(str, parts)])
+
+
+def to_cents(value):
+    return int((Decimal(value) * 100).to_integral_value())
+
+
+def increment(key, delta, timeout=None):
+    """
+    Adds to a counter shared by every process, creating it if needed.
+    """
+    cache.add(key, 0, timeout=timeout)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # evicted in between, the next refresh counts it again
+        pass
+
+
+class SlidingWindow:
+    """
+    Number and sum of the values recorded in the last seconds.
+
+    Values are added to the counters of fixed time buckets, which expire
+    once they leave the window, so recording and reading cost the same
+    however many values were recorded.
+
+    Attributes:
+        name (str): the name of the counters.
+        seconds (int): the length of the window.
+        bucket_seconds (int): the length of a bucket.
+    """
+
+    def __init__(self, name, seconds=WINDOW_SECONDS, bucket_seconds=BUCKET_SECONDS):
+        self.name = name
+        self.seconds = seconds
+        self.bucket_seconds = bucket_seconds
+        self.size = seconds // bucket_seconds
+
+    def current_bucket(self):
+        return int(time.time() // self.bucket_seconds)
+
+    def add(self, value=0, at=None):
+        """
+        Records a value at a time, by default now. Values older than the
+        window are ignored.
+        """
+        now = self.current_bucket()
+        bucket = now if at is None else int(at // self.bucket_seconds)
+
+        if bucket <= now - self.size:
+            return
+
+        prefix = metric_key(self.name, bucket)
+        increment(f"{prefix}:count", 1, timeout=self.seconds + self.bucket_seconds)
+        increment(f"{prefix}:sum", to_cents(value), timeout=self.seconds + self.bucket_seconds)
+
+    def fill(self, values):
+        """
+        Replaces the counters with the values recorded in the window.
+
+        Args:
+            values (list): the (value, timestamp) of every value.
+        """
+        now = self.current_bucket()
+        counts = dict.fromkeys(range(now - self.size + 1, now + 1), 0)
+        sums = dict(counts)
+
+        for value, at in values:
+            bucket = int(at // self.bucket_seconds)
+            if bucket in counts:
+                counts[bucket] += 1
+                sums[bucket] += to_cents(value)
+
+        prefix = metric_key(self.name)
+        counters = {f"{prefix}:{bucket}:count": count for bucket, count in counts.items()}
+        counters.update({f"{prefix}:{bucket}:sum": total for bucket, total in sums.items()})
+        cache.set_many(counters, timeout=self.seconds + self.bucket_seconds)
+
+    def totals(self):
+        """
+        Returns the number and the sum of the values in the window.
+        """
+        now = self.current_bucket()
+        prefix = metric_key(self.name)
+        buckets = range(now - self.size + 1, now + 1)
+        counters = cache.get_many(
+            [f"{prefix}:{bucket}:{counter}" for bucket in buckets for counter in ("count", "sum")]
+        )
+
+        count = sum(counters.get(f"{prefix}:{bucket}:count", 0) for bucket in buckets)
+        total = sum(counters.get(f"{prefix}:{bucket}:sum", 0) for bucket in buckets)
+
+        return count, Decimal(total) / 100
+
+
+class DailyCounter:
+    """
+    Number and sum of the values recorded today, counted per day.
+    """
+
+    # the counters of a day are kept for a while after it
+    TIMEOUT = 2 * 24 * 60 * 60
+
+    def __init__(self, name):
+        self.name = name
+
+    def keys(self, day):
+        prefix = metric_key(self.name, day.isoformat())
+        return f"{prefix}:count", f"{prefix}:sum"
+
+    def add(self, value=0, day=None):
+        count_key, sum_key = self.keys(day or timezone.localdate())
+        increment(count_key, 1, timeout=self.TIMEOUT)
+        increment(sum_key, to_cents(value), timeout=self.TIMEOUT)
+
+    def fill(self, count, total, day=None):
+        count_key, sum_key = self.keys(day or timezone.localdate())
+        cache.set_many({count_key: count, sum_key: to_cents(total)}, timeout=self.TIMEOUT)
+
+    def totals(self):
+        count_key, sum_key = self.keys(timezone.localdate())
+        counters = cache.get_many([count_key, sum_key])
+        return counters.get(count_key, 0), Decimal(counters.get(sum_key, 0)) / 100
+
+
+class Dashboard:
+    """
+    The live metrics shared by every process.
+    """
+
+    def __init__(self):
+        self.recent_orders = SlidingWindow("recent-orders")
+        self.recent_payments = SlidingWindow("recent-payments")
+        self.recent_prep = SlidingWindow("recent-prep", PREP_WINDOW_SECONDS, 60)
+        self.today_orders = DailyCounter("today-orders")
+        self.today_payments = DailyCounter("today-payments")
+
+    def reset(self):
+        """
+        Forgets every metric, they are warmed again on the next read.
+        """
+        bump_version(DASHBOARD)
+
+    @property
+    def warm(self):
+        return cache.get(metric_key("warm")) is not None
+
+    @primary_reads()
+    def warm_up(self):
+        """
+        Loads the metrics from the database, at most every REFRESH_SECONDS.
+
+        Events missed while the metrics were cold are read with the rest.
+        The prep times can't be read back, so they are kept.
+        """
+        now = timezone.now()
+        today = timezone.localdate()
+        window_start = now - timedelta(seconds=WINDOW_SECONDS)
+        day_start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+
+        open_orders = dict(
+            Order.objects.filter(status__in=Order.OPEN_STATUSES)
+            .values_list("status").annotate(count=Count("id")).order_by()
+        )
+        cache.set_many(
+            {metric_key("open", order_status): open_orders.get(order_status, 0) for order_status in Order.OPEN_STATUSES},
+            timeout=None,
+        )
+        cache.set_many(
+            {
+                metric_key("pending", order_id): created_at.timestamp()
+                for order_id, created_at in Order.objects.filter(status="PENDING").values_list("id", "created_at")
+            },
+            timeout=PENDING_SECONDS,
+        )
+
+        tables = dict(DiningTable.objects.values_list("id", "is_occupied"))
+        cache.set_many({metric_key("table", table_id): True for table_id, occupied in tables.items() if occupied}, timeout=None)
+        cache.delete_many([metric_key("table", table_id) for table_id, occupied in tables.items() if not occupied])
+        cache.set(metric_key("occupied"), sum(tables.values()), timeout=None)
+
+        self.recent_orders.fill(
+            (0, created_at.timestamp())
+            for created_at in Order.objects.filter(created_at__gte=window_start).values_list("created_at", flat=True)
+        )
+
+        payments = PaymentAttempt.objects.filter(status=PaymentAttempt.SUCCEEDED)
+        self.recent_payments.fill(
+            (amount, updated_at.timestamp())
+            for amount, updated_at in payments.filter(updated_at__gte=window_start).values_list("amount", "updated_at")
+        )
+
+        self.today_orders.fill(Order.objects.filter(created_at__gte=day_start).count(), 0, today)
+        today_payments = payments.filter(updated_at__gte=day_start).aggregate(count=Count("id"), total=Sum("amount"))
+        self.today_payments.fill(today_payments["count"], today_payments["total"] or 0, today)
+
+        cache.set(metric_key("warm"), True, timeout=REFRESH_SECONDS)
+
+    def order_created(self, order_id, order_status, created_at):
+        if not self.warm:
+            return
+        if order_status in Order.OPEN_STATUSES:
+            increment(metric_key("open", order_status), 1)
+        if order_status == "PENDING":
+            cache.set(metric_key("pending", order_id), created_at.timestamp(), timeout=PENDING_SECONDS)
+        self.recent_orders.add(at=created_at.timestamp())
+        self.today_orders.add(day=timezone.localdate(created_at))
+
+    def orders_moved(self, orders, new_status):
+        """
+        Records orders moved to a new status.
+
+        Args:
+            orders (list): the (id, previous status) of every order.
+            new_status (str): the status the orders moved to.
+        """
+        if not self.warm:
+            return
+
+        now = time.time()
+
+        for order_id, previous_status in orders:
+            if previous_status in Order.OPEN_STATUSES:
+                increment(metric_key("open", previous_status), -1)
+            if new_status in Order.OPEN_STATUSES:
+                increment(metric_key("open", new_status), 1)
+
+            if previous_status == "PENDING":
+                key = metric_key("pending", order_id)
+                placed_at = cache.get(key)
+
+                # only the process removing the order times it
+                if placed_at is not None and cache.delete(key):
+                    self.recent_prep.add(now - placed_at)
+
+    def order_deleted(self, order_id, order_status):
+        if not self.warm:
+            return
+        if order_status in Order.OPEN_STATUSES:
+            increment(metric_key("open", order_status), -1)
+        cache.delete(metric_key("pending", order_id))
+
+    def orders_paid(self, amounts):
+        """
+        Records payments.
+
+        Args:
+            amounts (list): the amount of every paid order.
+        """
+        if not self.warm:
+            return
+        for amount in amounts:
+            self.recent_payments.add(amount)
+            self.today_payments.add(amount)
+
+    def table_changed(self, table_id, occupied):
+        if not self.warm:
+            return
+
+        # a table is counted once however often it is saved
+        key = metric_key("table", table_id)
+        if occupied and cache.add(key, True, timeout=None):
+            increment(metric_key("occupied"), 1)
+        elif not occupied and cache.delete(key):
+            increment(metric_key("occupied"), -1)
+
+    def snapshot(self):
+        """
+        Returns the current metrics, warming them up when they are cold.
+        """
+        if not self.warm:
+            self.warm_up()
+
+        open_orders = cache.get_many([metric_key("open", order_status) for order_status in Order.OPEN_STATUSES])
+        recent_orders, _ = self.recent_orders.totals()
+        recent_paid, recent_revenue = self.recent_payments.totals()
+        today_orders, _ = self.today_orders.totals()
+        today_paid, today_revenue = self.today_payments.totals()
+        prepared, prep_seconds = self.recent_prep.totals()
+
+        return {
+            "open_orders": {
+                # a race with a refresh can leave a counter below 0 until the next one
+                order_status: max(open_orders.get(metric_key("open", order_status), 0), 0)
+                for order_status in Order.OPEN_STATUSES
+            },
+            "last_15_minutes": {
+                "orders": recent_orders,
+                "paid_orders": recent_paid,
+                "revenue": recent_revenue.quantize(Decimal("0.01")),
+            },
+            "today": {
+                "orders": today_orders,
+                "paid_orders": today_paid,
+                "revenue": today_revenue.quantize(Decimal("0.01")),
+            },
+            "occupied_tables": max(cache.get(metric_key("occupied"), 0), 0),
+            "average_prep_seconds": round(prep_seconds / prepared) if prepared else None,
+        }
+
+
+dashboard = Dashboard()
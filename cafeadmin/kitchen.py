@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from cafecustomer.models import Order
+from cafecustomer.serializers import OrderSerializer
+from cafecustomer.signals import order_status_changed
+
+
+# the number of orders listed per status by default and at most
+QUEUE_LIMIT = 50
+MAX_QUEUE_LIMIT = 200
+
+# the statuses the kitchen is still working on, every order of them is counted
+ACTIVE_STATUSES = ("PENDING", "READY")
+
+# orders of the other statuses (e.g DELIVERED) pile up, only the ones placed
+# this recently are counted
+COUNT_WINDOW = timedelta(hours=24)
+
+
+def order_queue(statuses=Order.OPEN_STATUSES, limit=QUEUE_LIMIT):
+    """
+    Lists the oldest orders of each status.
+
+    Every status is read with its own range scan of the (status, created_at)
+    index, so the cost depends on the limit and not on the number of orders.
+    The counts of the statuses past ACTIVE_STATUSES only cover the orders
+    placed in the last COUNT_WINDOW, a range of the same index.
+
+    Args:
+        statuses (tuple): the statuses to list.
+        limit (int): the number of orders listed per status.
+
+    Returns:
+        dict: the serialized orders, the number of orders per status and
+        the start of the count window.
+    """
+    orders = []
+    for order_status in statuses:
+        orders.extend(
+            Order.objects.filter(status=order_status).order_by("created_at", "id")
+            .values_list("id", flat=True)[:limit]
+        )
+
+    # the lines of every listed order are fetched at once
+    found = OrderSerializer.setup_eager_loading(Order.objects.filter(id__in=orders)).in_bulk()
+    serialized = OrderSerializer([found[order_id] for order_id in orders if order_id in found], many=True).data
+
+    counted_since = timezone.now() - COUNT_WINDOW
+    active = [order_status for order_status in statuses if order_status in ACTIVE_STATUSES]
+    piling_up = [order_status for order_status in statuses if order_status not in ACTIVE_STATUSES]
+
+    counts = dict(
+        Order.objects.filter(Q(status__in=active) | Q(status__in=piling_up, created_at__gte=counted_since))
+        .values("status").annotate(count=Count("id"))
+        .values_list("status", "count").order_by()
+    )
+
+    queue = {order_status: [] for order_status in statuses}
+    for order in serialized:
+        queue[order["status"]].append(order)
+
+    return {
+        "orders": queue,
+        "counts": {order_status: counts.get(order_status, 0) for order_status in statuses},
+        "counted_since": counted_since,
+    }
+
+
+def transition_orders(order_ids, new_status):
+    """
+    Moves orders to a new status in one conditional update.
+
+    Only orders whose current status allows moving to the new status are
+    updated, the others are reported back.
+
+    Args:
+        order_ids (list): the ids of the orders.
+        new_status (str): the status to move the orders to.
+
+    Returns:
+        tuple: the ids of the updated orders, and the id and reason of
+        every order that was not updated.
+    """
+    sources = [
+        order_status for order_status, targets in Order.STATUS_TRANSITIONS.items()
+        if new_status in targets
+    ]
+
+    with transaction.atomic():
+        current = dict(
+            Order.objects.select_for_update().filter(id__in=order_ids).values_list("id", "status")
+        )
+        eligible = [order_id for order_id, order_status in current.items() if order_status in sources]
+
+        if eligible:
+            Order.objects.filter(id__in=eligible, status__in=sources).update(
+                status=new_status, updated_at=timezone.now()
+            )
+            order_status_changed.send(
+                sender=Order,
+                orders=[(order_id, current[order_id]) for order_id in eligible],
+                status=new_status,
+            )
+
+    rejected = []
+    for order_id in dict.fromkeys(order_ids):
+        if order_id not in current:
+            rejected.append({"id": order_id, "detail": "Order not found."})
+        elif order_id not in eligible:
+            rejected.append({
+                "id": order_id,
+                "detail": f"Cannot move an order from {current[order_id]} to {new_status}.",
+            })
+
+    return eligible, rejected
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from cafeadmin.menuio import CSV, FORMATS, export_fooditems
+
+
+class Command(BaseCommand):
+    """
+    Exports every fooditem as CSV or JSON lines.
+    """
+
+    help = "Writes every fooditem to a CSV or JSON lines file, or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="Defaults to stdout.")
+        parser.add_argument("--file-format", choices=FORMATS, default=CSV)
+
+    def handle(self, *args, **options):
+        if options["path"] is None:
+            self.write(sys.stdout, options["file_format"])
+            return
+
+        with open(options["path"], "w", encoding="utf-8", newline="") as stream:
+            self.write(stream, options["file_format"])
+
+    def write(self, stream, file_format):
+        for chunk in export_fooditems(file_format):
+            stream.write(chunk)
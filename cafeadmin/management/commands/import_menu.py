@@ -0,0 +1,35 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cafeadmin.menuio import FORMATS, MenuImportError, import_fooditems
+
+
+class Command(BaseCommand):
+    """
+    Imports fooditems from a CSV or JSON lines file, nothing is imported
+    if any row is invalid.
+    """
+
+    help = "Creates or updates fooditems from a CSV or JSON lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--file-format", choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument("--create-categories", action="store_true", help="Create the missing categories.")
+
+    def handle(self, *args, **options):
+        file_format = options["file_format"] or os.path.splitext(options["path"])[1].lstrip(".").lower()
+
+        if file_format not in FORMATS:
+            raise CommandError("The file format must be csv or jsonl.")
+
+        try:
+            with open(options["path"], "rb") as stream:
+                result = import_fooditems(stream, file_format, create_categories=options["create_categories"])
+        except MenuImportError as exc:
+            for error in exc.errors:
+                self.stderr.write(f"line {error['line']}: {error['errors']}")
+            raise CommandError("No fooditems were imported.")
+
+        self.stdout.write(self.style.SUCCESS(f"Created {result['created']} and updated {result['updated']} fooditems."))
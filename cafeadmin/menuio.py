@@ -0,0 +1,220 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from cafecustomer.caching import MENU, REDEMPTIONS, bump_version
+from cafecustomer.models import Cart, Category, FoodItem
+from cafecustomer.pricing import expire_cart_totals
+from cafecustomer.search import SEARCH
+from cafecustomer.serializers import FoodItemImportSerializer
+
+
+CSV = "csv"
+JSONL = "jsonl"
+FORMATS = (CSV, JSONL)
+
+FIELDS = ["name", "category", "price", "description", "is_available"]
+
+# rows validated and written per batch
+CHUNK_SIZE = 500
+
+# stops collecting errors past this many, the import is rejected anyway
+MAX_ERRORS = 100
+
+
+class MenuImportError(Exception):
+    """
+    Raised when a menu import contains invalid rows, nothing is written.
+
+    Attributes:
+        errors (list): the line number and errors of every invalid row.
+    """
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid rows.")
+        self.errors = errors
+
+
+def read_rows(stream, format):
+    """
+    Lazily reads the rows of a CSV or JSON lines stream.
+
+    Args:
+        stream (file): a binary file-like object.
+        format (str): "csv" or "jsonl".
+
+    Yields:
+        tuple: the line number and the row as a dict, or None if it can't be parsed.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+    if format == CSV:
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most `size` items.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def import_fooditems(stream, format, create_categories=False):
+    """
+    Imports fooditems from a CSV or JSON lines stream.
+
+    Rows are validated and written in chunks with bulk_create/bulk_update
+    inside a single transaction, fooditems are matched by name and the
+    categories are resolved by name once for the whole import.
+
+    Args:
+        stream (file): a binary file-like object.
+        format (str): "csv" or "jsonl".
+        create_categories (bool): creates the categories that don't exist
+            instead of rejecting their rows.
+
+    Raises:
+        MenuImportError: if any row is invalid, nothing is imported.
+
+    Returns:
+        dict: the number of fooditems created and updated.
+    """
+    categories = {category.name.lower(): category for category in Category.objects.all()}
+    seen = set()
+    errors = []
+    created = updated = 0
+    updated_ids = []
+
+    with transaction.atomic():
+        for chunk in chunked(read_rows(stream, format), CHUNK_SIZE):
+            rows = []
+
+            for line_number, row in chunk:
+                if row is None:
+                    errors.append({"line": line_number, "errors": {"row": ["Invalid row."]}})
+                    continue
+
+                serializer = FoodItemImportSerializer(data=row)
+
+                if not serializer.is_valid():
+                    errors.append({"line": line_number, "errors": serializer.errors})
+                    continue
+
+                data = serializer.validated_data
+                category_key = data["category"].strip().lower()
+
+                if category_key not in categories:
+                    if not create_categories:
+                        errors.append({"line": line_number, "errors": {"category": ["Category not found."]}})
+                        continue
+                    categories[category_key] = Category.objects.create(name=data["category"].strip(), description="")
+
+                if data["name"] in seen:
+                    errors.append({"line": line_number, "errors": {"name": ["Duplicate fooditem in import."]}})
+                    continue
+
+                seen.add(data["name"])
+                rows.append((data, categories[category_key]))
+
+            if len(errors) >= MAX_ERRORS:
+                break
+
+            if errors:
+                # keeps validating to report every error, nothing will be written
+                continue
+
+            existing = FoodItem.objects.in_bulk([data["name"] for data, _ in rows], field_name="name")
+            now = timezone.now()
+            to_create = []
+            to_update = []
+
+            for data, category in rows:
+                fooditem = existing.get(data["name"])
+
+                if fooditem is None:
+                    to_create.append(FoodItem(
+                        category=category,
+                        name=data["name"],
+                        price=data["price"],
+                        description=data["description"],
+                        is_available=data["is_available"],
+                    ))
+                    continue
+
+                fooditem.category = category
+                fooditem.price = data["price"]
+                fooditem.description = data["description"]
+                fooditem.is_available = data["is_available"]
+                fooditem.updated_at = now
+                to_update.append(fooditem)
+
+            FoodItem.objects.bulk_create(to_create)
+            FoodItem.objects.bulk_update(to_update, ["category", "price", "description", "is_available", "updated_at"])
+
+            created += len(to_create)
+            updated += len(to_update)
+            updated_ids.extend(fooditem.id for fooditem in to_update)
+
+        if errors:
+            transaction.set_rollback(True)
+            raise MenuImportError(errors[:MAX_ERRORS])
+
+        # bulk writes skip the model signals, so their side effects are applied here
+        for ids in chunked(updated_ids, CHUNK_SIZE):
+            expire_cart_totals(Cart.objects.filter(cartitems__fooditem_id__in=ids))
+
+        transaction.on_commit(lambda: (bump_version(MENU), bump_version(REDEMPTIONS), bump_version(SEARCH)))
+
+    return {"created": created, "updated": updated}
+
+
+class Echo:
+    """
+    A file-like object handing back what is written to it, used to stream CSV rows.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_fooditems(format):
+    """
+    Streams every fooditem as CSV or JSON lines.
+
+    Args:
+        format (str): "csv" or "jsonl".
+
+    Yields:
+        str: the serialized rows.
+    """
+    fooditems = FoodItem.objects.select_related("category").order_by("name").iterator(chunk_size=CHUNK_SIZE)
+
+    if format == CSV:
+        writer = csv.writer(Echo())
+        yield writer.writerow(FIELDS)
+
+    for fooditem in fooditems:
+        row = [fooditem.name, fooditem.category.name, str(fooditem.price), fooditem.description, fooditem.is_available]
+
+        if format == CSV:
+            yield writer.writerow(row)
+        else:
+            yield json.dumps(dict(zip(FIELDS, row))) + "\n"
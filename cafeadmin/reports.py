@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.db.models import Max, Sum
+
+from cafecustomer.models import SalesRollup
+
+
+# the number of fooditems, categories or tables listed by default and at most
+REPORT_LIMIT = 50
+MAX_REPORT_LIMIT = 500
+
+# the number of days reported when no range is given
+DEFAULT_REPORT_DAYS = 30
+
+
+def average_ticket(revenue, order_count):
+    if not order_count:
+        return Decimal("0.00")
+    return (revenue / order_count).quantize(Decimal("0.01"))
+
+
+def summarize(row):
+    return {
+        **row,
+        "average_ticket": average_ticket(row["revenue"], row["order_count"]),
+    }
+
+
+def sales_report(dimension, start, end, limit=REPORT_LIMIT):
+    """
+    Reports the sales between two days from the rollups only.
+
+    Every dimension is read with a range scan of the (dimension, day, key)
+    index, so the cost depends on the number of days and keys and not on
+    the number of orders.
+
+    Args:
+        dimension (str): SalesRollup.TOTAL for the daily totals, or the
+            dimension the sales are grouped by.
+        start (date): the first day reported.
+        end (date): the last day reported.
+        limit (int): the number of best selling keys listed.
+
+    Returns:
+        dict: the sales of the whole range and per day or key.
+    """
+    rows = SalesRollup.objects.filter(dimension=dimension, day__range=(start, end))
+    totals = SalesRollup.objects.filter(dimension=SalesRollup.TOTAL, day__range=(start, end)).aggregate(
+        revenue=Sum("revenue"), order_count=Sum("order_count"), quantity=Sum("quantity"),
+    )
+    totals = {
+        "revenue": totals["revenue"] or Decimal("0.00"),
+        "order_count": totals["order_count"] or 0,
+        "quantity": totals["quantity"] or 0,
+    }
+
+    if dimension == SalesRollup.TOTAL:
+        results = rows.order_by("day").values("day", "revenue", "order_count", "quantity")
+    else:
+        results = (
+            rows.values("key")
+            .annotate(
+                label=Max("label"),
+                revenue=Sum("revenue"),
+                order_count=Sum("order_count"),
+                quantity=Sum("quantity"),
+            )
+            .order_by("-revenue", "key")[:limit]
+        )
+
+    return {
+        "dimension": dimension,
+        "start": start,
+        "end": end,
+        "totals": summarize(totals),
+        "results": [summarize(row) for row in results],
+    }
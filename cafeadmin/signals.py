@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from cafecustomer.models import DiningTable, Order
+from cafecustomer.signals import order_paid, order_status_changed, table_occupancy_changed
+from .dashboard import dashboard
+
+
+@receiver(post_save, sender=Order)
+def track_new_order(sender, instance, created, **kwargs):
+    """
+    Signal to count a new order in the dashboard metrics.
+    """
+    if created:
+        transaction.on_commit(lambda: dashboard.order_created(instance.id, instance.status, instance.created_at))
+
+
+@receiver(post_delete, sender=Order)
+def track_deleted_order(sender, instance, **kwargs):
+    """
+    Signal to remove a deleted order from the dashboard metrics.
+    """
+    transaction.on_commit(lambda: dashboard.order_deleted(instance.id, instance.status))
+
+
+@receiver(order_status_changed)
+def track_order_status(sender, orders, status, **kwargs):
+    """
+    Signal to move orders between statuses in the dashboard metrics.
+    """
+    transaction.on_commit(lambda: dashboard.orders_moved(orders, status))
+
+
+@receiver(order_paid)
+def track_payments(sender, orders, **kwargs):
+    """
+    Signal to add payments to the dashboard metrics.
+    """
+    transaction.on_commit(lambda: dashboard.orders_paid([total_price for _, total_price in orders]))
+
+
+@receiver(post_save, sender=DiningTable)
+def track_table(sender, instance, **kwargs):
+    """
+    Signal to count the occupied tables in the dashboard metrics.
+    """
+    transaction.on_commit(lambda: dashboard.table_changed(instance.id, instance.is_occupied))
+
+
+@receiver(post_delete, sender=DiningTable)
+def untrack_table(sender, instance, **kwargs):
+    transaction.on_commit(lambda: dashboard.table_changed(instance.id, False))
+
+
+@receiver(table_occupancy_changed)
+def track_claimed_tables(sender, tables, **kwargs):
+    """
+    Signal to count the tables claimed or released in the dashboard metrics.
+    """
+    def apply():
+        for table_id, occupied in tables:
+            dashboard.table_changed(table_id, occupied)
+
+    transaction.on_commit(apply)
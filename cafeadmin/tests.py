@@ -1,3 +1,527 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from unittest.mock import ANY
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from cafecustomer.caching import MENU, REDEMPTIONS, get_version
+from cafecustomer.models import (
+    Category, DiningTable, FoodItem, Order, OrderLine, PaymentAttempt, SalesRollup,
+    UserDinningTable,
+)
+from cafecustomer.outbox import ORDER_PAID, drain_outbox, record_event
+from cafecustomer.rollups import rollup_orders
+from cafecustomer.signals import order_status_changed
+from cafecustomer.tables import claim_table
+
+from .dashboard import Dashboard, SlidingWindow, dashboard, metric_key
+
+User = get_user_model()
+
+
+class AdminTestMixin:
+    """
+    Helpers for building menu fixtures as an authenticated admin.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username="admin", password="adminpass", role="admin")
+        self.client.force_authenticate(user=self.admin)
+
+    def create_menu(self, categories=1, fooditems=1):
+        created = []
+        for c in range(categories):
+            category = Category.objects.create(name=f"Category {Category.objects.count()}", description="test")
+            for f in range(fooditems):
+                created.append(FoodItem.objects.create(
+                    category=category,
+                    name=f"Food {FoodItem.objects.count()}",
+                    price=Decimal("100.00"),
+                    description="test",
+                ))
+        return created
+
+
+class MenuSnapshotTests(AdminTestMixin, APITestCase):
+
+    def test_conditional_get_returns_304_without_queries(self):
+        self.create_menu(fooditems=3)
+
+        response = self.client.get(reverse("fooditems"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("fooditems"), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_payload_is_cached_per_version(self):
+        fooditem, = self.create_menu()
+        url = reverse("list-fooditem", kwargs={"category_id": fooditem.category_id})
+
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_menu_writes_change_the_etag(self):
+        fooditem, = self.create_menu()
+
+        etag = self.client.get(reverse("fooditems"))["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            fooditem.name = "Renamed"
+            fooditem.save()
+
+        response = self.client.get(reverse("fooditems"), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["results"][0]["name"], "Renamed")
+
+    def test_rolled_back_menu_writes_keep_the_etag(self):
+        fooditem, = self.create_menu()
+        menu_version = get_version(MENU)
+
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            fooditem.name = "Renamed"
+            fooditem.save()
+            transaction.set_rollback(True)
+
+        self.assertEqual(get_version(MENU), menu_version)
+
+
+class MenuQueryCountTests(AdminTestMixin, APITestCase):
+
+    def count_queries(self, url):
+        # bypasses the menu cache so the full listing is built every time
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_fooditem_listing_queries_are_constant(self):
+        self.create_menu(categories=1, fooditems=1)
+        small_menu = self.count_queries(reverse("fooditems"))
+
+        self.create_menu(categories=5, fooditems=10)
+        large_menu = self.count_queries(reverse("fooditems"))
+
+        self.assertEqual(small_menu, large_menu)
+
+    def test_category_fooditem_listing_queries_are_constant(self):
+        fooditem, = self.create_menu(categories=1, fooditems=1)
+        url = reverse("list-fooditem", kwargs={"category_id": fooditem.category_id})
+        small_menu = self.count_queries(url)
+
+        for i in range(20):
+            FoodItem.objects.create(category=fooditem.category, name=f"Extra {i}", price=Decimal("10.00"), description="")
+        large_menu = self.count_queries(url)
+
+        self.assertEqual(small_menu, large_menu)
+
+
+class CategorySearchTests(AdminTestMixin, APITestCase):
+
+    def test_search_ranks_categories_from_the_index(self):
+        Category.objects.create(name="Breakfast", description="Morning meals")
+        Category.objects.create(name="Bread and Pastries", description="Baked daily")
+
+        response = self.client.get(reverse("category-list-create"), {"name": "brea"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([category["name"] for category in response.data["results"]], ["Bread and Pastries", "Breakfast"])
+
+        response = self.client.get(reverse("category-list-create"), {"name": "soups"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MenuImportExportTests(AdminTestMixin, APITestCase):
+
+    def upload(self, name, rows, **data):
+        upload = SimpleUploadedFile(name, "\n".join(rows).encode())
+        return self.client.post(reverse("fooditem-import"), {"file": upload, **data}, format="multipart")
+
+    def test_csv_import_creates_and_updates_fooditems(self):
+        fooditem, = self.create_menu()
+        category = fooditem.category
+        menu_version = get_version(MENU)
+        redemptions_version = get_version(REDEMPTIONS)
+
+        rows = ["name,category,price,description,is_available", f"{fooditem.name},{category.name},150.00,updated,true"]
+        rows += [f"Imported {i},{category.name},{i}.50,new,false" for i in range(20)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.upload("menu.csv", rows)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"created": 20, "updated": 1})
+        fooditem.refresh_from_db()
+        self.assertEqual(fooditem.price, Decimal("150.00"))
+        self.assertTrue(fooditem.is_available)
+        self.assertEqual(FoodItem.objects.filter(category=category).count(), 21)
+        self.assertNotEqual(get_version(MENU), menu_version)
+        self.assertNotEqual(get_version(REDEMPTIONS), redemptions_version)
+
+    def test_import_queries_do_not_grow_with_rows(self):
+        category = Category.objects.create(name="Mains", description="test")
+
+        def import_rows(count, offset):
+            rows = ['{"name": "%s", "category": "Mains", "price": "10.00"}' % f"Food {offset + i}" for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.upload("menu.jsonl", rows)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        self.assertEqual(import_rows(3, 0), import_rows(60, 100))
+        self.assertEqual(FoodItem.objects.filter(category=category).count(), 63)
+
+    def test_invalid_rows_reject_the_whole_import(self):
+        Category.objects.create(name="Mains", description="test")
+
+        rows = [
+            "name,category,price",
+            "Soup,Mains,10.00",
+            "Stew,Unknown,12.00",
+            "Salad,Mains,not-a-price",
+        ]
+        response = self.upload("menu.csv", rows)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error["line"] for error in response.data["errors"]], [3, 4])
+        self.assertFalse(FoodItem.objects.exists())
+
+    def test_missing_categories_can_be_created(self):
+        response = self.upload("menu.csv", ["name,category,price", "Soup,Starters,10.00"], create_categories="true")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(FoodItem.objects.filter(name="Soup", category__name="Starters").exists())
+
+    def test_export_streams_every_fooditem(self):
+        self.create_menu(categories=2, fooditems=2)
+
+        response = self.client.get(reverse("fooditem-export"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "name,category,price,description,is_available")
+        self.assertEqual(len(lines), 5)
+
+        response = self.client.get(reverse("fooditem-export"), {"file_format": "jsonl"})
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual({row["name"] for row in rows}, set(FoodItem.objects.values_list("name", flat=True)))
+
+
+class KitchenQueueTests(AdminTestMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+
+    def create_orders(self, count, order_status="PENDING"):
+        return [
+            Order.objects.create(user=self.customer, total_price=Decimal("100.00"), status=order_status)
+            for i in range(count)
+        ]
+
+    def test_queue_lists_open_orders_oldest_first(self):
+        pending = self.create_orders(3)
+        ready = self.create_orders(1, "READY")
+        self.create_orders(2, "COMPLETE")
+
+        response = self.client.get(reverse("kitchen-queue"), {"limit": 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([order["id"] for order in response.data["orders"]["PENDING"]], [str(order.id) for order in pending[:2]])
+        self.assertEqual([order["id"] for order in response.data["orders"]["READY"]], [str(ready[0].id)])
+        self.assertEqual(response.data["counts"], {"PENDING": 3, "READY": 1, "DELIVERED": 0})
+
+    def test_piling_up_statuses_are_counted_over_a_recent_window(self):
+        old_delivered = self.create_orders(2, "DELIVERED")
+        self.create_orders(1, "DELIVERED")
+        old_pending = self.create_orders(1)
+        Order.objects.filter(id__in=[order.id for order in old_delivered + old_pending]).update(
+            created_at=timezone.now() - timedelta(days=3)
+        )
+
+        response = self.client.get(reverse("kitchen-queue"))
+
+        self.assertEqual(response.data["counts"], {"PENDING": 1, "READY": 0, "DELIVERED": 1})
+        # the queue itself still lists them
+        self.assertEqual(len(response.data["orders"]["DELIVERED"]), 3)
+
+    def test_queue_queries_do_not_grow_with_orders(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse("kitchen-queue"))
+            return len(queries)
+
+        self.create_orders(2)
+        few_orders = count_queries()
+        self.create_orders(30)
+        self.create_orders(30, "READY")
+
+        self.assertEqual(few_orders, count_queries())
+
+    def test_bulk_transition_follows_the_state_machine(self):
+        pending = self.create_orders(2)
+        delivered, = self.create_orders(1, "DELIVERED")
+        received = []
+
+        def receiver(sender, orders, status, **kwargs):
+            received.append((orders, status))
+
+        order_status_changed.connect(receiver)
+        self.addCleanup(order_status_changed.disconnect, receiver)
+
+        response = self.client.post(
+            reverse("kitchen-transition"),
+            {"orders": [str(order.id) for order in pending + [delivered]], "status": "READY"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data["updated"]), {order.id for order in pending})
+        self.assertEqual([order["id"] for order in response.data["rejected"]], [delivered.id])
+        self.assertEqual(Order.objects.filter(status="READY").count(), 2)
+        self.assertEqual(received, [(ANY, "READY")])
+        self.assertEqual(sorted(received[0][0]), sorted((order.id, "PENDING") for order in pending))
+
+        # orders can't skip a status
+        response = self.client.post(
+            reverse("kitchen-transition"), {"orders": [str(pending[0].id)], "status": "COMPLETE"}, format="json"
+        )
+        self.assertEqual(response.data["updated"], [])
+        self.assertEqual(Order.objects.get(id=pending[0].id).status, "READY")
+
+    def test_transition_validates_the_status(self):
+        order, = self.create_orders(1)
+
+        response = self.client.post(
+            reverse("kitchen-transition"), {"orders": [str(order.id)], "status": "COOKING"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SalesReportTests(AdminTestMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.burger, self.fries, self.soda = self.create_menu(categories=1, fooditems=3)
+        self.table = DiningTable.objects.create(table_number=7)
+
+    def create_paid_order(self, lines, table=None, days_ago=0):
+        order = Order.objects.create(
+            user=self.customer,
+            total_price=sum(fooditem.price * quantity for fooditem, quantity in lines),
+            dining_table=table,
+            is_paid=True,
+        )
+        Order.objects.filter(id=order.id).update(created_at=order.created_at - timedelta(days=days_ago))
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, fooditem=fooditem, name=fooditem.name, unit_price=fooditem.price,
+                      quantity=quantity, line_total=fooditem.price * quantity)
+            for fooditem, quantity in lines
+        )
+        return order
+
+    def report(self, **params):
+        return self.client.get(reverse("sales-report"), params)
+
+    def test_paid_orders_are_rolled_up_from_the_outbox(self):
+        order = self.create_paid_order([(self.burger, 2), (self.fries, 1)], table=self.table)
+        record_event(ORDER_PAID, {"order": order.id, "user": self.customer.id, "total_price": order.total_price})
+
+        drain_outbox()
+        # a replayed event doesn't count the order twice
+        record_event(ORDER_PAID, {"order": order.id, "user": self.customer.id, "total_price": order.total_price})
+        drain_outbox()
+
+        rollups = {
+            (rollup.dimension, rollup.key): (rollup.revenue, rollup.order_count, rollup.quantity)
+            for rollup in SalesRollup.objects.all()
+        }
+        self.assertEqual(rollups, {
+            (SalesRollup.TOTAL, ""): (Decimal("300.00"), 1, 3),
+            (SalesRollup.TABLE, str(self.table.id)): (Decimal("300.00"), 1, 3),
+            (SalesRollup.FOODITEM, str(self.burger.id)): (Decimal("200.00"), 1, 2),
+            (SalesRollup.FOODITEM, str(self.fries.id)): (Decimal("100.00"), 1, 1),
+            (SalesRollup.CATEGORY, str(self.burger.category_id)): (Decimal("300.00"), 1, 3),
+        })
+
+    def test_backfill_is_resumable(self):
+        orders = [self.create_paid_order([(self.soda, 1)], days_ago=i % 3) for i in range(5)]
+        Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+        # an interrupted backfill already rolled up the first orders
+        rollup_orders([orders[0].id, orders[1].id])
+
+        call_command("backfill_sales_rollups", "--chunk-size", "2", stdout=StringIO())
+
+        self.assertEqual(Order.objects.filter(is_paid=True, rolled_up=False).count(), 0)
+        totals = SalesRollup.objects.filter(dimension=SalesRollup.TOTAL)
+        self.assertEqual(totals.count(), 3)
+        self.assertEqual(sum(rollup.order_count for rollup in totals), 5)
+
+        call_command("backfill_sales_rollups", "--rebuild", stdout=StringIO())
+        self.assertEqual(sum(rollup.order_count for rollup in totals.all()), 5)
+
+    def test_report_reads_only_the_rollups(self):
+        self.create_paid_order([(self.burger, 1)], table=self.table)
+        self.create_paid_order([(self.burger, 1), (self.soda, 3)], days_ago=1)
+        self.create_paid_order([(self.fries, 1)], days_ago=40)
+        call_command("backfill_sales_rollups", stdout=StringIO())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.report()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if "cafecustomer_order" in query["sql"]])
+        self.assertEqual(response.data["totals"], {
+            "revenue": Decimal("500.00"), "order_count": 2, "quantity": 5, "average_ticket": Decimal("250.00"),
+        })
+        self.assertEqual([row["order_count"] for row in response.data["results"]], [1, 1])
+
+        response = self.report(dimension="fooditem")
+        self.assertEqual(
+            [(row["label"], row["revenue"], row["order_count"]) for row in response.data["results"]],
+            [(self.soda.name, Decimal("300.00"), 1), (self.burger.name, Decimal("200.00"), 2)],
+        )
+
+        today = timezone.localdate()
+        response = self.report(dimension="table", start=today.isoformat(), end=today.isoformat())
+        self.assertEqual([row["label"] for row in response.data["results"]], ["Table 7"])
+
+    def test_report_rejects_invalid_parameters(self):
+        self.assertEqual(self.report(dimension="user").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.report(start="yesterday").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.report(start="2024-02-10", end="2024-02-01").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class DashboardTests(AdminTestMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        dashboard.reset()
+        self.addCleanup(dashboard.reset)
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+
+    def metrics(self):
+        response = self.client.get(reverse("admin-home"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["metrics"]
+
+    def test_metrics_are_warmed_from_the_database(self):
+        Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+        Order.objects.create(user=self.customer, total_price=Decimal("100.00"), status="READY")
+        paid = Order.objects.create(user=self.customer, total_price=Decimal("150.00"), status="COMPLETE", is_paid=True)
+        PaymentAttempt.objects.create(order=paid, amount=paid.total_price, status=PaymentAttempt.SUCCEEDED)
+        DiningTable.objects.create(table_number=1, is_occupied=True)
+        DiningTable.objects.create(table_number=2)
+
+        metrics = self.metrics()
+
+        self.assertEqual(metrics["open_orders"], {"PENDING": 1, "READY": 1, "DELIVERED": 0})
+        self.assertEqual(metrics["last_15_minutes"], {"orders": 3, "paid_orders": 1, "revenue": Decimal("150.00")})
+        self.assertEqual(metrics["today"], {"orders": 3, "paid_orders": 1, "revenue": Decimal("150.00")})
+        self.assertEqual(metrics["occupied_tables"], 1)
+        self.assertIsNone(metrics["average_prep_seconds"])
+
+    def test_metrics_follow_order_events_without_querying_orders(self):
+        self.metrics()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.customer, total_price=Decimal("200.00"))
+            DiningTable.objects.create(table_number=3, is_occupied=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            order_status_changed.send(sender=Order, orders=[(order.id, "PENDING")], status="READY")
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.filter(id=order.id).update(is_paid=True)
+            record_event(ORDER_PAID, {"order": order.id, "user": self.customer.id, "total_price": order.total_price})
+            drain_outbox()
+
+        with CaptureQueriesContext(connection) as queries:
+            metrics = self.metrics()
+
+        self.assertFalse([query for query in queries if "cafecustomer_" in query["sql"]])
+        self.assertEqual(metrics["open_orders"], {"PENDING": 0, "READY": 1, "DELIVERED": 0})
+        self.assertEqual(metrics["last_15_minutes"], {"orders": 1, "paid_orders": 1, "revenue": Decimal("200.00")})
+        self.assertEqual(metrics["today"]["revenue"], Decimal("200.00"))
+        self.assertEqual(metrics["occupied_tables"], 1)
+        self.assertEqual(metrics["average_prep_seconds"], 0)
+
+    def test_metrics_are_shared_by_every_process(self):
+        self.metrics()
+        # e.g the worker serving the kitchen, or the drain_outbox command
+        other_process = Dashboard()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.customer, total_price=Decimal("120.00"))
+        other_process.orders_moved([(order.id, "PENDING")], "READY")
+        other_process.orders_paid([Decimal("120.00")])
+
+        metrics = self.metrics()
+
+        self.assertEqual(metrics["open_orders"], {"PENDING": 0, "READY": 1, "DELIVERED": 0})
+        self.assertEqual(metrics["today"], {"orders": 1, "paid_orders": 1, "revenue": Decimal("120.00")})
+        self.assertEqual(metrics["average_prep_seconds"], 0)
+
+    def test_metrics_are_read_again_from_the_database(self):
+        self.metrics()
+
+        # a change the counters missed
+        Order.objects.bulk_create([Order(user=self.customer, total_price=Decimal("100.00"), status="READY")])
+        self.assertEqual(self.metrics()["open_orders"]["READY"], 0)
+
+        # the refresh interval ran out
+        cache.delete(metric_key("warm"))
+        self.assertEqual(self.metrics()["open_orders"]["READY"], 1)
+
+    def test_sliding_window_forgets_old_values(self):
+        window = SlidingWindow("test", seconds=60, bucket_seconds=10)
+
+        with mock.patch("cafeadmin.dashboard.time.time", return_value=1000.0):
+            window.add(5)
+            window.add(7, at=955.0)
+            window.add(9, at=900.0)
+            self.assertEqual(window.totals(), (2, Decimal("12")))
+
+        with mock.patch("cafeadmin.dashboard.time.time", return_value=1055.0):
+            window.add(1)
+            self.assertEqual(window.totals(), (2, Decimal("6")))
+
+    def test_occupied_tables_follow_claims_and_host_releases(self):
+        table = DiningTable.objects.create(table_number=5)
+        self.metrics()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            claim_table(self.customer, table.id)
+        self.assertEqual(self.metrics()["occupied_tables"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("dinningtable-release", kwargs={"pk": table.id}))
+
+        self.assertEqual(response.data["released"], True)
+        self.assertFalse(UserDinningTable.objects.filter(dinning_table=table).exists())
+        self.assertEqual(self.metrics()["occupied_tables"], 0)
@@ -3,7 +3,9 @@ from django.urls import path
 from .views import (AdminHome, ListCreateCategory, DetailUpdateDeleteCategory,
                     FoodItemCreateView, FoodItemListView, FoodItemDetailView,
                     DinningTableViewSet, SpecialOfferListCreateAPIView,SpecialOfferRetrieveUpdateDestroyAPIView,
-                    FoodItemListAllView,
+                    FoodItemListAllView, FoodItemImportView, FoodItemExportView,
+                    KitchenQueueView, KitchenTransitionView, kitchen_events,
+                    SalesReportView,
                     )
 
 # defines the router and registers th viewset
@@ -18,8 +20,14 @@ urlpatterns = [
     path("categories/<uuid:category_id>/fooditems/", FoodItemListView.as_view(), name="list-fooditem"),
     path("fooditem/<uuid:fooditem_id>/", FoodItemDetailView.as_view(), name="fooditem-detail"),
     path("fooditems/", FoodItemListAllView.as_view(), name="fooditems"),
+    path("fooditems/import/", FoodItemImportView.as_view(), name="fooditem-import"),
+    path("fooditems/export/", FoodItemExportView.as_view(), name="fooditem-export"),
     path('specialoffers/', SpecialOfferListCreateAPIView.as_view(), name='specialoffer-list-create'),
     path('specialoffers/<uuid:offer_id>/', SpecialOfferRetrieveUpdateDestroyAPIView.as_view(), name='specialoffer-detail'),
+    path("kitchen/orders/", KitchenQueueView.as_view(), name="kitchen-queue"),
+    path("kitchen/orders/transition/", KitchenTransitionView.as_view(), name="kitchen-transition"),
+    path("kitchen/events/", kitchen_events, name="kitchen-events"),
+    path("reports/sales/", SalesReportView.as_view(), name="sales-report"),
 ]
 
 
@@ -1,4 +1,10 @@
+import os
+from datetime import timedelta
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 from rest_framework.response import Response
 from rest_framework import status
@@ -6,19 +12,33 @@ from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import NotFound
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 
 from .permissions import IsAdmin
+from cafebackend.events import KITCHEN, authenticate_stream, event_stream, unauthorized
+from cafebackend.pagination import KeysetPagination
+from .menuio import CSV, FORMATS, MenuImportError, export_fooditems, import_fooditems
+from .kitchen import MAX_QUEUE_LIMIT, QUEUE_LIMIT, order_queue, transition_orders
+from .dashboard import dashboard
+from .reports import DEFAULT_REPORT_DAYS, MAX_REPORT_LIMIT, REPORT_LIMIT, sales_report
+from cafecustomer.caching import MENU, versioned_response
+from cafecustomer.search import CATEGORY, search_menu
+from cafecustomer.tables import clear_table
 from cafecustomer.serializers import (
     CategorySerializer,
     FoodItemSerializer, 
     DinningTableSerializer,
     SpecialOfferSerializer,
+    OrderTransitionSerializer,
 )
 from cafecustomer.models import (
     Category,
     FoodItem,
     DiningTable,
     SpecialOffer,
+    Order,
+    SalesRollup,
 )
 
 
@@ -41,12 +61,14 @@ class AdminHome(APIView):
             request (Request): The Http request
 
         Returns:
-            response (Response): A response containing a welcome message.
+            response (Response): A response containing a welcome message
+            and the live metrics of the cafe.
 
         """
 
         message = {
-            "detail": "welcome to the admin dashboard updated."
+            "detail": "welcome to the admin dashboard updated.",
+            "metrics": dashboard.snapshot(),
         }
 
         return Response(message, status=status.HTTP_200_OK)
@@ -69,6 +91,8 @@ class ListCreateCategory(APIView):
 
     permission_classes = [IsAuthenticated, IsAdmin]
     serializer_class = CategorySerializer
+    pagination_class = KeysetPagination
+    ordering = ("name", "id")
 
     def get(self, request):
         """
@@ -79,19 +103,25 @@ class ListCreateCategory(APIView):
             request (Request): The Http request
 
         Returns:
-            response (Response): A response containing all categories
-            or search results.
+            response (Response): A response containing a page of categories
+            or the search results.
 
         """
 
         search_query = request.query_params.get("name")
+        paginator = self.pagination_class()
 
         if search_query:
-            categories = Category.objects.filter(name__icontains=search_query)
+            # ranked lookup through the menu search index, already bounded
+            hits = search_menu(search_query, kind=CATEGORY)
+            found = Category.objects.in_bulk([hit.id for hit in hits])
+            categories = [found[hit.id] for hit in hits if hit.id in found]
+            cursor = None
         else:
-            categories = Category.objects.all()
+            categories = paginator.paginate_queryset(Category.objects.all(), request, view=self)
+            cursor = paginator.cursor
 
-        if not categories.exists():
+        if not categories and not cursor:
             response ={
                 "detail":"No categories found."
             }
@@ -99,7 +129,10 @@ class ListCreateCategory(APIView):
         
         serializer = CategorySerializer(categories, many=True)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        if search_query:
+            return Response({"next": None, "previous": None, "results": serializer.data}, status=status.HTTP_200_OK)
+
+        return paginator.get_paginated_response(serializer.data)
     
     def post(self, request):
         """
@@ -311,19 +344,32 @@ class FoodItemListView(APIView):
             Response: A JSON response with all the fooditems or an error message.
         """
 
-        try:
-            category = Category.objects.get(id=category_id)
-        except Category.DoesNotExist:
-            raise NotFound("Category not found.")
+        return versioned_response(request, MENU, lambda: self.build_menu(category_id))
+
+    def build_menu(self, category_id):
+        """
+        Serializes the fooditems under a category.
+
+        Args:
+            category_id (UUID): The UUID of the category for the fooditems.
+
+        Returns:
+            tuple: the response data and status code.
+        """
+
+        if not Category.objects.filter(id=category_id).exists():
+            return {"detail": "Category not found."}, status.HTTP_404_NOT_FOUND
         
-        fooditems = FoodItem.objects.filter(category=category)
+        fooditems = FoodItemSerializer.setup_eager_loading(
+            FoodItem.objects.filter(category_id=category_id)
+        )
 
         if not fooditems:
-            return Response({"detail":"No fooditems under this category"}, status=status.HTTP_404_NOT_FOUND)
+            return {"detail":"No fooditems under this category"}, status.HTTP_404_NOT_FOUND
         
         serializer = FoodItemSerializer(fooditems, many=True)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return serializer.data, status.HTTP_200_OK
 
 class FoodItemDetailView(APIView):
     """
@@ -354,7 +400,7 @@ class FoodItemDetailView(APIView):
         """
 
         try:
-            fooditem = FoodItem.objects.get(id=fooditem_id)
+            fooditem = FoodItemSerializer.setup_eager_loading(FoodItem.objects.all()).get(id=fooditem_id)
 
         except FoodItem.DoesNotExist:
             return Response({"detail": "FoodItem not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -430,6 +476,8 @@ class FoodItemListAllView(APIView):
 
     permission_classes = [IsAuthenticated, IsAdmin]
     serializer_class = FoodItemSerializer
+    pagination_class = KeysetPagination
+    ordering = ("name", "id")
 
     def get(self, request):
         """
@@ -439,19 +487,122 @@ class FoodItemListAllView(APIView):
             request (HttpRequest): The HTTP request.
             
         Returns:
-            Response: A JSON response with all the fooditems or an error message.
+            Response: A JSON response with a page of fooditems or an error message.
         """
 
+        return versioned_response(request, MENU, lambda: self.build_menu(request))
+
+    def build_menu(self, request):
+        """
+        Serializes a page of the fooditems.
+
+        Args:
+            request (HttpRequest): The HTTP request holding the cursor.
+
+        Returns:
+            tuple: the response data and status code.
+        """
         
-        
-        fooditems = FoodItem.objects.all()
+        paginator = self.pagination_class()
+        fooditems = paginator.paginate_queryset(
+            FoodItemSerializer.setup_eager_loading(FoodItem.objects.all()), request, view=self
+        )
 
-        if not fooditems:
-            return Response({"detail":"No fooditems available"}, status=status.HTTP_404_NOT_FOUND)
+        if not fooditems and not paginator.cursor:
+            return {"detail":"No fooditems available"}, status.HTTP_404_NOT_FOUND
         
         serializer = FoodItemSerializer(fooditems, many=True)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_data(serializer.data), status.HTTP_200_OK
+
+
+class FoodItemImportView(APIView):
+    """
+    View to handle the bulk import of fooditems from a CSV or JSON lines file.
+
+    Only accessible to admin users.
+
+    Methods:
+        post: Creates or updates the fooditems of an uploaded file.
+
+    """
+
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        """
+        Handle post request to import fooditems.
+
+        The file is uploaded as `file`, its format is taken from `file_format`
+        or the file extension. Fooditems are matched by name, existing ones
+        are updated. Nothing is imported if any row is invalid.
+
+        Args:
+            request (HttpRequest): The HTTP request.
+
+        Returns:
+            Response: A JSON response with the number of fooditems created and
+            updated, or the errors of the invalid rows.
+        """
+
+        upload = request.FILES.get("file")
+
+        if upload is None:
+            return Response({"detail": "A file is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get("file_format") or os.path.splitext(upload.name)[1].lstrip(".").lower()
+
+        if file_format not in FORMATS:
+            return Response({"detail": "The file format must be csv or jsonl."}, status=status.HTTP_400_BAD_REQUEST)
+
+        create_categories = str(request.data.get("create_categories", "")).lower() in ("1", "true")
+
+        try:
+            result = import_fooditems(upload.open("rb"), file_format, create_categories=create_categories)
+        except MenuImportError as exc:
+            return Response({"detail": "No fooditems were imported.", "errors": exc.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class FoodItemExportView(APIView):
+    """
+    View to handle the export of all fooditems as CSV or JSON lines.
+
+    Only accessible to admin users.
+
+    Methods:
+        get: Streams all the fooditems.
+
+    """
+
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        """
+        Handle get request to export the fooditems.
+
+        Args:
+            request (HttpRequest): The HTTP request, `file_format` selects csv
+            (the default) or jsonl.
+
+        Returns:
+            StreamingHttpResponse: The fooditems, streamed as they are read.
+        """
+
+        file_format = request.query_params.get("file_format", CSV)
+
+        if file_format not in FORMATS:
+            return Response({"detail": "The file format must be csv or jsonl."}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = "text/csv" if file_format == CSV else "application/x-ndjson"
+        response = StreamingHttpResponse(export_fooditems(file_format), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="fooditems.{file_format}"'
+
+        return response
 
 
 class DinningTableViewSet(viewsets.ModelViewSet):
@@ -464,12 +615,23 @@ class DinningTableViewSet(viewsets.ModelViewSet):
     -Retrieve a single dinning table (GET)
     -Updates an existing dinning table(PUT/PATCH)
     -Deletes a dinning table(DELETE)
+    -Releases a dinning table held by a customer(POST release)
     """
 
     queryset = DiningTable.objects.all()
     serializer_class = DinningTableSerializer
     permission_classes = [IsAuthenticated, IsAdmin]
 
+    @action(detail=True, methods=["post"])
+    def release(self, request, pk=None):
+        """
+        Releases a table whoever holds it, once the host cleared it.
+        """
+        table = self.get_object()
+        released = clear_table(table.id)
+
+        return Response({"dining_table": table.id, "released": released}, status=status.HTTP_200_OK)
+
 
 class SpecialOfferListCreateAPIView(APIView):
     """
@@ -617,3 +779,158 @@ class SpecialOfferRetrieveUpdateDestroyAPIView(APIView):
 
         return Response({"detail":"Specialoffer deleted successfully."}, status=status.HTTP_200_OK)
 
+
+
+class KitchenQueueView(APIView):
+    """
+    View listing the open orders for the kitchen, oldest first per status.
+
+    Only accessible to admin users.
+
+    Methods:
+        get: Lists the orders of every open status.
+
+    """
+
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        """
+        Handle get request to list the kitchen queue.
+
+        Args:
+            request (HttpRequest): The HTTP request, `status` restricts the
+            queue to one status and `limit` sets the orders listed per status.
+
+        Returns:
+            Response: A JSON response with the orders and counts per status.
+        """
+
+        statuses = Order.OPEN_STATUSES
+        order_status = request.query_params.get("status")
+
+        if order_status:
+            if order_status not in Order.STATUS_TRANSITIONS:
+                return Response({"detail": "Invalid order status."}, status=status.HTTP_400_BAD_REQUEST)
+            statuses = (order_status,)
+
+        try:
+            limit = min(max(int(request.query_params.get("limit", QUEUE_LIMIT)), 1), MAX_QUEUE_LIMIT)
+        except ValueError:
+            return Response({"detail": "Invalid limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(order_queue(statuses, limit), status=status.HTTP_200_OK)
+
+
+class KitchenTransitionView(APIView):
+    """
+    View moving orders to a new status in bulk.
+
+    Orders follow PENDING -> READY -> DELIVERED -> COMPLETE, orders that
+    can't move to the requested status are left unchanged and reported.
+
+    Only accessible to admin users.
+
+    Methods:
+        post: Moves the orders to a new status.
+
+    """
+
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def post(self, request):
+        """
+        Handle post request to move orders to a new status.
+
+        Args:
+            request (HttpRequest): The HTTP request with the `orders` ids and
+            the new `status`.
+
+        Returns:
+            Response: A JSON response with the updated and rejected orders.
+        """
+
+        serializer = OrderTransitionSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        updated, rejected = transition_orders(serializer.validated_data["orders"], serializer.validated_data["status"])
+
+        return Response({"updated": updated, "rejected": rejected}, status=status.HTTP_200_OK)
+
+
+@require_GET
+async def kitchen_events(request):
+    """
+    Streams new orders, status changes and payments to the kitchen as
+    server-sent events.
+
+    The access token can be passed as `?token=` since browsers can't set
+    headers on an EventSource.
+
+    Returns:
+        StreamingHttpResponse: the event stream, or an error if the user
+        is not an authenticated admin.
+    """
+    user = await authenticate_stream(request)
+
+    if user is None:
+        return unauthorized()
+
+    if user.role != "admin":
+        return JsonResponse({"detail": IsAdmin.message}, status=403)
+
+    return event_stream(KITCHEN)
+
+
+class SalesReportView(APIView):
+    """
+    View reporting the sales of a range of days, read from the sales rollups.
+
+    Only accessible to admin users.
+
+    Methods:
+        get: Reports the daily totals or the best sellers of a dimension.
+
+    """
+
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        """
+        Handle get request to report the sales.
+
+        Args:
+            request (HttpRequest): The HTTP request, `dimension` is one of
+            total (default), fooditem, category or table, `start` and `end`
+            are ISO dates (the last 30 days by default) and `limit` sets
+            the number of fooditems, categories or tables listed.
+
+        Returns:
+            Response: A JSON response with the totals of the range and the
+            sales per day or per key.
+        """
+
+        dimension = request.query_params.get("dimension", SalesRollup.TOTAL)
+
+        if dimension not in dict(SalesRollup.DIMENSION_CHOICES):
+            return Response({"detail": "Invalid dimension."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            end = parse_date(request.query_params["end"]) if "end" in request.query_params else timezone.localdate()
+            start = (
+                parse_date(request.query_params["start"]) if "start" in request.query_params
+                else end - timedelta(days=DEFAULT_REPORT_DAYS - 1)
+            )
+            limit = min(max(int(request.query_params.get("limit", REPORT_LIMIT)), 1), MAX_REPORT_LIMIT)
+        except (TypeError, ValueError):
+            return Response({"detail": "Invalid date range or limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if start is None or end is None or start > end:
+            return Response({"detail": "Invalid date range or limit."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(sales_report(dimension, start, end, limit), status=status.HTTP_200_OK)
@@ -0,0 +1,252 @@
+"""
+Publish/subscribe of small realtime events, streamed to clients as
+server-sent events.
+
+Events are published to named channels ("user:<id>", "kitchen") once the
+current transaction commits. By default the broker lives in the process,
+so it only reaches clients connected to the same worker. With
+EVENTS_BROKER_URL pointing at a Redis server, events are relayed through
+Redis to the subscribers of every worker (requires the redis package).
+"""
+
+import asyncio
+import itertools
+import json
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError, AuthenticationFailed
+
+from account.authentication import StatelessJWTAuthentication
+
+
+KITCHEN = "kitchen"
+
+# a comment is sent this often on idle streams so proxies keep them open
+KEEPALIVE_SECONDS = 15
+
+
+def user_channel(user_id):
+    """
+    Returns the channel of the events sent to a single user.
+    """
+    return f"user:{user_id}"
+
+
+class LocalBroker:
+    """
+    In-process broker delivering events to asyncio subscribers.
+
+    Events can be published from any thread, every subscriber has a
+    bounded queue and loses its oldest events if it falls behind.
+
+    Attributes:
+        max_queue (int): the number of undelivered events kept per subscriber.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        """
+        Delivers an event to the current subscribers of a channel.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # the subscriber's loop is closed, it is removed when its stream ends
+                pass
+
+    @staticmethod
+    def _deliver(queue, event):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+    async def listen(self, channel, timeout=None):
+        """
+        Yields the events published to a channel until the consumer stops.
+
+        Args:
+            channel (str): the channel to listen to.
+            timeout (float): yields None after this many idle seconds.
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.max_queue))
+
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+class RedisBroker(LocalBroker):
+    """
+    Broker relaying events through Redis so they reach the subscribers of
+    every worker process.
+
+    Attributes:
+        prefix (str): the prefix of the Redis channels.
+    """
+
+    def __init__(self, url, prefix="cafe:events:", max_queue=100):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("EVENTS_BROKER_URL requires the redis package.")
+
+        super().__init__(max_queue=max_queue)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._relay = None
+        self._relay_lock = threading.Lock()
+
+    def publish(self, channel, event):
+        self.client.publish(self.prefix + channel, json.dumps(event, cls=DjangoJSONEncoder))
+
+    async def listen(self, channel, timeout=None):
+        self._start_relay()
+        async for event in super().listen(channel, timeout):
+            yield event
+
+    def _start_relay(self):
+        with self._relay_lock:
+            if self._relay is None:
+                self._relay = threading.Thread(target=self._run_relay, name="events-relay", daemon=True)
+                self._relay.start()
+
+    def _run_relay(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(self.prefix + "*")
+
+        for message in pubsub.listen():
+            channel = message["channel"].decode()[len(self.prefix):]
+            LocalBroker.publish(self, channel, json.loads(message["data"]))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """
+    Returns the broker of the process, creating it on first use.
+    """
+    global _broker
+
+    with _broker_lock:
+        if _broker is None:
+            url = getattr(settings, "EVENTS_BROKER_URL", "")
+            _broker = RedisBroker(url) if url else LocalBroker()
+
+        return _broker
+
+
+def publish(channels, event_type, data):
+    """
+    Publishes an event once the current transaction commits.
+
+    Args:
+        channels (list): the channels to publish to.
+        event_type (str): the type of the event, e.g "order.status".
+        data (dict): the event payload.
+    """
+    event = {"type": event_type, "data": data}
+
+    def send():
+        broker = get_broker()
+        for channel in channels:
+            broker.publish(channel, event)
+
+    transaction.on_commit(send)
+
+
+def format_event(event_id, event):
+    """
+    Formats an event as a server-sent event frame.
+    """
+    data = json.dumps(event["data"], cls=DjangoJSONEncoder)
+    return f"id: {event_id}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def authenticate_stream(request):
+    """
+    Authenticates a stream request from its bearer token, or the `token`
+    query parameter since browsers can't set headers on an EventSource.
+
+    Returns:
+        User: the authenticated user, None if the token is missing or invalid.
+    """
+    authentication = StatelessJWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+
+    if raw_token is None:
+        raw_token = request.GET.get("token")
+
+    if not raw_token:
+        return None
+
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        return await sync_to_async(authentication.get_user)(validated_token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+def event_stream(channel, keepalive=KEEPALIVE_SECONDS):
+    """
+    Streams the events of a channel as server-sent events.
+
+    Args:
+        channel (str): the channel to stream.
+        keepalive (float): the idle seconds between keepalive comments.
+
+    Returns:
+        StreamingHttpResponse: the never ending event stream.
+    """
+
+    async def stream():
+        counter = itertools.count(1)
+        yield ": connected\n\n"
+
+        async for event in get_broker().listen(channel, timeout=keepalive):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield format_event(next(counter), event)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+
+    return response
+
+
+def unauthorized(message="Authentication credentials were not provided or are invalid."):
+    return JsonResponse({"detail": message}, status=401)
@@ -0,0 +1,191 @@
+"""
+Keyset (cursor) pagination for the hand-written API views.
+
+Pages are fetched by filtering on the ordering values of the last row
+seen rather than with an OFFSET, so with an index matching the ordering
+every page costs the same however deep it is, and rows inserted while a
+client pages through a list don't shift the pages.
+"""
+
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates a queryset on a unique ordering, e.g ("-updated_at", "id").
+
+    The ordering is read from the `ordering` attribute of the view and must
+    end with a unique field so every row has a distinct position.
+
+    Attributes:
+        page_size (int): the default number of results per page.
+        page_size_query_param (str): lets the client pick a smaller or larger page.
+        max_page_size (int): the largest page size a client can ask for.
+        cursor_query_param (str): the query parameter holding the cursor.
+        ordering (tuple): the ordering used when the view doesn't set one.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    ordering = ("-created_at", "id")
+
+    invalid_cursor_message = "Invalid cursor."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Returns the page of the queryset after (or before) the request cursor.
+        """
+        self.request = request
+        self.model = queryset.model
+        self.ordering = tuple(getattr(view, "ordering", self.ordering))
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor["reverse"]
+        ordering = self.reverse_ordering(self.ordering) if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+
+        if self.cursor is not None:
+            queryset = queryset.filter(self.after(ordering, self.cursor["position"]))
+
+        # one extra row tells whether there is a page beyond this one
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        self.page = results
+
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        """
+        Wraps a page of serialized data with the links to its neighbouring pages.
+        """
+        return OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ])
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        if not self.page:
+            # past the end of the list, the previous page is the last one
+            url = self.request.build_absolute_uri()
+            return remove_query_param(url, self.cursor_query_param)
+
+        return self.encode_link(self.page[0], reverse=True)
+
+    def encode_link(self, instance, reverse):
+        """
+        Returns the url of the page after (or before) an instance.
+        """
+        position = [
+            str(getattr(instance, field.lstrip("-"))) for field in self.ordering
+        ]
+        payload = json.dumps({"p": position, "r": reverse}, separators=(",", ":"))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """
+        Decodes the request cursor.
+
+        Raises:
+            NotFound: if the cursor is malformed.
+
+        Returns:
+            dict: the position values and direction, None on the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if not encoded:
+            return None
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)))
+            values = payload["p"]
+            reverse = bool(payload["r"])
+
+            if len(values) != len(self.ordering):
+                raise ValueError
+
+            position = [
+                self.model._meta.get_field(field.lstrip("-")).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        return {"position": position, "reverse": reverse}
+
+    @staticmethod
+    def reverse_ordering(ordering):
+        return tuple(field[1:] if field.startswith("-") else f"-{field}" for field in ordering)
+
+    @staticmethod
+    def after(ordering, position):
+        """
+        Builds the filter matching the rows ordered after a position.
+
+        For ("-updated_at", "id") that is
+        `updated_at < v1 OR (updated_at = v1 AND id > v2)`.
+        """
+        condition = Q()
+        equal = {}
+
+        for field, value in zip(ordering, position):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+
+        return condition
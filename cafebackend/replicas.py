@@ -0,0 +1,158 @@
+"""
+Routing of the reads of safe requests to read replicas.
+
+ReplicaMiddleware flags GET, HEAD and OPTIONS requests as allowed to read
+from a replica, and ReplicaRouter sends the reads of flagged requests to
+one of the REPLICA_DATABASES. Every write, and every read meant for a
+write (select_for_update, get_or_create), goes to the default database.
+
+Replicas lag behind, so a user who just wrote something (placed an order,
+left a review) reads from the default database for REPLICA_STICKY_SECONDS
+afterwards and sees their own writes. The window is kept in the cache,
+keyed by the user_id of the request's access token.
+
+Code caching or writing back what it reads runs under `primary_reads`,
+so a lagging replica is never cached past the request.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# whether the current request may read from a replica
+reads_from_replica = ContextVar("reads_from_replica", default=False)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Reads from the default database, whatever the request. Used by code
+    caching what it reads past the request (versioned payloads, in-memory
+    indexes) or writing back what it read, which must never see a lagging
+    replica.
+    """
+    token = reads_from_replica.set(False)
+    try:
+        yield
+    finally:
+        reads_from_replica.reset(token)
+
+
+def sticky_key(user_id):
+    return f"replica-sticky:{user_id}"
+
+
+def stick_to_primary(user_id):
+    """
+    Sends the reads of a user to the default database for a short while,
+    e.g after their own write.
+    """
+    cache.set(sticky_key(user_id), True, timeout=getattr(settings, "REPLICA_STICKY_SECONDS", 10))
+
+
+def is_sticky(user_id):
+    return cache.get(sticky_key(user_id), False)
+
+
+def request_user_id(request):
+    """
+    Returns the user_id of the request's access token, None without one.
+
+    The signature isn't checked, the authentication of the view does: a
+    forged user_id can only send a request to the default database.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+
+    if raw_token is None:
+        return None
+
+    try:
+        return AccessToken(raw_token, verify=False).get(api_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of safe requests to a random replica, everything else
+    to the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "REPLICA_DATABASES", [])
+
+        if replicas and reads_from_replica.get():
+            return random.choice(replicas)
+
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # instances read from a replica are saved to the default database too
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, "REPLICA_DATABASES", [])}
+
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Lets safe requests read from a replica unless their user wrote
+    something recently, and starts that window on every other request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        user_id, token = self.enter(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self.exit(request, user_id, token)
+
+    async def __acall__(self, request):
+        user_id, token = self.enter(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            self.exit(request, user_id, token)
+
+    def enter(self, request):
+        user_id = request_user_id(request)
+        replica = request.method in SAFE_METHODS and not (user_id is not None and is_sticky(user_id))
+
+        return user_id, reads_from_replica.set(replica)
+
+    def exit(self, request, user_id, token):
+        reads_from_replica.reset(token)
+
+        if request.method not in SAFE_METHODS and user_id is not None:
+            stick_to_primary(user_id)
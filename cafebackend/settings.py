@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+from copy import deepcopy
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -69,6 +71,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "cafebackend.replicas.ReplicaMiddleware",
 ]
 
 ROOT_URLCONF = "cafebackend.urls"
@@ -95,13 +98,110 @@ WSGI_APPLICATION = "cafebackend.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_PROFILE selects the database: "sqlite" (the default) or "postgres".
+
+DATABASE_PROFILE = config("DATABASE_PROFILE", default="sqlite")
+
+if DATABASE_PROFILE == "postgres":
+    # persistent connections checked before reuse, or, with DATABASE_POOL,
+    # a psycopg connection pool (requires psycopg[pool]) checking the
+    # connections it hands out
+    DATABASE_POOL = config("DATABASE_POOL", cast=bool, default=False)
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": config("DATABASE_NAME", default="cafebackend"),
+            "USER": config("DATABASE_USER", default="cafebackend"),
+            "PASSWORD": config("DATABASE_PASSWORD", default=""),
+            "HOST": config("DATABASE_HOST", default="localhost"),
+            "PORT": config("DATABASE_PORT", default="5432"),
+            "CONN_MAX_AGE": 0 if DATABASE_POOL else config("DATABASE_CONN_MAX_AGE", cast=int, default=600),
+            "CONN_HEALTH_CHECKS": not DATABASE_POOL,
+            "OPTIONS": {},
+        }
+    }
+
+    if DATABASE_POOL:
+        from psycopg_pool import ConnectionPool
+
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": config("DATABASE_POOL_MIN_SIZE", cast=int, default=2),
+            "max_size": config("DATABASE_POOL_MAX_SIZE", cast=int, default=10),
+            "timeout": config("DATABASE_POOL_TIMEOUT", cast=float, default=10),
+            "check": ConnectionPool.check_connection,
+        }
+
+elif DATABASE_PROFILE == "sqlite":
+    # WAL lets readers run alongside the writer, and IMMEDIATE transactions
+    # take the write lock upfront so concurrent writers wait up to the
+    # timeout instead of failing with "database is locked"
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": config("DATABASE_NAME", default=str(BASE_DIR / "db.sqlite3")),
+            "OPTIONS": {
+                "transaction_mode": "IMMEDIATE",
+                "timeout": config("DATABASE_TIMEOUT", cast=int, default=20),
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    f"PRAGMA mmap_size={config('DATABASE_MMAP_SIZE', cast=int, default=134217728)};"
+                ),
+            },
+        }
+    }
+
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_PROFILE {DATABASE_PROFILE!r}, use \"sqlite\" or \"postgres\".")
+
+# Read replicas: DATABASE_REPLICAS lists their hosts (postgres) or files
+# (sqlite). Safe requests read from a random replica, except for
+# REPLICA_STICKY_SECONDS after their user's own write, everything else
+# uses the default database. Tests use the default database for them.
+
+REPLICA_DATABASES = []
+
+for number, replica in enumerate(config("DATABASE_REPLICAS", cast=Csv(), default=""), start=1):
+    alias = f"replica_{number}"
+    DATABASES[alias] = deepcopy(DATABASES["default"])
+    DATABASES[alias]["HOST" if DATABASE_PROFILE == "postgres" else "NAME"] = replica
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    REPLICA_DATABASES.append(alias)
+
+REPLICA_STICKY_SECONDS = config("REPLICA_STICKY_SECONDS", cast=int, default=10)
+
+DATABASE_ROUTERS = ["cafebackend.replicas.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# use a shared backend (e.g memcached or redis) when running several workers,
+# so the cached menu versions are the same in every worker.
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="cafebackend"),
     }
 }
 
+# whether every process sees the same cache, the in-process blacklist
+# relies on it to learn about logouts in other processes
+SHARED_CACHE = CACHES["default"]["BACKEND"] not in (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# the menu, floor and redemption versions (and their ETags) and the search
+# index only move in the process that wrote, so a per-process cache would
+# serve stale menus from every other worker
+if not DEBUG and not SHARED_CACHE:
+    raise ImproperlyConfigured(
+        f"CACHE_BACKEND {CACHES['default']['BACKEND']!r} isn't shared between processes, "
+        "use a shared backend (e.g memcached or redis) when DEBUG is off."
+    )
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -143,6 +243,52 @@ STATIC_URL = "static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR/"media"
 
+# Background work
+# tasks such as image renditions run on bounded thread pools,
+# eager tasks run inline in the calling thread instead.
+
+BACKGROUND_TASKS_EAGER = config("BACKGROUND_TASKS_EAGER", cast=bool, default=False)
+
+BACKGROUND_POOLS = {
+    "renditions": {"max_workers": 2, "max_queue": 100},
+    "payments": {"max_workers": 8, "max_queue": 500},
+    # a single dispatcher drains the outbox, one queued drain is enough
+    "outbox": {"max_workers": 1, "max_queue": 1},
+    # password hashing of the login and register requests
+    "auth": {
+        "max_workers": config("AUTH_POOL_WORKERS", cast=int, default=4),
+        "max_queue": config("AUTH_POOL_QUEUE", cast=int, default=32),
+    },
+}
+
+# Payments
+# attempts are charged on the payments pool through the gateway backend,
+# the fake gateway stands in for the real one with a configurable latency
+# and failure rate. Gateways reporting results asynchronously call back
+# with a payload signed with PAYMENT_CALLBACK_SECRET.
+
+PAYMENT_GATEWAY = {
+    "BACKEND": config("PAYMENT_GATEWAY_BACKEND", default="cafecustomer.payments.FakeGateway"),
+    "OPTIONS": {
+        "latency": config("FAKE_GATEWAY_LATENCY", cast=float, default=0.0),
+        "failure_rate": config("FAKE_GATEWAY_FAILURE_RATE", cast=float, default=0.0),
+    },
+}
+
+PAYMENT_CALLBACK_SECRET = config("PAYMENT_CALLBACK_SECRET", default=SECRET_KEY)
+
+# Realtime events
+# events are pushed to the subscribers of this process only, unless they
+# are relayed through the Redis server at EVENTS_BROKER_URL.
+
+EVENTS_BROKER_URL = config("EVENTS_BROKER_URL", default="")
+
+# Idempotency keys
+# responses to POST requests sent with an Idempotency-Key header are
+# replayed to retries for this long.
+
+IDEMPOTENCY_KEY_TTL = timedelta(hours=config("IDEMPOTENCY_KEY_TTL_HOURS", cast=int, default=24))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -150,8 +296,9 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
 
+    # builds the request user from the token claims, without a query
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'account.authentication.StatelessJWTAuthentication',
     ),
 
     'DEFAULT_SCHEMA_CLASS': "drf_spectacular.openapi.AutoSchema",
@@ -186,6 +333,10 @@ SIMPLE_JWT ={
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
     'JTI_CLAIM': 'jti',
+    # issues tokens carrying the username and role of their user
+    'TOKEN_OBTAIN_SERIALIZER': 'account.tokens.RoleTokenObtainPairSerializer',
+    # checks refresh tokens against the in-memory blacklist
+    'TOKEN_REFRESH_SERIALIZER': 'account.tokens.RoleTokenRefreshSerializer',
 }
 
 SPECTACULAR_SETTINGS = {
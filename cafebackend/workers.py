@@ -0,0 +1,150 @@
+"""
+Bounded thread pools for work that should not run in the request thread.
+
+Each named pool is sized through the BACKGROUND_POOLS setting. A pool
+accepts at most `max_workers + max_queue` tasks at once and raises
+PoolSaturated beyond that, so callers can shed load instead of queueing
+without bound. With BACKGROUND_TASKS_EAGER enabled (e.g in tests) tasks
+run inline in the calling thread.
+
+Async views use `run` to wait for a task without blocking the event loop.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+DEFAULT_POOL = {
+    "max_workers": 4,
+    "max_queue": 64,
+}
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when a pool already holds as many tasks as it can queue.
+    """
+
+
+class BoundedPool:
+    """
+    A thread pool with a bounded number of pending tasks.
+
+    Attributes:
+        name (str): the name of the pool.
+        max_workers (int): the number of worker threads.
+        max_queue (int): the number of tasks allowed to wait for a worker.
+    """
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+
+    @property
+    def pending(self):
+        """
+        The number of tasks running or waiting for a worker.
+        """
+        return self._pending
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules a task on the pool.
+
+        Raises:
+            PoolSaturated: if the pool has no free slot.
+
+        Returns:
+            Future: the future of the task.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated(f"The {self.name} pool is saturated.")
+
+        with self._pending_lock:
+            self._pending += 1
+
+        try:
+            return self._executor.submit(self._run, fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+
+    def _run(self, fn, *args, **kwargs):
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # as at the end of a request: worker threads outlive the task, so their
+            # connections are only kept for CONN_MAX_AGE (or returned to the pool)
+            close_old_connections()
+            self._release()
+
+    def _release(self):
+        with self._pending_lock:
+            self._pending -= 1
+        self._slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name):
+    """
+    Returns the pool with the given name, creating it on first use.
+    """
+    with _pools_lock:
+        if name not in _pools:
+            options = {**DEFAULT_POOL, **getattr(settings, "BACKGROUND_POOLS", {}).get(name, {})}
+            _pools[name] = BoundedPool(name, options["max_workers"], options["max_queue"])
+
+        return _pools[name]
+
+
+def submit(pool_name, fn, *args, **kwargs):
+    """
+    Runs a task on a named pool, or inline when tasks are eager.
+
+    Raises:
+        PoolSaturated: if the pool has no free slot.
+
+    Returns:
+        Future: the future of the task.
+    """
+    if getattr(settings, "BACKGROUND_TASKS_EAGER", False):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    return get_pool(pool_name).submit(fn, *args, **kwargs)
+
+
+async def run(pool_name, fn, *args, **kwargs):
+    """
+    Runs a task on a named pool and waits for its result without blocking
+    the event loop. Eager tasks run in the sync thread of the request,
+    since the ORM can't be used from the event loop.
+
+    Raises:
+        PoolSaturated: if the pool has no free slot.
+
+    Returns:
+        the result of the task.
+    """
+    if getattr(settings, "BACKGROUND_TASKS_EAGER", False):
+        return await sync_to_async(fn)(*args, **kwargs)
+
+    return await asyncio.wrap_future(get_pool(pool_name).submit(fn, *args, **kwargs))
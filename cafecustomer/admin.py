@@ -1,13 +1,16 @@
 
 from django.contrib import admin
-from .models import (Category, FoodItem, DiningTable, Order, 
+from .models import (Category, FoodItem, DiningTable, Order, OrderLine, PaymentAttempt,
                      Cart, CartItem, Review, UserDinningTable, SpecialOffer, Transaction, 
-                     CustomerPoint, RedemptionOption, RedemptionTransaction, Notification)
+                     CustomerPoint, RedemptionOption, RedemptionTransaction, Notification,
+                     IdempotencyRecord, OutboxEvent, SalesRollup, PointsEntry)
 
 admin.site.register(Category)
 admin.site.register(FoodItem)
 admin.site.register(DiningTable)
 admin.site.register(Order)
+admin.site.register(OrderLine)
+admin.site.register(PaymentAttempt)
 admin.site.register(Cart)
 admin.site.register(CartItem)
 admin.site.register(Review)
@@ -17,4 +20,8 @@ admin.site.register(SpecialOffer)
 admin.site.register(Transaction)
 admin.site.register(RedemptionOption)
 admin.site.register(RedemptionTransaction)
-admin.site.register(Notification)
\ No newline at end of file
+admin.site.register(Notification)
+admin.site.register(IdempotencyRecord)
+admin.site.register(OutboxEvent)
+admin.site.register(SalesRollup)
+admin.site.register(PointsEntry)
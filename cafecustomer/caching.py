@@ -0,0 +1,117 @@
+import time
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from cafebackend.replicas import primary_reads
+
+
+# the namespace versioned by Category, FoodItem and SpecialOffer writes
+MENU = "menu"
+
+# the namespace versioned by DiningTable writes and table claims
+FLOOR = "floor"
+
+# the namespace versioned by RedemptionOption, FoodItem and Category writes
+REDEMPTIONS = "redemptions"
+
+
+def _version_key(namespace):
+    return f"{namespace}:version"
+
+
+def get_version(namespace):
+    """
+    Gets the current version of a cached namespace.
+
+    A missing version is seeded from the clock, so ETags issued before the
+    version was evicted from the cache can never match again.
+
+    Args:
+        namespace (str): the namespace e.g "menu".
+
+    Returns:
+        int: the current version.
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_version(namespace):
+    """
+    Moves a namespace to a new version, invalidating everything cached for it.
+
+    Args:
+        namespace (str): the namespace e.g "menu".
+
+    Returns:
+        int: the new version.
+    """
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        # the version was evicted, seeding a new one invalidates it as well
+        return get_version(namespace)
+
+
+def _etag_matches(request, etag):
+    """
+    Checks whether the request's If-None-Match header matches an ETag.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def versioned_response(request, namespace, build, timeout=60 * 60):
+    """
+    Serves a GET response cached for the current version of a namespace.
+
+    Clients sending back the ETag of the current version get a 304 without
+    any database or serializer work. Otherwise the payload is built once per
+    version and url and then served from the cache.
+
+    Args:
+        request (Request): the Http request.
+        namespace (str): the namespace whose version the payload depends on.
+        build (callable): builds the (data, status_code) of the response.
+        timeout (int): how long to keep the payload in seconds.
+
+    Returns:
+        Response: the cached response or a 304.
+    """
+    version = get_version(namespace)
+    etag = f'"{namespace}-{version}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+    }
+
+    if _etag_matches(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = f"{namespace}:{version}:{request.get_full_path()}"
+    cached = cache.get(key)
+
+    if cached is None:
+        # cached for the whole version, so never built from a lagging replica
+        with primary_reads():
+            data, status_code = build()
+        cached = (data, status_code)
+        cache.set(key, cached, timeout=timeout)
+
+    data, status_code = cached
+
+    return Response(data, status=status_code, headers=headers)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+# set on responses served from a stored record
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# the response headers stored with the response and replayed, e.g the
+# Location of the status of a payment
+STORED_HEADERS = ("Location",)
+
+
+def get_ttl():
+    """
+    Returns how long a stored response is replayed.
+    """
+    return getattr(settings, "IDEMPOTENCY_KEY_TTL", timedelta(hours=24))
+
+
+def request_fingerprint(request):
+    """
+    Returns the sha256 of a request method, path and body, so a key
+    reused for a different request can be told apart from a retry.
+    """
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    payload = f"{request.method}\n{request.path}\n{body}"
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim_key(user, key, fingerprint):
+    """
+    Records that a request with an idempotency key is being handled.
+
+    Returns:
+        IdempotencyRecord: the new record, None if the key is already taken.
+    """
+    now = timezone.now()
+
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyRecord.objects.create(
+                    user=user, key=key, fingerprint=fingerprint, expires_at=now + get_ttl()
+                )
+        except IntegrityError:
+            # the key is free again once its previous record expired
+            if not IdempotencyRecord.objects.filter(user=user, key=key, expires_at__lte=now).delete()[0]:
+                return None
+
+    return None
+
+
+def idempotent(view_method):
+    """
+    Makes a POST view method idempotent for requests sent with an
+    Idempotency-Key header.
+
+    The first request runs the view and stores its response, along with its
+    STORED_HEADERS, retries with the same key and body get the stored
+    response back from a single lookup.
+    A retry arriving while the first request is still running gets a 409,
+    and a key reused with a different body a 422. Server errors aren't
+    stored so the request can be retried. Requests without the header run
+    the view as usual.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > 255:
+            return Response(
+                {"detail": f"The {IDEMPOTENCY_HEADER} header must be at most 255 characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        record = IdempotencyRecord.objects.filter(
+            user=request.user, key=key, expires_at__gt=timezone.now()
+        ).first()
+
+        if record is None:
+            record = claim_key(request.user, key, fingerprint)
+
+            if record is not None:
+                return run_and_store(record, view_method, self, request, *args, **kwargs)
+
+            # another request claimed the key in the meantime
+            record = IdempotencyRecord.objects.filter(user=request.user, key=key).first()
+
+        if record is None or record.status_code is None and record.fingerprint == fingerprint:
+            return Response(
+                {"detail": f"A request with this {IDEMPOTENCY_HEADER} is still being processed."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        if record.fingerprint != fingerprint:
+            return Response(
+                {"detail": f"This {IDEMPOTENCY_HEADER} was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+
+        return Response(
+            record.response_body,
+            status=record.status_code,
+            headers={**record.response_headers, REPLAYED_HEADER: "true"},
+        )
+
+    return wrapper
+
+
+def run_and_store(record, view_method, view, request, *args, **kwargs):
+    """
+    Runs a view for a claimed key and stores its response on the record.
+    """
+    try:
+        response = view_method(view, request, *args, **kwargs)
+    except Exception:
+        record.delete()
+        raise
+
+    if response.status_code >= 500 or not hasattr(response, "data"):
+        record.delete()
+        return response
+
+    IdempotencyRecord.objects.filter(id=record.id).update(
+        status_code=response.status_code,
+        response_body=response.data,
+        response_headers={name: response[name] for name in STORED_HEADERS if response.has_header(name)},
+    )
+
+    return response
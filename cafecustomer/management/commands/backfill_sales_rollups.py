@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from cafecustomer.rollups import BACKFILL_CHUNK_SIZE, backfill_rollups, reset_rollups
+
+
+class Command(BaseCommand):
+    """
+    Adds the paid orders missing from the sales rollups, e.g the orders
+    paid before the rollups existed. Safe to interrupt and run again.
+    """
+
+    help = "Backfills the sales rollups from the paid orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+        parser.add_argument("--rebuild", action="store_true", help="Empty the rollups and rebuild them from every order.")
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            reset_rollups(chunk_size=options["chunk_size"])
+
+        total = backfill_rollups(
+            chunk_size=options["chunk_size"],
+            progress=lambda count: self.stdout.write(f"Rolled up {count} orders..."),
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {total} orders."))
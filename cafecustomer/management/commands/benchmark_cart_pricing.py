@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from cafecustomer.models import Category, FoodItem, SpecialOffer, Cart, CartItem
+from cafecustomer.pricing import price_cart
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks pricing carts of increasing size.
+
+    The synthetic menu and carts are created inside a transaction which is
+    rolled back once the benchmark is done.
+    """
+
+    help = "Benchmarks cart pricing for carts of 1 to 200 lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[1, 10, 50, 100, 200])
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = sorted(options["sizes"])
+
+        with transaction.atomic():
+            fooditems = self.create_menu(max(sizes))
+            user = User.objects.create_user(username="benchmark-cart-pricing", password="benchmark")
+            cart = Cart.objects.create(user=user)
+
+            self.stdout.write(f"{'lines':>6} {'queries':>8} {'ms/price':>10}")
+
+            added = 0
+            for size in sizes:
+                CartItem.objects.bulk_create(
+                    CartItem(cart=cart, fooditem=fooditem, quantity=2)
+                    for fooditem in fooditems[added:size]
+                )
+                added = size
+
+                start = time.perf_counter()
+                for _ in range(options["repeat"]):
+                    pricing = price_cart(cart)
+                elapsed = (time.perf_counter() - start) / options["repeat"]
+
+                self.stdout.write(f"{len(pricing.lines):>6} {pricing.query_count:>8} {elapsed * 1000:>10.2f}")
+
+            transaction.set_rollback(True)
+
+    def create_menu(self, size):
+        now = timezone.now()
+        category = Category.objects.create(name="benchmark-cart-pricing", description="benchmark")
+        fooditems = FoodItem.objects.bulk_create(
+            FoodItem(category=category, name=f"benchmark-cart-pricing-{i}", price=Decimal("150.00"), description="")
+            for i in range(size)
+        )
+        SpecialOffer.objects.bulk_create(
+            SpecialOffer(
+                fooditem=fooditem,
+                discount_percentage=Decimal("15.00"),
+                start_date=now - timedelta(days=1),
+                end_date=now + timedelta(days=1),
+            )
+            for fooditem in fooditems[::3]
+        )
+        return fooditems
@@ -0,0 +1,130 @@
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from cafecustomer.models import Cart, CartItem, Category, DiningTable, FoodItem, Order
+from cafecustomer.tables import claim_table
+from cafecustomer.views import CreateOrderAPIView
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks concurrent checkouts against the configured database profile.
+
+    Every thread checks out the carts of its own customer at its own table,
+    so the threads only contend for the database. Threads commit, so the
+    synthetic customers, tables and menu are deleted once the benchmark is done.
+    """
+
+    help = "Benchmarks checkout write throughput with increasing numbers of threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", nargs="+", type=int, default=[1, 4, 8, 16])
+        parser.add_argument("--checkouts", type=int, default=50, help="Checkouts per thread.")
+        parser.add_argument("--lines", type=int, default=5, help="Cart lines per checkout.")
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        self.stdout.write(f"vendor: {connection.vendor}, options: {settings_dict['OPTIONS']}")
+        self.stdout.write(
+            f"CONN_MAX_AGE: {settings_dict['CONN_MAX_AGE']}, CONN_HEALTH_CHECKS: {settings_dict['CONN_HEALTH_CHECKS']}"
+        )
+
+        category = Category.objects.create(name="benchmark-checkout", description="benchmark")
+        fooditems = FoodItem.objects.bulk_create(
+            FoodItem(category=category, name=f"benchmark-checkout-{i}", price=Decimal("120.00"), description="")
+            for i in range(options["lines"])
+        )
+        users = []
+        tables = []
+
+        self.stdout.write(f"{'threads':>7} {'orders/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'locked':>7} {'failed':>7}")
+
+        try:
+            for thread_count in options["threads"]:
+                while len(users) < thread_count:
+                    number = len(users)
+                    user = User.objects.create_user(
+                        username=f"benchmark-checkout-{number}", password="benchmark", role="customer"
+                    )
+                    table = DiningTable.objects.create(table_number=900000 + number)
+                    claim_table(user, table.id)
+                    users.append(user)
+                    tables.append(table)
+
+                results = [None] * thread_count
+                threads = [
+                    threading.Thread(target=self.check_out, args=(users[i], fooditems, options, results, i))
+                    for i in range(thread_count)
+                ]
+
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+
+                timings = sorted(timing for result in results for timing in result["timings"])
+                locked = sum(result["locked"] for result in results)
+                failed = sum(result["failed"] for result in results)
+
+                self.stdout.write(
+                    f"{thread_count:>7} {len(timings) / elapsed:>9.1f} {statistics.median(timings) if timings else 0:>8.1f} "
+                    f"{timings[int(len(timings) * 0.95)] if timings else 0:>8.1f} {locked:>7} {failed:>7}"
+                )
+        finally:
+            Order.objects.filter(user__in=users).delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+            DiningTable.objects.filter(id__in=[table.id for table in tables]).delete()
+            category.delete()
+
+    def check_out(self, user, fooditems, options, results, index):
+        view = CreateOrderAPIView.as_view()
+        factory = APIRequestFactory()
+        result = {"timings": [], "locked": 0, "failed": 0}
+
+        try:
+            cart, _ = Cart.objects.get_or_create(user=user)
+
+            for _ in range(options["checkouts"]):
+                request = factory.post("/api/customer/create-order/", {}, format="json")
+                force_authenticate(request, user=user)
+
+                start = time.perf_counter()
+                try:
+                    CartItem.objects.bulk_create(
+                        CartItem(cart=cart, fooditem=fooditem, quantity=2) for fooditem in fooditems
+                    )
+                    response = view(request)
+                except OperationalError:
+                    # "database is locked", the busy timeout ran out
+                    result["locked"] += 1
+                    self.empty_cart(cart)
+                    continue
+
+                if response.status_code == 201:
+                    result["timings"].append((time.perf_counter() - start) * 1000)
+                else:
+                    result["failed"] += 1
+                    self.empty_cart(cart)
+        finally:
+            results[index] = result
+            connection.close()
+
+    def empty_cart(self, cart):
+        """
+        Drops the leftovers of a failed checkout, so they don't pile up in the cart.
+        """
+        try:
+            cart.clear()
+        except OperationalError:
+            pass
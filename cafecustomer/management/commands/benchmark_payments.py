@@ -0,0 +1,81 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from cafebackend.workers import get_pool
+from cafecustomer import payments
+from cafecustomer.models import Order, PaymentAttempt
+from cafecustomer.views import PaymentAPIView
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the payment endpoint against a fake gateway of increasing latency.
+
+    Payments are charged by the worker pool in other threads, so the
+    synthetic orders are committed and deleted once the benchmark is done.
+    """
+
+    help = "Benchmarks payment request and settlement throughput as gateway latency rises."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--latencies", nargs="+", type=float, default=[0.0, 0.05, 0.2, 0.5])
+        parser.add_argument("--failure-rate", type=float, default=0.0)
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username="benchmark-payments", password="benchmark", role="customer")
+        view = PaymentAPIView.as_view()
+        factory = APIRequestFactory()
+        pool = get_pool("payments")
+        gateway = payments._gateway
+
+        self.stdout.write(f"workers: {pool.max_workers}, queue: {pool.max_queue}")
+        self.stdout.write(
+            f"{'latency s':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'503s':>5} {'settled/s':>10} {'settled':>8}"
+        )
+
+        try:
+            for latency in options["latencies"]:
+                payments._gateway = payments.FakeGateway(latency=latency, failure_rate=options["failure_rate"])
+                orders = Order.objects.bulk_create(
+                    Order(user=user, total_price=Decimal("250.00")) for _ in range(options["requests"])
+                )
+
+                timings = []
+                rejected = 0
+                start = time.perf_counter()
+
+                for order in orders:
+                    request = factory.post("/api/customer/make-payment/", {"order_id": str(order.id)}, format="json")
+                    force_authenticate(request, user=user)
+
+                    request_start = time.perf_counter()
+                    response = view(request)
+                    timings.append((time.perf_counter() - request_start) * 1000)
+                    rejected += response.status_code == 503
+
+                accepted_in = time.perf_counter() - start
+
+                while pool.pending:
+                    time.sleep(0.01)
+
+                settled_in = time.perf_counter() - start
+                settled = PaymentAttempt.objects.filter(
+                    order__user=user, order__in=orders, status__in=[PaymentAttempt.SUCCEEDED, PaymentAttempt.FAILED]
+                ).count()
+
+                timings.sort()
+                self.stdout.write(
+                    f"{latency:>9.2f} {len(orders) / accepted_in:>9.0f} {statistics.median(timings):>8.2f} "
+                    f"{timings[int(len(timings) * 0.95)]:>8.2f} {rejected:>5} {settled / settled_in:>10.1f} {settled:>8}"
+                )
+        finally:
+            payments._gateway = gateway
+            user.delete()
@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from cafecustomer.search import FOODITEM, CATEGORY, MenuSearchIndex
+
+
+SYLLABLES = [
+    "ba", "ko", "ri", "ma", "ne", "lu", "sa", "to", "vi", "de", "chi", "pa",
+    "mo", "ke", "ra", "zu", "ni", "go", "fe", "la", "shu", "ta", "we", "yo",
+]
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks menu search lookups on a synthetic catalogue.
+
+    The catalogue is indexed in memory only, nothing is written to the database.
+    """
+
+    help = "Benchmarks exact, prefix and typo-tolerant menu search lookups."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=50000)
+        parser.add_argument("--queries", type=int, default=2000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vocabulary = sorted({self.make_word(rng) for _ in range(8000)})
+
+        index = MenuSearchIndex()
+
+        start = time.perf_counter()
+        for i in range(200):
+            index.add(CATEGORY, uuid.uuid4(), " ".join(rng.sample(vocabulary, 2)), " ".join(rng.sample(vocabulary, 6)))
+        for i in range(options["items"]):
+            index.add(FOODITEM, uuid.uuid4(), " ".join(rng.sample(vocabulary, 3)), " ".join(rng.sample(vocabulary, 10)))
+        build = time.perf_counter() - start
+
+        self.stdout.write(f"indexed {len(index)} documents in {build:.2f}s")
+        self.stdout.write(f"{'lookup':>8} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'hits':>6}")
+
+        lookups = {
+            "exact": lambda word: word,
+            "prefix": lambda word: word[:4],
+            "typo": lambda word: self.make_typo(rng, word),
+            "2 words": lambda word: f"{word} {rng.choice(vocabulary)[:3]}",
+        }
+
+        for name, make_query in lookups.items():
+            timings = []
+            hits = 0
+            for _ in range(options["queries"]):
+                query = make_query(rng.choice(vocabulary))
+                start = time.perf_counter()
+                hits += len(index.search(query))
+                timings.append((time.perf_counter() - start) * 1_000_000)
+
+            timings.sort()
+            self.stdout.write(
+                f"{name:>8} {statistics.mean(timings):>9.1f} {timings[len(timings) // 2]:>9.1f} "
+                f"{timings[int(len(timings) * 0.95)]:>9.1f} {hits / len(timings):>6.1f}"
+            )
+
+    def make_word(self, rng):
+        return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+    def make_typo(self, rng, word):
+        position = rng.randrange(len(word))
+        return word[:position] + rng.choice("aeiouxyz") + word[position + 1:]
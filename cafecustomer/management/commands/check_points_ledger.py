@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cafecustomer.myutils import ledger_mismatches, open_ledgers
+
+
+class Command(BaseCommand):
+    """
+    Compares the stored points of every customer with their ledger.
+    """
+
+    help = "Reports the customers whose points differ from their ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--open", action="store_true",
+            help="First open the ledger of customers holding points from before the ledger existed.",
+        )
+
+    def handle(self, *args, **options):
+        if options["open"]:
+            self.stdout.write(f"Opened {open_ledgers()} ledgers.")
+
+        mismatches = ledger_mismatches()
+
+        for user_id, (stored, ledger) in mismatches.items():
+            self.stdout.write(self.style.ERROR(f"{user_id}: stored {stored}, ledger {ledger}"))
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("Every balance matches its ledger."))
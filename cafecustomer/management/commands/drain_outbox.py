@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cafecustomer.outbox import BATCH_SIZE, drain_outbox
+
+
+class Command(BaseCommand):
+    """
+    Handles the pending outbox events, e.g after a restart or to run the
+    dispatcher in its own process.
+    """
+
+    help = "Drains the pending outbox events."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Keep draining new events.")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds between drains with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            handled = drain_outbox(batch_size=options["batch_size"])
+
+            if handled or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Handled {handled} outbox events."))
+
+            if not options["loop"]:
+                break
+
+            time.sleep(options["interval"])
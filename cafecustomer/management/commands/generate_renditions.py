@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from cafecustomer.models import FoodItem
+from cafecustomer.renditions import generate_renditions
+
+
+class Command(BaseCommand):
+    """
+    Generates the image renditions missing for fooditems, e.g for images
+    uploaded before renditions existed or while the worker pool was saturated.
+    """
+
+    help = "Generates the missing fooditem image renditions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Regenerate the renditions of every fooditem.")
+
+    def handle(self, *args, **options):
+        fooditems = FoodItem.objects.all() if options["all"] else FoodItem.objects.filter(image_hash="")
+        generated = 0
+
+        for fooditem_id in fooditems.values_list("id", flat=True).iterator():
+            if generate_renditions(fooditem_id):
+                generated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Generated renditions for {generated} fooditems."))
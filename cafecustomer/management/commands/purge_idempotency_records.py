@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cafecustomer.models import IdempotencyRecord
+
+
+class Command(BaseCommand):
+    """
+    Deletes the expired idempotency records in small batches, so the
+    table stays compact without long running deletes.
+    """
+
+    help = "Deletes the expired idempotency records."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+
+        while True:
+            ids = list(
+                IdempotencyRecord.objects.filter(expires_at__lte=now)
+                .values_list("id", flat=True)[:options["batch_size"]]
+            )
+
+            if not ids:
+                break
+
+            deleted += IdempotencyRecord.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency records."))
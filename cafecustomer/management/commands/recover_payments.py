@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from cafecustomer.payments import STALE_PENDING_SECONDS, STALE_PROCESSING_SECONDS, recover_payments
+
+
+class Command(BaseCommand):
+    """
+    Recovers the payment attempts lost by the payments pool, e.g queued or
+    being charged when the server restarted. Meant to run at startup and
+    periodically.
+    """
+
+    help = "Schedules stale pending payments again and settles stale processing ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pending-after", type=float, default=STALE_PENDING_SECONDS)
+        parser.add_argument("--processing-after", type=float, default=STALE_PROCESSING_SECONDS)
+
+    def handle(self, *args, **options):
+        scheduled, finalized = recover_payments(
+            pending_after=options["pending_after"], processing_after=options["processing_after"]
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"Scheduled {scheduled} payments again, settled {finalized}."))
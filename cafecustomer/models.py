@@ -1,4 +1,5 @@
 import uuid
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -46,6 +47,7 @@ class FoodItem(models.Model):
         created_at (DateTimeField): Timestamp when the fooditem was created.
         updated_at (DateTimeField): Timestamp when the fooditem was updated.
         is_available (BooleanField): Availability of the fooditem.
+        image_hash (CharField): sha256 of the image, addressing its renditions.
 
     """
 
@@ -66,10 +68,23 @@ class FoodItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_available = models.BooleanField("Availability", default=False)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+
+    # the image name last read from the database, used to detect new uploads
+    _loaded_image = None
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        if "image" in instance.__dict__:
+            instance._loaded_image = instance.image.name
+
+        return instance
+
 
 class DiningTable(models.Model):
     """
@@ -113,6 +128,10 @@ class SpecialOffer(models.Model):
 
     class Meta:
         verbose_name_plural = "SpecialOffers"
+        indexes = [
+            # serves the active offer lookup used when pricing cartitems
+            models.Index(fields=["fooditem", "start_date", "end_date"], name="specialoffer_active_idx"),
+        ]
 
     OFFER_CHOICES = (
         ('CHRISTMAS','Christmas'),
@@ -171,17 +190,28 @@ class Cart(models.Model):
     Attributes:
         id (UUIDField): Unique identifier for the cart.
         user(ForeignKey): the user to whom the cart belongs to.
+        subtotal (DecimalField): the cartitems total before special offers.
+        discount (DecimalField): the amount taken off by special offers.
+        item_count (PositiveIntegerField): the total quantity of the cartitems.
+        totals_expire_at (DateTimeField): when a special offer affecting the
+            cartitems next starts or ends, making the stored totals stale.
     """
 
     class Meta:
         verbose_name_plural = "Carts"
 
+    TOTAL_FIELDS = ["subtotal", "discount", "item_count", "totals_expire_at"]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.OneToOneField(
         User,
         related_name="cart",
         on_delete=models.CASCADE
     )
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    totals_expire_at = models.DateTimeField(blank=True, null=True)
 
 
     def __str__(self):
@@ -190,9 +220,48 @@ class Cart(models.Model):
     @property
     def total_price(self):
         """
-        Dynamically Calculates the total price based on the cartitems.
+        Gets the total price from the stored cart totals, as read with the
+        cart, recomputed only once they expired.
+        """
+        return self.get_totals()["total_price"]
+
+    def get_totals(self, resolver=None):
+        """
+        Gets the stored cart totals, recomputing them once a special offer
+        affecting the cartitems has started or ended.
+
+        Args:
+            resolver (OfferPriceResolver): resolver to share the resolved
+                offers with when the totals have to be recomputed.
+
+        Returns:
+            dict: the subtotal, discount, total price and item count.
+        """
+        if self.totals_expire_at is not None and self.totals_expire_at <= timezone.now():
+            # imported here since pricing depends on the models in this module
+            from .pricing import recalculate_cart_totals
+
+            recalculate_cart_totals(self, resolver)
+
+        return {
+            "subtotal": self.subtotal,
+            "discount": self.discount,
+            "total_price": self.subtotal - self.discount,
+            "item_count": self.item_count,
+        }
+
+    def clear(self):
+        """
+        Removes all the cartitems and resets the stored totals.
         """
-        return sum(item.total_price for item in self.cartitems.all())
+        # imported here since pricing depends on the models in this module
+        from .pricing import suspend_cart_tracking
+
+        with suspend_cart_tracking():
+            self.cartitems.all().delete()
+
+        Cart.objects.filter(id=self.id).update(subtotal=0, discount=0, item_count=0, totals_expire_at=None)
+        self.refresh_from_db(fields=self.TOTAL_FIELDS)
         
 
 class CartItem(models.Model):
@@ -231,27 +300,37 @@ class CartItem(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # the fooditem and quantity last read from or written to the database,
+    # used to apply the change of a line to the stored cart totals
+    _loaded_values = None
+
     def __str__(self):
         return f"{self.quantity} x {self.fooditem.name}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+
+        if "fooditem_id" in instance.__dict__ and "quantity" in instance.__dict__:
+            instance._loaded_values = (instance.fooditem_id, instance.quantity)
+
+        return instance
     
     @property
     def price(self):
         """
         Gets the price of the fooditem dynamically, considering specialoffers.
         """
-        price = self.fooditem.price
+        resolver = getattr(self, "_price_resolver", None)
 
-        # checks if the fooditem has a specialoffer
-        specialoffers = SpecialOffer.objects.all()
+        if resolver is None:
+            # imported here since pricing depends on the models in this module
+            from .pricing import OfferPriceResolver
 
-        for offer in specialoffers:
-            if offer.is_active:
-                if offer.fooditem == self.fooditem:
-                    discount = (offer.discount_percentage / 100) * price
-                    price -= discount
-                    break
+            resolver = OfferPriceResolver()
+            self._price_resolver = resolver
 
-        return price 
+        return resolver.price_for(self.fooditem)
     
     @property
     def total_price(self):
@@ -273,13 +352,26 @@ class Order(models.Model):
         is_paid (BooleanField): indicates if an order has been paid for.
         estimated_time (IntegerField): estimated delivery time for the order
         status (CharField): the order status
+        rolled_up (BooleanField): indicates if the paid order was added to the sales rollups.
         created_at (DateTimeField): Timestamp when the order was created.
         updated_at (DateTimeField): Timestamp when the order was updated.
     """
 
     class Meta:
         verbose_name_plural = "Orders"
-        ordering = ['-updated_at']
+        ordering = ['-updated_at', 'id']
+        indexes = [
+            # serves the keyset pages of a user's order history
+            models.Index(fields=["user", "-updated_at", "id"], name="order_history_idx"),
+            # serves the kitchen queue, oldest orders of a status first
+            models.Index(fields=["status", "created_at"], name="order_queue_idx"),
+            # serves the sales rollup backfill, only paid orders not rolled up yet
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_paid=True, rolled_up=False),
+                name="order_rollup_pending_idx",
+            ),
+        ]
 
     
     ESTIMATED_TIME_CHOICES = [(i, f"{i} minutes") for i in range(5, 65, 5)]
@@ -290,6 +382,17 @@ class Order(models.Model):
         ("DELIVERED", "Delivered"),
     )
 
+    # the statuses an order can move to from each status
+    STATUS_TRANSITIONS = {
+        "PENDING": ("READY",),
+        "READY": ("DELIVERED",),
+        "DELIVERED": ("COMPLETE",),
+        "COMPLETE": (),
+    }
+
+    # the statuses of orders still handled by the kitchen
+    OPEN_STATUSES = ("PENDING", "READY", "DELIVERED")
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(
         User,
@@ -306,6 +409,7 @@ class Order(models.Model):
     )
     dining_table = models.ForeignKey(DiningTable, max_length=250, on_delete=models.CASCADE, blank=True, null=True)
     status = models.CharField(max_length=250, default="PENDING", choices=STATUS_CHOICES)
+    rolled_up = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -320,6 +424,107 @@ class Order(models.Model):
         return self.updated_at.date() == timezone.now().date()
     
     
+class OrderLine(models.Model):
+    """
+    Snapshot of a cartitem taken when its order was placed, so the order
+    keeps its prices after the fooditem or its special offers change.
+
+    Attributes:
+        id (UUIDField): Unique identifier for the order line.
+        order (Order): the order the line belongs to.
+        fooditem (FoodItem): the fooditem ordered, kept null if it is deleted.
+        name (CharField): the name of the fooditem when ordered.
+        unit_price (DecimalField): the fooditem price before special offers.
+        discount (DecimalField): the amount taken off the line by special offers.
+        quantity (PositiveIntegerField): the quantity ordered.
+        line_total (DecimalField): the amount charged for the line.
+    """
+
+    class Meta:
+        verbose_name_plural = "Order Lines"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(
+        Order,
+        related_name="lines",
+        on_delete=models.CASCADE
+    )
+    fooditem = models.ForeignKey(
+        FoodItem,
+        related_name="order_lines",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    name = models.CharField(max_length=250)
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2)
+    discount = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    line_total = models.DecimalField(max_digits=8, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.name}"
+
+
+class PaymentAttempt(models.Model):
+    """
+    Defines an attempt to pay for an order through the payment gateway.
+
+    Attempts are processed in the background, an order has at most one
+    attempt pending or processing at a time.
+
+    Attributes:
+        id (UUIDField): Unique identifier for the payment attempt.
+        order (Order): the order being paid for.
+        amount (DecimalField): the amount charged.
+        status (CharField): the status of the attempt.
+        gateway_reference (CharField): the reference of the charge at the gateway.
+        error (CharField): why the attempt failed.
+        created_at (DateTimeField): Timestamp when the attempt was created.
+        updated_at (DateTimeField): Timestamp when the attempt was updated.
+    """
+
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (PROCESSING, "Processing"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    )
+
+    ACTIVE_STATUSES = (PENDING, PROCESSING)
+
+    class Meta:
+        verbose_name_plural = "Payment Attempts"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order"],
+                condition=models.Q(status__in=["PENDING", "PROCESSING"]),
+                name="payment_one_active_per_order",
+            ),
+        ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(
+        Order,
+        related_name="payment_attempts",
+        on_delete=models.CASCADE
+    )
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    status = models.CharField(max_length=20, default=PENDING, choices=STATUS_CHOICES)
+    gateway_reference = models.CharField(max_length=250, blank=True)
+    error = models.CharField(max_length=250, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Payment of {self.amount} for Order {self.order_id}: {self.status}"
+
+
 class Notification(models.Model):
     """
     Model for storing in-app notification for users.
@@ -328,16 +533,22 @@ class Notification(models.Model):
         id (UUIDField): Unique identifier for the notification.
         user(User): the user to whom the notification belongs.
         message(TextField): the body of the notification
+        order(Order): the paid order the notification is about, if any.
         created_at (DateTimeField): Timestamp when the notification was created.
        
     """
 
     class Meta:
         verbose_name_plural = "Notifications"
+        constraints = [
+            # a paid order is notified once, however often its event is handled
+            models.UniqueConstraint(fields=["user", "order"], name="notification_user_order_uniq"),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, related_name="notifications", on_delete=models.CASCADE)
     message = models.TextField()
+    order = models.ForeignKey(Order, related_name="notifications", on_delete=models.CASCADE, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self) -> str:
@@ -359,6 +570,10 @@ class Review(models.Model):
 
     class Meta:
         verbose_name_plural = "Reviews"
+        indexes = [
+            # serves the keyset pages of a user's reviews
+            models.Index(fields=["user", "-created_at", "id"], name="review_history_idx"),
+        ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(
@@ -386,6 +601,7 @@ class CustomerPoint(models.Model):
         id (UUIDField): Unique identifier for customerpoint.
         user(User): the user to whom the points belong to.
         points(PositiveIntegerField):points awarded
+        unchecked_entries(PositiveIntegerField): ledger entries appended since the last checkpoint
 
     """
 
@@ -395,10 +611,67 @@ class CustomerPoint(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="customerpoints")
     points = models. PositiveIntegerField(default=0)
+    unchecked_entries = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return f"{self.user.username} has {self.points} points"
 
+
+class PointsEntry(models.Model):
+    """
+    Append-only ledger of the points earned and redeemed by customers.
+
+    Every change of CustomerPoint.points appends an entry in the same
+    transaction. Checkpoint entries record the balance after every entry
+    before them, so a balance is recomputed from the last checkpoint
+    rather than from the whole ledger.
+
+    Attributes:
+        id (BigAutoField): the sequence number of the entry.
+        user (User): the customer whose points changed.
+        kind (CharField): earned, redeemed or checkpoint.
+        points (IntegerField): the points added, negative when redeemed.
+        balance (PositiveIntegerField): the balance at a checkpoint.
+        order (Order): the paid order points were earned for.
+        redemption (RedemptionTransaction): the redemption points were spent on.
+        created_at (DateTimeField): timestamp when the entry was appended.
+    """
+
+    EARN = "EARN"
+    REDEEM = "REDEEM"
+    CHECKPOINT = "CHECKPOINT"
+
+    KIND_CHOICES = (
+        (EARN, "Earned"),
+        (REDEEM, "Redeemed"),
+        (CHECKPOINT, "Checkpoint"),
+    )
+
+    class Meta:
+        verbose_name_plural = "Points Entries"
+        indexes = [
+            # serves the entries of a customer after their last checkpoint
+            models.Index(fields=["user", "id"], name="points_entry_user_idx"),
+        ]
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, related_name="points_entries", on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    points = models.IntegerField(default=0)
+    balance = models.PositiveIntegerField(blank=True, null=True)
+    order = models.ForeignKey("Order", related_name="points_entries", on_delete=models.SET_NULL, blank=True, null=True)
+    redemption = models.ForeignKey(
+        "RedemptionTransaction",
+        related_name="points_entries",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.points} points for {self.user}"
+
 class Transaction(models.Model):
     """
     Defines the transaction for the points awarded to the user.
@@ -406,6 +679,7 @@ class Transaction(models.Model):
     Attributes:
         id (UUIDField): Unique identifier for transaction.
         customer_point(CustomerPoint): the customerpoint instance.
+        order(Order): the paid order the points were awarded for.
         amount(DecimalField): the order total 
         points_earned(PositiveIntegerField):points awarded based on the order total
         date(DateTimeField): timestamp when the transaction was created
@@ -416,6 +690,14 @@ class Transaction(models.Model):
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     customer_point = models.ForeignKey(CustomerPoint, on_delete=models.CASCADE)
+    # points are awarded once per order
+    order = models.OneToOneField(
+        Order,
+        related_name="points_transaction",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True
+    )
     amount = models.DecimalField(max_digits=10, decimal_places=2) # order total 
     points_earned = models.PositiveIntegerField() # points awarded based on the order total
     date = models.DateTimeField(auto_now_add=True)
@@ -469,4 +751,133 @@ class RedemptionTransaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.customer} redeemed {self.points_redeemed} points"
\ No newline at end of file
+        return f"{self.customer} redeemed {self.points_redeemed} points"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Stores the response of a POST request sent with an Idempotency-Key
+    header, so a retry of the same request gets it back without running
+    the view again.
+
+    Attributes:
+        id (UUIDField): Unique identifier for the record.
+        user (User): the user who sent the request, keys are scoped per user.
+        key (CharField): the Idempotency-Key header of the request.
+        fingerprint (CharField): the sha256 of the request method, path and body.
+        status_code (PositiveSmallIntegerField): the response status, null
+            while the request is still being handled.
+        response_body (JSONField): the response data.
+        response_headers (JSONField): the response headers replayed with it, e.g Location.
+        created_at (DateTimeField): timestamp when the record was created.
+        expires_at (DateTimeField): when the key can be reused.
+    """
+
+    class Meta:
+        verbose_name_plural = "Idempotency Records"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="idempotency_user_key_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["expires_at"], name="idempotency_expiry_idx"),
+        ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name="idempotency_records", on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, blank=True, null=True)
+    response_headers = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Idempotency key {self.key} of {self.user}"
+
+
+class OutboxEvent(models.Model):
+    """
+    An event recorded in the same transaction as the change it describes,
+    and handled afterwards by the outbox dispatcher.
+
+    Events are numbered in the order they were recorded and drained in
+    that order.
+
+    Attributes:
+        id (BigAutoField): the sequence number of the event.
+        topic (CharField): the kind of event, e.g "order.paid".
+        payload (JSONField): the event data.
+        created_at (DateTimeField): timestamp when the event was recorded.
+        processed_at (DateTimeField): timestamp when the event was handled.
+        attempts (PositiveSmallIntegerField): the number of failed attempts to handle the event.
+        last_error (TextField): the error of the last failed attempt.
+    """
+
+    class Meta:
+        verbose_name_plural = "Outbox Events"
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="outbox_pending_idx",
+            ),
+        ]
+
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.topic} #{self.id}"
+
+
+class SalesRollup(models.Model):
+    """
+    Sales of a day, in total or for a single fooditem, category or dining
+    table, maintained as orders are paid so reports never scan the orders.
+
+    Attributes:
+        id (BigAutoField): Unique identifier for the rollup.
+        day (DateField): the day the orders were placed.
+        dimension (CharField): what the sales are grouped by.
+        key (CharField): the id of the fooditem, category or table, empty for the day total.
+        label (CharField): the name of the fooditem, category or table when last sold.
+        revenue (DecimalField): the amount sold.
+        order_count (PositiveIntegerField): the number of paid orders.
+        quantity (PositiveIntegerField): the number of items sold.
+    """
+
+    TOTAL = "total"
+    FOODITEM = "fooditem"
+    CATEGORY = "category"
+    TABLE = "table"
+
+    DIMENSION_CHOICES = (
+        (TOTAL, "Total"),
+        (FOODITEM, "Food item"),
+        (CATEGORY, "Category"),
+        (TABLE, "Dining table"),
+    )
+
+    class Meta:
+        verbose_name_plural = "Sales Rollups"
+        constraints = [
+            models.UniqueConstraint(fields=["dimension", "day", "key"], name="salesrollup_dimension_day_key_uniq"),
+        ]
+
+    id = models.BigAutoField(primary_key=True)
+    day = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=36, blank=True)
+    label = models.CharField(max_length=250, blank=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.dimension} {self.key} sales on {self.day}"
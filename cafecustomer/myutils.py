@@ -1,4 +1,11 @@
-from .models import Order, CustomerPoint, Transaction, RedemptionTransaction
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import CustomerPoint, PointsEntry, RedemptionTransaction
+
+
+# a checkpoint is appended to a customer's ledger every this many entries
+CHECKPOINT_INTERVAL = 100
 
 
 def calculate_points(total_price):
@@ -9,52 +16,122 @@ def calculate_points(total_price):
 
     return int(total_price/100)
 
-def assign_points(order:Order):
-    """
-    Awards points to users and creates a transaction for it.
-    """
-    user = order.user
-    total_price = order.total_price
-    points = calculate_points(total_price=total_price)
-    
-    # gets or creates a customer_point object and assigns points
-    customer_point, created = CustomerPoint.objects.get_or_create(user=user)
-    customer_point.points += points
-    customer_point.save()
-
-    # creates a new transaction for the point assigned
-    new_transaction = Transaction.objects.create(
-        customer_point=customer_point,
-        amount=total_price,
-        points_earned=points
-    )
-
-
 def redeem_points(user,redemption_option):
     """
     Redeems customerpoints and creates a transaction for it.
-    """ 
 
-    user_points = user.customerpoints
+    The points are taken with a single update guarded by the balance, so
+    concurrent redemptions can never spend more than the customer has.
+    """
+
     points_redeemed = redemption_option.points_required
 
-    # if user points is >= to points required, a redemption transaction is created for the user
-    if user_points.points >= points_redeemed:
+    with transaction.atomic():
+        # reduce customer points, only if user points is >= to points required
+        redeemed = CustomerPoint.objects.filter(user=user, points__gte=points_redeemed).update(
+            points=F("points") - points_redeemed, unchecked_entries=F("unchecked_entries") + 1
+        )
+
+        if not redeemed:
+            return None
+
+        # a redemption transaction is created for the user
         redemption_transaction = RedemptionTransaction.objects.create(
             customer=user,
             redemption_option=redemption_option,
             points_redeemed =  points_redeemed,
         )
+        PointsEntry.objects.create(
+            user=user, kind=PointsEntry.REDEEM, points=-points_redeemed, redemption=redemption_transaction
+        )
+        checkpoint_balances([user.id])
 
-        # reduce customer points
-        user_points.points -= points_redeemed
-        user_points.save()
+    return redemption_transaction
+
+
+def checkpoint_balances(user_ids):
+    """
+    Appends a checkpoint to the ledger of the customers with enough entries
+    since their last one.
 
-        return redemption_transaction
-    
-    return None
-    
+    Must run in the transaction that updated their points, after their
+    entries were appended, so every checkpoint matches the entries before it.
 
-    
+    Args:
+        user_ids (list): the ids of the customers whose points just changed.
+    """
+    due = list(
+        CustomerPoint.objects.filter(user_id__in=user_ids, unchecked_entries__gte=CHECKPOINT_INTERVAL)
+        .values_list("user_id", "points")
+    )
+
+    if not due:
+        return
+
+    PointsEntry.objects.bulk_create(
+        PointsEntry(user_id=user_id, kind=PointsEntry.CHECKPOINT, balance=points) for user_id, points in due
+    )
+    CustomerPoint.objects.filter(user_id__in=[user_id for user_id, _ in due]).update(unchecked_entries=0)
+
+
+def open_ledgers():
+    """
+    Appends an opening checkpoint to the ledger of the customers holding
+    points but no ledger entries, e.g points awarded before the ledger.
+
+    Returns:
+        int: the number of ledgers opened.
+    """
+    with transaction.atomic():
+        missing = list(
+            CustomerPoint.objects.select_for_update()
+            .filter(points__gt=0).exclude(user__points_entries__isnull=False)
+            .values_list("user_id", "points")
+        )
+        PointsEntry.objects.bulk_create(
+            PointsEntry(user_id=user_id, kind=PointsEntry.CHECKPOINT, balance=points) for user_id, points in missing
+        )
+
+    return len(missing)
+
+
+def ledger_balance(user_id):
+    """
+    Recomputes a customer's balance from their ledger, reading only the
+    entries after their last checkpoint.
+
+    Returns:
+        int: the balance.
+    """
+    entries = PointsEntry.objects.filter(user_id=user_id)
+    checkpoint = entries.filter(kind=PointsEntry.CHECKPOINT).order_by("-id").values_list("id", "balance").first()
+
+    if checkpoint is not None:
+        entries = entries.filter(id__gt=checkpoint[0])
+
+    balance = checkpoint[1] if checkpoint is not None else 0
+
+    return balance + (entries.exclude(kind=PointsEntry.CHECKPOINT).aggregate(total=Sum("points"))["total"] or 0)
+
+
+def ledger_mismatches(user_ids=None):
+    """
+    Compares the stored balances with the ledger.
+
+    Args:
+        user_ids (list): the customers to check, every customer by default.
+
+    Returns:
+        dict: the (stored, ledger) balances of the customers that differ.
+    """
+    balances = CustomerPoint.objects.all()
+    if user_ids is not None:
+        balances = balances.filter(user_id__in=user_ids)
 
+    mismatches = {}
+    for user_id, points in balances.values_list("user_id", "points").iterator():
+        ledger = ledger_balance(user_id)
+        if ledger != points:
+            mismatches[user_id] = (points, ledger)
 
+    return mismatches
@@ -0,0 +1,300 @@
+"""
+Transactional outbox.
+
+Side effects of a change (points, notifications, sales rollups, ...) are recorded as
+OutboxEvents in the same transaction as the change, so they are never
+lost nor applied for a change that rolled back. The dispatcher drains the
+events in batches on the outbox worker pool, or from the drain_outbox
+command, and hands every batch to the handlers of its topic.
+
+A batch is claimed and handled in a single transaction, a handler error
+rolls back both, so every event is applied exactly once. The events of a
+failed batch are then retried one at a time, so only the failing ones
+count an attempt and the others are not held back.
+"""
+
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from cafebackend.workers import PoolSaturated, submit
+from .models import CustomerPoint, Notification, Order, OutboxEvent, PointsEntry, Transaction
+from .myutils import calculate_points, checkpoint_balances
+from .rollups import rollup_orders
+from .signals import order_paid, publish_notification
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_PAID = "order.paid"
+
+BATCH_SIZE = 100
+
+# events failing this many times are left for inspection
+MAX_ATTEMPTS = 5
+
+# the handlers of every topic, called with a batch of events
+_handlers = defaultdict(list)
+
+
+def handles(topic):
+    """
+    Registers a function handling the batches of events of a topic.
+    """
+    def register(handler):
+        _handlers[topic].append(handler)
+        return handler
+
+    return register
+
+
+def record_event(topic, payload):
+    """
+    Records an event in the current transaction and drains the outbox
+    once it commits.
+
+    Args:
+        topic (str): the kind of event.
+        payload (dict): the event data.
+
+    Returns:
+        OutboxEvent: the recorded event.
+    """
+    event = OutboxEvent.objects.create(topic=topic, payload=payload)
+    transaction.on_commit(schedule_drain)
+    return event
+
+
+def schedule_drain():
+    """
+    Drains the outbox on the outbox worker pool.
+    """
+    try:
+        submit("outbox", drain_outbox)
+    except PoolSaturated:
+        # a drain is already queued and will pick the new events up
+        pass
+
+
+def pending_events():
+    return OutboxEvent.objects.filter(processed_at__isnull=True, attempts__lt=MAX_ATTEMPTS).order_by("id")
+
+
+def drain_outbox(batch_size=BATCH_SIZE, max_batches=None):
+    """
+    Handles the pending events, oldest first, a batch at a time.
+
+    Args:
+        batch_size (int): the number of events handled per transaction.
+        max_batches (int): stops after this many batches.
+
+    Returns:
+        int: the number of events handled.
+    """
+    handled = 0
+    batches = 0
+    # events failing during this drain are left for the next one
+    failed = set()
+
+    while max_batches is None or batches < max_batches:
+        failures = len(failed)
+        count = drain_batch(batch_size, failed)
+
+        # the outbox is empty, but for the events that failed
+        if not count and len(failed) == failures:
+            break
+
+        handled += count
+        batches += 1
+
+    return handled
+
+
+def drain_batch(batch_size=BATCH_SIZE, failed=None):
+    """
+    Claims and handles one batch of pending events, one event at a time
+    when the batch fails.
+
+    Args:
+        batch_size (int): the number of events claimed.
+        failed (set): the ids of the events that already failed, skipped.
+            The ids of the events failing now are added to it.
+
+    Returns:
+        int: the number of events handled, 0 when the outbox is empty or
+        every event of the batch failed.
+    """
+    ids = []
+    failed = set() if failed is None else failed
+
+    try:
+        with transaction.atomic():
+            ids = list(
+                pending_events().exclude(id__in=failed).select_for_update(skip_locked=True)
+                .values_list("id", flat=True)[:batch_size]
+            )
+
+            if not ids:
+                return 0
+
+            return handle_events(ids)
+    except Exception:
+        logger.exception("Failed to handle outbox events %s, retrying them one at a time", ids)
+
+    handled = 0
+    for event_id in ids:
+        if drain_event(event_id):
+            handled += 1
+        else:
+            failed.add(event_id)
+
+    return handled
+
+
+def drain_event(event_id):
+    """
+    Claims and handles a single pending event, counting an attempt when it fails.
+
+    Returns:
+        int: 1 when the event was handled, 0 otherwise.
+    """
+    try:
+        with transaction.atomic():
+            # another drain may have handled the event since
+            ids = list(
+                pending_events().filter(id=event_id).select_for_update(skip_locked=True)
+                .values_list("id", flat=True)
+            )
+
+            return handle_events(ids) if ids else 0
+    except Exception as exc:
+        logger.exception("Failed to handle outbox event %s", event_id)
+        OutboxEvent.objects.filter(id=event_id, processed_at__isnull=True).update(
+            attempts=F("attempts") + 1, last_error=repr(exc)
+        )
+        return 0
+
+
+def handle_events(ids):
+    """
+    Marks the events handled and hands them to the handlers of their topic,
+    in the current transaction.
+
+    Returns:
+        int: the number of events handled.
+    """
+    # only the events still pending are claimed
+    now = timezone.now()
+    OutboxEvent.objects.filter(id__in=ids, processed_at__isnull=True).update(processed_at=now)
+    events = list(OutboxEvent.objects.filter(id__in=ids, processed_at=now).order_by("id"))
+
+    by_topic = defaultdict(list)
+    for event in events:
+        by_topic[event.topic].append(event)
+
+    for topic, topic_events in by_topic.items():
+        for handler in _handlers[topic]:
+            handler(topic_events)
+
+    return len(events)
+
+
+@handles(ORDER_PAID)
+def award_points(events):
+    """
+    Awards the points of paid orders of 100 or more, with one Transaction
+    and one ledger entry per order and a single update of the CustomerPoints.
+    """
+    awarded = {}
+    for event in events:
+        points = calculate_points(Decimal(event.payload["total_price"]))
+        if points:
+            awarded[event.payload["order"]] = (event.payload["user"], event.payload["total_price"], points)
+
+    # orders already awarded (e.g before the outbox existed) are skipped
+    for order_id in Transaction.objects.filter(order_id__in=awarded).values_list("order_id", flat=True):
+        awarded.pop(str(order_id), None)
+
+    if not awarded:
+        return
+
+    per_user = defaultdict(int)
+    entries_per_user = defaultdict(int)
+    for user_id, total_price, points in awarded.values():
+        per_user[user_id] += points
+        entries_per_user[user_id] += 1
+
+    def per_user_value(values):
+        return Case(
+            *[When(user_id=user_id, then=Value(value)) for user_id, value in values.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+
+    CustomerPoint.objects.bulk_create(
+        [CustomerPoint(user_id=user_id) for user_id in per_user], ignore_conflicts=True
+    )
+    CustomerPoint.objects.filter(user_id__in=per_user).update(
+        points=F("points") + per_user_value(per_user),
+        unchecked_entries=F("unchecked_entries") + per_user_value(entries_per_user),
+    )
+
+    customer_points = dict(CustomerPoint.objects.filter(user_id__in=per_user).values_list("user_id", "id"))
+    customer_points = {str(user_id): point_id for user_id, point_id in customer_points.items()}
+
+    Transaction.objects.bulk_create([
+        Transaction(
+            customer_point_id=customer_points[str(user_id)],
+            order_id=order_id,
+            amount=total_price,
+            points_earned=points,
+        )
+        for order_id, (user_id, total_price, points) in awarded.items()
+    ])
+    PointsEntry.objects.bulk_create([
+        PointsEntry(user_id=user_id, kind=PointsEntry.EARN, points=points, order_id=order_id)
+        for order_id, (user_id, total_price, points) in awarded.items()
+    ])
+    checkpoint_balances(list(per_user))
+
+
+@handles(ORDER_PAID)
+def notify_payment(events):
+    """
+    Sends the payment notifications of paid orders with a single insert.
+    """
+    paid = {event.payload["order"]: event.payload["user"] for event in events}
+
+    # orders already notified (e.g by a replayed event) are skipped
+    for order_id in Notification.objects.filter(order_id__in=paid).values_list("order_id", flat=True):
+        paid.pop(str(order_id), None)
+
+    notifications = Notification.objects.bulk_create([
+        Notification(
+            user_id=user_id,
+            order_id=order_id,
+            message=f"Your payment for Order {order_id} has been processed sucessfully",
+        )
+        for order_id, user_id in paid.items()
+    ])
+
+    # bulk_create skips the post_save signal pushing new notifications
+    for notification in notifications:
+        publish_notification(Notification, notification, created=True)
+
+
+@handles(ORDER_PAID)
+def rollup_sales(events):
+    """
+    Adds the paid orders to the sales rollups, and announces the orders
+    added for the first time with the order_paid signal.
+    """
+    prices = {event.payload["order"]: Decimal(event.payload["total_price"]) for event in events}
+    rolled_up = rollup_orders(list(prices))
+
+    if rolled_up:
+        order_paid.send(sender=Order, orders=[(order_id, prices[str(order_id)]) for order_id in rolled_up])
@@ -0,0 +1,274 @@
+import hashlib
+import hmac
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from cafebackend.events import KITCHEN, publish, user_channel
+from cafebackend.workers import PoolSaturated, submit
+from .models import Order, PaymentAttempt
+from .outbox import ORDER_PAID, record_event
+
+
+# finalizing is retried this many times on transient database errors,
+# e.g a locked SQLite database, since the charge can't be redone
+FINALIZE_ATTEMPTS = 5
+
+# attempts left pending or processing this long are recovered, e.g after a restart
+STALE_PENDING_SECONDS = 60
+STALE_PROCESSING_SECONDS = 15 * 60
+
+# the outcome of a charge, None from a gateway means it will call back later
+GatewayResult = namedtuple("GatewayResult", ["succeeded", "reference", "error"])
+
+
+class PaymentGateway:
+    """
+    Client of a payment gateway.
+
+    Gateways answering synchronously return a GatewayResult from charge,
+    gateways reporting the outcome asynchronously return None and later
+    call the payment callback endpoint.
+    """
+
+    def charge(self, attempt):
+        """
+        Charges a payment attempt.
+
+        Args:
+            attempt (PaymentAttempt): the attempt to charge.
+
+        Returns:
+            GatewayResult: the outcome, None if it is reported by callback.
+        """
+        raise NotImplementedError
+
+    def check(self, attempt):
+        """
+        Asks the gateway for the outcome of a charge it was sent, e.g once
+        its worker died or its callback never came.
+
+        Args:
+            attempt (PaymentAttempt): the attempt being processed.
+
+        Returns:
+            GatewayResult: the outcome, None if the gateway doesn't know it.
+        """
+        return None
+
+
+class FakeGateway(PaymentGateway):
+    """
+    Local stand-in for the payment gateway.
+
+    Attributes:
+        latency (float): the seconds every charge takes.
+        failure_rate (float): the share of charges declined, from 0 to 1.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def charge(self, attempt):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._random_lock:
+            declined = self._random.random() < self.failure_rate
+
+        if declined:
+            return GatewayResult(False, "", "Payment declined by the gateway.")
+
+        return GatewayResult(True, f"FAKE-{uuid.uuid4().hex[:12].upper()}", "")
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    Returns the gateway configured by the PAYMENT_GATEWAY setting.
+    """
+    global _gateway
+
+    with _gateway_lock:
+        if _gateway is None:
+            config = settings.PAYMENT_GATEWAY
+            _gateway = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+
+        return _gateway
+
+
+def schedule_payment(attempt):
+    """
+    Charges a payment attempt on the payments worker pool.
+
+    Raises:
+        PoolSaturated: if the pool can't take the attempt.
+    """
+    return submit("payments", process_payment, attempt.id)
+
+
+def process_payment(attempt_id):
+    """
+    Charges a pending payment attempt through the gateway.
+
+    Args:
+        attempt_id (UUID): the id of the payment attempt.
+    """
+    # claims the attempt so it is charged only once
+    claimed = PaymentAttempt.objects.filter(id=attempt_id, status=PaymentAttempt.PENDING).update(
+        status=PaymentAttempt.PROCESSING, updated_at=timezone.now()
+    )
+
+    if not claimed:
+        return
+
+    attempt = PaymentAttempt.objects.select_related("order").get(id=attempt_id)
+
+    try:
+        result = get_gateway().charge(attempt)
+    except Exception as exc:
+        result = GatewayResult(False, "", f"Gateway error: {exc}"[:250])
+
+    if result is None:
+        return
+
+    for retry in range(FINALIZE_ATTEMPTS):
+        try:
+            finalize_payment(attempt_id, result)
+            return
+        except OperationalError:
+            if retry == FINALIZE_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0.05, 0.1) * 2 ** retry)
+
+
+def recover_payments(pending_after=STALE_PENDING_SECONDS, processing_after=STALE_PROCESSING_SECONDS):
+    """
+    Recovers the payment attempts lost by the payments pool, e.g queued or
+    being charged when the process stopped, which would otherwise keep
+    their order from being paid.
+
+    Stale pending attempts are scheduled again, claiming keeps them from
+    being charged twice. Stale processing attempts are checked with the
+    gateway and failed when it doesn't know their outcome, so the
+    customer can pay again.
+
+    Args:
+        pending_after (float): the seconds after which a pending attempt is stale.
+        processing_after (float): the seconds after which a processing attempt is stale.
+
+    Returns:
+        tuple: the number of attempts scheduled again and finalized.
+    """
+    now = timezone.now()
+    scheduled = finalized = 0
+
+    pending = PaymentAttempt.objects.filter(
+        status=PaymentAttempt.PENDING, updated_at__lte=now - timedelta(seconds=pending_after)
+    ).order_by("created_at").values_list("id", flat=True)
+
+    for attempt_id in pending:
+        try:
+            submit("payments", process_payment, attempt_id)
+        except PoolSaturated:
+            # the rest is recovered on the next run
+            break
+        scheduled += 1
+
+    processing = PaymentAttempt.objects.select_related("order").filter(
+        status=PaymentAttempt.PROCESSING, updated_at__lte=now - timedelta(seconds=processing_after)
+    )
+
+    for attempt in processing:
+        try:
+            result = get_gateway().check(attempt)
+        except Exception as exc:
+            result = None
+            error = f"Gateway error: {exc}"[:250]
+        else:
+            error = "The payment timed out. Please try again."
+
+        if result is None:
+            result = GatewayResult(False, "", error)
+
+        finalized += finalize_payment(attempt.id, result)
+
+    return scheduled, finalized
+
+
+def finalize_payment(attempt_id, result):
+    """
+    Records the outcome of a payment attempt and marks its order as paid.
+
+    Called once the gateway answered, either by the worker or from the
+    gateway callback. Outcomes for attempts already finalized are ignored.
+    A successful payment only writes the attempt, the order and an
+    outbox event, its side effects are applied by the outbox dispatcher.
+
+    Args:
+        attempt_id (UUID): the id of the payment attempt.
+        result (GatewayResult): the outcome of the charge.
+
+    Returns:
+        bool: whether the outcome was recorded.
+    """
+    with transaction.atomic():
+        attempt = (
+            PaymentAttempt.objects.select_for_update().select_related("order")
+            .filter(id=attempt_id, status__in=PaymentAttempt.ACTIVE_STATUSES).first()
+        )
+
+        if attempt is None:
+            return False
+
+        order = attempt.order
+        attempt.status = PaymentAttempt.SUCCEEDED if result.succeeded else PaymentAttempt.FAILED
+        attempt.gateway_reference = result.reference
+        attempt.error = result.error
+        attempt.save(update_fields=["status", "gateway_reference", "error", "updated_at"])
+
+        if not result.succeeded:
+            publish([user_channel(order.user_id)], "payment.failed", {"id": attempt.id, "order": order.id, "error": result.error})
+            return True
+
+        Order.objects.filter(id=order.id).update(is_paid=True, updated_at=timezone.now())
+
+        # the points and notification are handled by the outbox dispatcher
+        record_event(ORDER_PAID, {
+            "order": order.id,
+            "user": order.user_id,
+            "total_price": order.total_price,
+            "dining_table": order.dining_table_id,
+        })
+
+        publish([user_channel(order.user_id), KITCHEN], "order.paid", {"id": order.id, "is_paid": True})
+
+    return True
+
+
+def sign_callback(body):
+    """
+    Returns the signature a gateway sends with a callback body.
+    """
+    return hmac.new(settings.PAYMENT_CALLBACK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_callback(body, signature):
+    """
+    Checks the signature of a gateway callback.
+    """
+    return bool(signature) and hmac.compare_digest(sign_callback(body), signature)
@@ -0,0 +1,431 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Min, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from cafebackend.replicas import primary_reads
+
+from .models import FoodItem, SpecialOffer, Cart, CartItem
+
+
+CENT = Decimal("0.01")
+NO_DISCOUNT = Decimal("0")
+
+
+def apply_discount(price, discount_percentage):
+    """
+    Applies a percentage discount to a price.
+
+    Args:
+        price (Decimal): the undiscounted price.
+        discount_percentage (Decimal): the discount e.g 20.00 for 20%.
+
+    Returns:
+        Decimal: the discounted price rounded to the cent.
+    """
+    if not discount_percentage:
+        return price
+
+    discounted = price - (discount_percentage / 100) * price
+    return discounted.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class OfferPriceResolver:
+    """
+    Resolves fooditem prices against the currently active special offers.
+
+    The active offers for a whole set of fooditems are fetched in a single
+    indexed query and memoized, so pricing a cart costs one offer query
+    no matter how many lines it has.
+
+    Attributes:
+        now (datetime): the instant the offers are resolved at.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self._discounts = {}
+
+    def prime(self, fooditem_ids):
+        """
+        Fetches the active discount for every fooditem not resolved yet.
+
+        Args:
+            fooditem_ids (iterable): ids of the fooditems to resolve.
+        """
+        missing = {fooditem_id for fooditem_id in fooditem_ids if fooditem_id not in self._discounts}
+
+        if not missing:
+            return
+
+        offers = SpecialOffer.objects.filter(
+            fooditem_id__in=missing,
+            start_date__lte=self.now,
+            end_date__gte=self.now,
+        ).order_by("start_date", "id").values_list("fooditem_id", "discount_percentage")
+
+        for fooditem_id in missing:
+            self._discounts[fooditem_id] = NO_DISCOUNT
+
+        # the most recently started offer wins when several overlap
+        for fooditem_id, discount_percentage in offers:
+            self._discounts[fooditem_id] = discount_percentage
+
+    def remember(self, fooditem_id, discount_percentage):
+        """
+        Records a discount that has already been resolved elsewhere.
+        """
+        self._discounts[fooditem_id] = discount_percentage or NO_DISCOUNT
+
+    def discount_for(self, fooditem_id):
+        """
+        Returns the active discount percentage for a fooditem.
+        """
+        self.prime([fooditem_id])
+        return self._discounts[fooditem_id]
+
+    def price_for(self, fooditem):
+        """
+        Returns the price of a fooditem after any active special offer.
+        """
+        return apply_discount(fooditem.price, self.discount_for(fooditem.id))
+
+    def bind(self, cartitems):
+        """
+        Resolves the prices for a set of cartitems with a single query.
+
+        Each cartitem keeps a reference to this resolver so its `price`
+        and `total_price` properties reuse the memoized discounts.
+
+        Args:
+            cartitems (iterable): the cartitems, ideally with their
+                fooditem already selected.
+
+        Returns:
+            list: the cartitems.
+        """
+        cartitems = list(cartitems)
+        self.prime(item.fooditem_id for item in cartitems)
+
+        for item in cartitems:
+            item._price_resolver = self
+
+        return cartitems
+
+
+def get_price_resolver(request):
+    """
+    Returns the price resolver memoized for the lifetime of a request.
+
+    Args:
+        request (Request): the DRF or Django request.
+
+    Returns:
+        OfferPriceResolver: the resolver shared by everything handling the request.
+    """
+    http_request = getattr(request, "_request", request)
+    resolver = getattr(http_request, "_price_resolver", None)
+
+    if resolver is None:
+        resolver = OfferPriceResolver()
+        http_request._price_resolver = resolver
+
+    return resolver
+
+
+# the pricing of a single cartitem
+PricedLine = namedtuple(
+    "PricedLine",
+    ["cartitem", "unit_price", "discount_percentage", "price", "discount", "line_total"],
+)
+
+# the pricing of a whole cart
+CartPricing = namedtuple(
+    "CartPricing",
+    ["lines", "subtotal", "discount", "total", "query_count"],
+)
+
+
+class QueryCounter:
+    """
+    Context manager counting the queries run on a connection.
+    """
+
+    def __init__(self, using=connection):
+        self.using = using
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = self.using.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
+
+
+def active_discount(now, fooditem_ref="fooditem"):
+    """
+    Builds a subquery selecting the active discount percentage of a fooditem.
+
+    Args:
+        now (datetime): the instant the offers are resolved at.
+        fooditem_ref (str): the outer field referencing the fooditem.
+
+    Returns:
+        Coalesce: the active discount percentage, 0 when there is no offer.
+    """
+    offers = SpecialOffer.objects.filter(
+        fooditem=OuterRef(fooditem_ref),
+        start_date__lte=now,
+        end_date__gte=now,
+    ).order_by("-start_date", "-id").values("discount_percentage")[:1]
+
+    return Coalesce(
+        Subquery(offers),
+        Value(NO_DISCOUNT),
+        output_field=DecimalField(max_digits=5, decimal_places=2),
+    )
+
+
+@primary_reads()
+def price_cart(cart, resolver=None):
+    """
+    Prices every cartitem in a cart with a single annotated query.
+
+    The cartitems are fetched with their fooditem and the active discount
+    in one query, so the cost stays flat however many lines the cart has.
+
+    Args:
+        cart (Cart): the cart to price.
+        resolver (OfferPriceResolver): resolver to share the resolved
+            discounts with, e.g the one memoized for the request.
+
+    Returns:
+        CartPricing: the priced lines, the cart totals and the number
+        of queries issued.
+    """
+    if resolver is None:
+        resolver = OfferPriceResolver()
+
+    with QueryCounter() as counter:
+        cartitems = list(
+            CartItem.objects.filter(cart=cart)
+            .select_related("fooditem")
+            .annotate(active_discount=active_discount(resolver.now))
+            .order_by("created_at", "id")
+        )
+
+    lines = []
+    subtotal = total = Decimal("0.00")
+
+    for item in cartitems:
+        unit_price = item.fooditem.price
+        price = apply_discount(unit_price, item.active_discount)
+        line_total = price * item.quantity
+        lines.append(PricedLine(
+            cartitem=item,
+            unit_price=unit_price,
+            discount_percentage=item.active_discount,
+            price=price,
+            discount=(unit_price - price) * item.quantity,
+            line_total=line_total,
+        ))
+        subtotal += unit_price * item.quantity
+        total += line_total
+
+        # lets the cartitem's price properties reuse the resolved discount
+        resolver.remember(item.fooditem_id, item.active_discount)
+        item._price_resolver = resolver
+
+    return CartPricing(
+        lines=lines,
+        subtotal=subtotal,
+        discount=subtotal - total,
+        total=total,
+        query_count=counter.count,
+    )
+
+
+# disables the incremental cart totals while a cart is being bulk cleared
+_tracking_suspended = ContextVar("cart_tracking_suspended", default=False)
+
+
+@contextmanager
+def suspend_cart_tracking():
+    """
+    Skips the incremental total updates for cartitem changes made inside
+    the block, for callers that reset the cart totals themselves.
+    """
+    token = _tracking_suspended.set(True)
+    try:
+        yield
+    finally:
+        _tracking_suspended.reset(token)
+
+
+def next_offer_change(fooditem_ids, now):
+    """
+    Returns when the active discount of any of the fooditems next changes.
+
+    Args:
+        fooditem_ids (iterable): ids of the fooditems.
+        now (datetime): the instant the offers are resolved at.
+
+    Returns:
+        datetime: the earliest upcoming offer start or end, None if there is none.
+    """
+    boundaries = SpecialOffer.objects.filter(
+        fooditem_id__in=fooditem_ids,
+        end_date__gte=now,
+    ).aggregate(
+        next_start=Min("start_date", filter=Q(start_date__gt=now)),
+        next_end=Min("end_date"),
+    )
+
+    changes = [boundary for boundary in boundaries.values() if boundary is not None]
+
+    return min(changes) if changes else None
+
+
+def _line_amounts(fooditem, quantity, resolver):
+    """
+    Returns the subtotal and discount contributed by a cart line.
+    """
+    subtotal = fooditem.price * quantity
+    return subtotal, subtotal - resolver.price_for(fooditem) * quantity
+
+
+def record_cartitem_change(cartitem, created):
+    """
+    Applies the change of a saved cartitem to its cart's stored totals.
+
+    The totals are updated with atomic F() deltas, so concurrent changes
+    to the same cart never overwrite each other.
+
+    Args:
+        cartitem (CartItem): the saved cartitem.
+        created (bool): whether the cartitem was just created.
+    """
+    if _tracking_suspended.get():
+        return
+
+    previous = None if created else cartitem._loaded_values
+
+    if not created and previous is None:
+        # the previous state of the line is unknown, let the next read recompute
+        expire_cart_totals(Cart.objects.filter(id=cartitem.cart_id))
+        return
+
+    resolver = OfferPriceResolver()
+
+    subtotal, discount = _line_amounts(cartitem.fooditem, cartitem.quantity, resolver)
+    quantity = cartitem.quantity
+
+    if previous is not None:
+        previous_fooditem_id, previous_quantity = previous
+
+        if previous_fooditem_id == cartitem.fooditem_id:
+            previous_fooditem = cartitem.fooditem
+        else:
+            previous_fooditem = FoodItem.objects.get(id=previous_fooditem_id)
+
+        previous_subtotal, previous_discount = _line_amounts(previous_fooditem, previous_quantity, resolver)
+        subtotal -= previous_subtotal
+        discount -= previous_discount
+        quantity -= previous_quantity
+
+    changes = {
+        "subtotal": F("subtotal") + subtotal,
+        "discount": F("discount") + discount,
+        "item_count": F("item_count") + quantity,
+    }
+
+    offer_change = next_offer_change([cartitem.fooditem_id], resolver.now)
+
+    # the stored totals expire at the earliest offer start or end among the lines
+    if offer_change is not None:
+        changes["totals_expire_at"] = Case(
+            When(Q(totals_expire_at__isnull=True) | Q(totals_expire_at__gt=offer_change), then=Value(offer_change)),
+            default=F("totals_expire_at"),
+        )
+
+    Cart.objects.filter(id=cartitem.cart_id).update(**changes)
+    cartitem._loaded_values = (cartitem.fooditem_id, cartitem.quantity)
+
+
+def record_cartitem_removal(cartitem):
+    """
+    Removes a deleted cartitem from its cart's stored totals.
+
+    Args:
+        cartitem (CartItem): the deleted cartitem.
+    """
+    if _tracking_suspended.get():
+        return
+
+    fooditem_id, quantity = cartitem._loaded_values or (cartitem.fooditem_id, cartitem.quantity)
+
+    if fooditem_id != cartitem.fooditem_id:
+        # the line was re-pointed without being saved, let the next read recompute
+        expire_cart_totals(Cart.objects.filter(id=cartitem.cart_id))
+        return
+
+    subtotal, discount = _line_amounts(cartitem.fooditem, quantity, OfferPriceResolver())
+
+    Cart.objects.filter(id=cartitem.cart_id).update(
+        subtotal=F("subtotal") - subtotal,
+        discount=F("discount") - discount,
+        item_count=F("item_count") - quantity,
+    )
+
+
+def expire_cart_totals(carts):
+    """
+    Marks the stored totals of carts as stale so they are recomputed on
+    their next read, e.g when an offer or a fooditem price changes.
+
+    Args:
+        carts (QuerySet): the carts to expire.
+    """
+    carts.update(totals_expire_at=timezone.now())
+
+
+@primary_reads()
+def recalculate_cart_totals(cart, resolver=None):
+    """
+    Recomputes and stores the totals of a cart from its cartitems.
+
+    Args:
+        cart (Cart): the cart to recompute.
+        resolver (OfferPriceResolver): resolver to share the resolved
+            discounts with.
+
+    Returns:
+        CartPricing: the fresh pricing of the cart.
+    """
+    with transaction.atomic():
+        # blocks incremental updates on the cart until the new totals are stored
+        Cart.objects.select_for_update().filter(id=cart.id).values_list("id", flat=True).first()
+
+        pricing = price_cart(cart, resolver)
+        now = resolver.now if resolver is not None else timezone.now()
+
+        cart.subtotal = pricing.subtotal
+        cart.discount = pricing.discount
+        cart.item_count = sum(line.cartitem.quantity for line in pricing.lines)
+        cart.totals_expire_at = next_offer_change(
+            [line.cartitem.fooditem_id for line in pricing.lines], now
+        )
+        cart.save(update_fields=["subtotal", "discount", "item_count", "totals_expire_at"])
+
+    return pricing
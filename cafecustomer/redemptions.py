@@ -0,0 +1,77 @@
+import threading
+from bisect import bisect_right
+
+from cafebackend.replicas import primary_reads
+
+from .caching import REDEMPTIONS, get_version
+from .models import RedemptionOption
+from .serializers import RedemptionOptionSerializer
+
+
+# the number of options just out of reach listed as the next targets
+NEXT_TARGETS = 3
+
+
+class RedemptionIndex:
+    """
+    In-memory index of the serialized redemption options, sorted by the
+    points they require.
+
+    Attributes:
+        version (int): the redemptions version the index is in sync with,
+            None until it is built.
+        thresholds (list): the points required by every option, ascending.
+        options (list): the serialized options, in the same order.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.thresholds = []
+        self.options = []
+        self.lock = threading.Lock()
+
+    @primary_reads()
+    def rebuild(self, version):
+        queryset = RedemptionOptionSerializer.setup_eager_loading(
+            RedemptionOption.objects.order_by("points_required", "id")
+        )
+        options = RedemptionOptionSerializer(queryset, many=True).data
+
+        self.thresholds = [option["points_required"] for option in options]
+        self.options = list(options)
+        self.version = version
+
+    def lookup(self, points, next_targets=NEXT_TARGETS):
+        """
+        Splits the options at a balance.
+
+        Returns:
+            tuple: the options the balance affords and the next options out of reach.
+        """
+        affordable = bisect_right(self.thresholds, points)
+        return self.options[:affordable], self.options[affordable:affordable + next_targets]
+
+
+redemption_index = RedemptionIndex()
+
+
+def redemption_options(points, next_targets=NEXT_TARGETS):
+    """
+    Lists the redemption options a balance affords and the next ones out
+    of reach, from the index rebuilt only after an option, fooditem or
+    category changed.
+
+    Args:
+        points (int): the customer's balance.
+        next_targets (int): the number of options out of reach listed.
+
+    Returns:
+        tuple: the affordable options and the next targets, serialized.
+    """
+    version = get_version(REDEMPTIONS)
+
+    with redemption_index.lock:
+        if redemption_index.version != version:
+            redemption_index.rebuild(version)
+
+        return redemption_index.lookup(points, next_targets)
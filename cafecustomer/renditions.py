@@ -0,0 +1,166 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.views.static import serve
+from PIL import Image, ImageOps, features
+
+from cafebackend.workers import PoolSaturated, submit
+from .caching import MENU, REDEMPTIONS, bump_version
+from .models import FoodItem
+
+
+RENDITIONS_DIR = "food_renditions"
+
+# the bounding box of every rendition
+RENDITION_SIZES = {
+    "thumb": (160, 160),
+    "card": (480, 480),
+    "full": (1280, 1280),
+}
+
+# renditions never change once written since their path holds the image hash
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def rendition_formats():
+    """
+    Returns the (Pillow format, extension, save options) renditions are written in.
+    """
+    formats = [("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True})]
+
+    if features.check("webp"):
+        formats.append(("WEBP", "webp", {"quality": 80, "method": 4}))
+
+    return formats
+
+
+def rendition_path(image_hash, size, extension):
+    """
+    Returns the storage path of a rendition, addressed by the image hash
+    so identical uploads share their renditions.
+    """
+    return f"{RENDITIONS_DIR}/{image_hash[:2]}/{image_hash}/{size}.{extension}"
+
+
+def rendition_urls(image_hash):
+    """
+    Returns the urls of every rendition of an image.
+
+    Args:
+        image_hash (str): the sha256 of the original image.
+
+    Returns:
+        dict: the urls per size and extension, None if there are no renditions yet.
+    """
+    if not image_hash:
+        return None
+
+    return {
+        size: {
+            extension: default_storage.url(rendition_path(image_hash, size, extension))
+            for _, extension, _ in rendition_formats()
+        }
+        for size in RENDITION_SIZES
+    }
+
+
+def hash_file(file):
+    """
+    Returns the sha256 of a file's content.
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render(image, size, format, options):
+    """
+    Renders an image scaled down to fit a bounding box.
+
+    Returns:
+        bytes: the encoded rendition.
+    """
+    rendition = image.copy()
+    rendition.thumbnail(size, Image.LANCZOS)
+
+    buffer = BytesIO()
+    rendition.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def generate_renditions(fooditem_id):
+    """
+    Generates the renditions of a fooditem's image and records its hash.
+
+    Renditions already stored for the same image content are reused.
+
+    Args:
+        fooditem_id (UUID): the id of the fooditem.
+
+    Returns:
+        str: the image hash, None if the fooditem or its image is missing.
+    """
+    fooditem = FoodItem.objects.filter(id=fooditem_id).only("id", "image").first()
+
+    if fooditem is None or not fooditem.image or not default_storage.exists(fooditem.image.name):
+        return None
+
+    with fooditem.image.open("rb") as file:
+        image_hash = hash_file(file)
+
+        pending = [
+            (size, format, extension, options)
+            for size in RENDITION_SIZES
+            for format, extension, options in rendition_formats()
+            if not default_storage.exists(rendition_path(image_hash, size, extension))
+        ]
+
+        if pending:
+            file.seek(0)
+            with Image.open(file) as original:
+                image = ImageOps.exif_transpose(original).convert("RGB")
+
+            for size, format, extension, options in pending:
+                content = render(image, RENDITION_SIZES[size], format, options)
+                default_storage.save(rendition_path(image_hash, size, extension), ContentFile(content))
+
+    # only records the hash if the image was not replaced in the meantime
+    updated = FoodItem.objects.filter(id=fooditem_id, image=fooditem.image.name).update(image_hash=image_hash)
+
+    if updated:
+        # the redemption options serialize their fooditem, renditions included
+        bump_version(MENU)
+        bump_version(REDEMPTIONS)
+
+    return image_hash
+
+
+def schedule_renditions(fooditem):
+    """
+    Generates the renditions of a fooditem's image on the renditions worker
+    pool once the current transaction commits.
+    """
+    fooditem_id = fooditem.id
+
+    def enqueue():
+        try:
+            submit("renditions", generate_renditions, fooditem_id)
+        except PoolSaturated:
+            # the original image is served until the renditions are generated
+            # by the generate_renditions command
+            pass
+
+    transaction.on_commit(enqueue)
+
+
+def serve_rendition(request, path, document_root=None):
+    """
+    Serves a rendition with long-lived cache headers.
+    """
+    response = serve(request, path, document_root=document_root)
+    response["Cache-Control"] = CACHE_CONTROL
+    return response
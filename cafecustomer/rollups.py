@@ -0,0 +1,185 @@
+"""
+Incremental maintenance of the sales rollups.
+
+Every paid order is added once to the SalesRollup rows of its day: the
+day total, its dining table and the fooditems and categories of its
+lines. Orders are flagged as rolled up in the same transaction, so the
+outbox handler and the backfill command can overlap or be re-run safely.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, OrderLine, SalesRollup
+
+
+BACKFILL_CHUNK_SIZE = 500
+
+
+class Totals:
+    """
+    The sales added to one rollup row.
+    """
+
+    def __init__(self):
+        self.label = ""
+        self.revenue = Decimal("0")
+        self.orders = set()
+        self.quantity = 0
+
+    def add(self, order_id, revenue, quantity, label=""):
+        self.revenue += revenue
+        self.orders.add(order_id)
+        self.quantity += quantity
+        if label:
+            self.label = label
+
+
+def rollup_orders(order_ids):
+    """
+    Adds paid orders to the sales rollups.
+
+    Orders unpaid or already rolled up are skipped, so the same orders can
+    be passed more than once.
+
+    Args:
+        order_ids (list): the ids of the orders.
+
+    Returns:
+        list: the ids of the orders added.
+    """
+    with transaction.atomic():
+        ids = list(
+            Order.objects.select_for_update()
+            .filter(id__in=order_ids, is_paid=True, rolled_up=False)
+            .values_list("id", flat=True)
+        )
+
+        if not ids:
+            return []
+
+        Order.objects.filter(id__in=ids).update(rolled_up=True)
+
+        totals = defaultdict(Totals)
+        quantities = defaultdict(int)
+
+        lines = OrderLine.objects.filter(order_id__in=ids).values_list(
+            "order_id", "order__created_at", "fooditem_id", "name",
+            "fooditem__category_id", "fooditem__category__name", "quantity", "line_total",
+        )
+        for order_id, created_at, fooditem_id, name, category_id, category_name, quantity, line_total in lines:
+            day = timezone.localdate(created_at)
+            quantities[order_id] += quantity
+
+            # lines of deleted fooditems only count in the order totals
+            if fooditem_id is not None:
+                totals[day, SalesRollup.FOODITEM, str(fooditem_id)].add(order_id, line_total, quantity, name)
+                totals[day, SalesRollup.CATEGORY, str(category_id)].add(order_id, line_total, quantity, category_name)
+
+        orders = Order.objects.filter(id__in=ids).values_list(
+            "id", "created_at", "total_price", "dining_table_id", "dining_table__table_number",
+        )
+        for order_id, created_at, total_price, table_id, table_number in orders:
+            day = timezone.localdate(created_at)
+            quantity = quantities[order_id]
+
+            totals[day, SalesRollup.TOTAL, ""].add(order_id, total_price, quantity)
+            if table_id is not None:
+                totals[day, SalesRollup.TABLE, str(table_id)].add(order_id, total_price, quantity, f"Table {table_number}")
+
+        apply_totals(totals)
+
+    return ids
+
+
+def apply_totals(totals):
+    """
+    Adds totals to their rollup rows, creating the missing rows.
+
+    Args:
+        totals (dict): the Totals of every (day, dimension, key).
+    """
+    SalesRollup.objects.bulk_create(
+        [SalesRollup(day=day, dimension=dimension, key=key) for day, dimension, key in totals],
+        ignore_conflicts=True,
+    )
+
+    # the rows are locked so concurrent rollups add up instead of overwriting
+    rows = SalesRollup.objects.select_for_update().filter(
+        day__in={day for day, _, _ in totals},
+        dimension__in={dimension for _, dimension, _ in totals},
+        key__in={key for _, _, key in totals},
+    )
+
+    updated = []
+    for row in rows:
+        added = totals.get((row.day, row.dimension, row.key))
+        if added is None:
+            continue
+
+        row.revenue = F("revenue") + added.revenue
+        row.order_count = F("order_count") + len(added.orders)
+        row.quantity = F("quantity") + added.quantity
+        row.label = added.label or row.label
+        updated.append(row)
+
+    SalesRollup.objects.bulk_update(updated, ["revenue", "order_count", "quantity", "label"])
+
+
+def pending_orders():
+    """
+    Returns the paid orders not rolled up yet, in backfill order.
+    """
+    return Order.objects.filter(is_paid=True, rolled_up=False).order_by("id")
+
+
+def backfill_rollups(chunk_size=BACKFILL_CHUNK_SIZE, progress=None):
+    """
+    Rolls up the paid orders missing from the rollups, a chunk per
+    transaction, so an interrupted backfill resumes where it stopped.
+
+    Args:
+        chunk_size (int): the number of orders rolled up per transaction.
+        progress (callable): called with the running total after every chunk.
+
+    Returns:
+        int: the number of orders rolled up.
+    """
+    total = 0
+    last_id = None
+
+    while True:
+        chunk = pending_orders()
+        if last_id is not None:
+            chunk = chunk.filter(id__gt=last_id)
+
+        ids = list(chunk.values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+
+        total += len(rollup_orders(ids))
+        last_id = ids[-1]
+
+        if progress is not None:
+            progress(total)
+
+    return total
+
+
+def reset_rollups(chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Empties the rollups and flags every order as not rolled up, so a
+    backfill rebuilds them from scratch.
+    """
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+
+        while True:
+            ids = list(Order.objects.filter(rolled_up=True).values_list("id", flat=True)[:chunk_size])
+            if not ids:
+                break
+            Order.objects.filter(id__in=ids).update(rolled_up=False)
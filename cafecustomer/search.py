@@ -0,0 +1,377 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict, namedtuple
+from operator import itemgetter
+
+from cafebackend.replicas import primary_reads
+
+from .caching import get_version, bump_version
+from .models import Category, FoodItem
+
+
+# the namespace versioned by every write to an indexed category or fooditem
+SEARCH = "search"
+
+CATEGORY = "category"
+FOODITEM = "fooditem"
+
+TOKEN_RE = re.compile(r"\w+")
+
+# a single ranked search result
+SearchHit = namedtuple("SearchHit", ["kind", "id", "name", "score"])
+
+
+def tokenize(text):
+    """
+    Splits a text into lowercase word tokens.
+    """
+    return TOKEN_RE.findall((text or "").lower())
+
+
+def deletes(token, distance):
+    """
+    Returns the variants of a token with up to `distance` characters deleted.
+    """
+    variants = {token}
+    frontier = {token}
+
+    for _ in range(distance):
+        frontier = {
+            variant[:i] + variant[i + 1:]
+            for variant in frontier
+            for i in range(len(variant))
+        }
+        variants |= frontier
+
+    return variants
+
+
+def typo_distance(token):
+    """
+    Returns how many typos are tolerated in a token of a given length.
+    """
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+def edit_distance(a, b, limit):
+    """
+    Computes the Levenshtein distance between two tokens.
+
+    Args:
+        a (str): the first token.
+        b (str): the second token.
+        limit (int): the largest distance of interest.
+
+    Returns:
+        int: the distance, or limit + 1 once it is known to exceed the limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+
+        if min(current) > limit:
+            return limit + 1
+
+        previous = current
+
+    return previous[-1]
+
+
+class MenuSearchIndex:
+    """
+    In-memory inverted index over the names and descriptions of categories
+    and fooditems.
+
+    Every token maps to the documents containing it and their weight, so a
+    lookup only touches the postings of the query tokens. Tokens are also
+    kept sorted for prefix matching, and indexed by their deletion variants
+    so tokens within a typo or two of a query token are found with a few
+    dictionary lookups.
+
+    Attributes:
+        version (int): the search version the index is in sync with, None
+            when it has to be rebuilt.
+    """
+
+    NAME_WEIGHT = 3.0
+    DESCRIPTION_WEIGHT = 1.0
+
+    EXACT_SCORE = 1.0
+    PREFIX_SCORE = 0.7
+    FUZZY_SCORE = 0.4
+
+    # bounds the work done for very short prefixes
+    MAX_EXPANSIONS = 50
+
+    def __init__(self):
+        self.version = None
+        self.lock = threading.RLock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+            # documents are numbered so the postings hash small ints
+            self._numbers = {}
+            self._documents = {}
+            self._next_number = 0
+            self._postings = defaultdict(dict)
+            self._tokens = []
+            self._variants = defaultdict(set)
+
+    def add(self, kind, id, name, description="", available=True):
+        """
+        Indexes a document, replacing any previous version of it.
+
+        Args:
+            kind (str): the document type, "category" or "fooditem".
+            id (UUID): the id of the category or fooditem.
+            name (str): the name, weighted higher than the description.
+            description (str): the description.
+            available (bool): whether the document can be returned to customers.
+        """
+        weights = {}
+        for token in tokenize(description):
+            weights[token] = self.DESCRIPTION_WEIGHT
+        for token in tokenize(name):
+            weights[token] = self.NAME_WEIGHT
+
+        with self.lock:
+            self.remove(kind, id)
+
+            number = self._next_number
+            self._next_number += 1
+            self._numbers[(kind, id)] = number
+            self._documents[number] = (kind, id, name, available, tuple(weights))
+
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    insort(self._tokens, token)
+                    for variant in deletes(token, typo_distance(token)):
+                        self._variants[variant].add(token)
+
+                self._postings[token][number] = weight
+
+    def remove(self, kind, id):
+        """
+        Removes a document from the index.
+        """
+        with self.lock:
+            number = self._numbers.pop((kind, id), None)
+
+            if number is None:
+                return
+
+            for token in self._documents.pop(number)[4]:
+                postings = self._postings[token]
+                postings.pop(number, None)
+
+                if not postings:
+                    del self._postings[token]
+                    del self._tokens[bisect_left(self._tokens, token)]
+                    for variant in deletes(token, typo_distance(token)):
+                        self._variants[variant].discard(token)
+                        if not self._variants[variant]:
+                            del self._variants[variant]
+
+    def _prefix_matches(self, token):
+        """
+        Returns the indexed tokens starting with a token, excluding itself.
+        """
+        position = bisect_left(self._tokens, token)
+        if position < len(self._tokens) and self._tokens[position] == token:
+            position += 1
+
+        matches = []
+        for candidate in self._tokens[position:position + self.MAX_EXPANSIONS]:
+            if not candidate.startswith(token):
+                break
+            matches.append(candidate)
+
+        return matches
+
+    def _fuzzy_matches(self, token):
+        """
+        Returns the indexed tokens within a small edit distance of a token.
+        """
+        distance = typo_distance(token)
+
+        if not distance:
+            return []
+
+        candidates = set()
+        for variant in deletes(token, distance):
+            candidates |= self._variants.get(variant, set())
+
+        return [candidate for candidate in candidates if edit_distance(token, candidate, distance) <= distance]
+
+    def _score_token(self, token):
+        """
+        Scores the documents matching a single query token.
+        """
+        scores = dict(self._postings.get(token, {}))
+
+        for matched in self._prefix_matches(token):
+            for number, weight in self._postings[matched].items():
+                weight *= self.PREFIX_SCORE
+                if weight > scores.get(number, 0):
+                    scores[number] = weight
+
+        # typo tolerance is only needed when nothing matched as typed
+        if not scores:
+            for matched in self._fuzzy_matches(token):
+                for number, weight in self._postings[matched].items():
+                    weight *= self.FUZZY_SCORE
+                    if weight > scores.get(number, 0):
+                        scores[number] = weight
+
+        return scores
+
+    def search(self, query, kind=None, limit=20, available_only=False):
+        """
+        Runs a ranked search, every query token has to match a document
+        exactly, as a prefix, or within a small edit distance.
+
+        Args:
+            query (str): the search text.
+            kind (str): restricts the results to "category" or "fooditem".
+            limit (int): the maximum number of results.
+            available_only (bool): skips documents not available to customers.
+
+        Returns:
+            list: the SearchHits, best match first.
+        """
+        tokens = tokenize(query)
+
+        if not tokens:
+            return []
+
+        with self.lock:
+            totals = None
+
+            for token in dict.fromkeys(tokens):
+                scores = self._score_token(token)
+
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {number: totals[number] + score for number, score in scores.items() if number in totals}
+
+                if not totals:
+                    return []
+
+            documents = self._documents
+
+            if kind is not None or available_only:
+                totals = {
+                    number: score for number, score in totals.items()
+                    if (kind is None or documents[number][0] == kind)
+                    and (not available_only or documents[number][3])
+                }
+
+            best = heapq.nlargest(limit, totals.items(), key=itemgetter(1))
+
+            hits = [
+                SearchHit(documents[number][0], documents[number][1], documents[number][2], round(score, 3))
+                for number, score in best
+            ]
+
+        hits.sort(key=lambda hit: (-hit.score, hit.name))
+
+        return hits
+
+
+# the index shared by every request handled by this process
+menu_index = MenuSearchIndex()
+
+
+def index_instance(instance):
+    """
+    Adds a category or fooditem to the search index.
+    """
+    if isinstance(instance, Category):
+        menu_index.add(CATEGORY, instance.id, instance.name, instance.description)
+    else:
+        menu_index.add(FOODITEM, instance.id, instance.name, instance.description, instance.is_available)
+
+
+@primary_reads()
+def rebuild_index():
+    """
+    Rebuilds the search index from the database.
+    """
+    with menu_index.lock:
+        version = get_version(SEARCH)
+        menu_index.clear()
+
+        for category in Category.objects.only("id", "name", "description").iterator():
+            index_instance(category)
+
+        for fooditem in FoodItem.objects.only("id", "name", "description", "is_available").iterator():
+            index_instance(fooditem)
+
+        menu_index.version = version
+
+
+def record_change(instance, deleted=False):
+    """
+    Applies the change of a category or fooditem to the search index.
+
+    The index is updated in place when it has seen every earlier change,
+    otherwise (e.g after a write in another process) it is rebuilt on the
+    next search.
+
+    Args:
+        instance (Category | FoodItem): the saved or deleted instance.
+        deleted (bool): whether the instance was deleted.
+    """
+    version = bump_version(SEARCH)
+
+    with menu_index.lock:
+        if menu_index.version is None or menu_index.version != version - 1:
+            menu_index.version = None
+            return
+
+        if deleted:
+            kind = CATEGORY if isinstance(instance, Category) else FOODITEM
+            menu_index.remove(kind, instance.id)
+        else:
+            index_instance(instance)
+
+        menu_index.version = version
+
+
+def search_menu(query, kind=None, limit=20, available_only=False):
+    """
+    Searches the menu, rebuilding the index first if it is out of date.
+
+    Args:
+        query (str): the search text.
+        kind (str): restricts the results to "category" or "fooditem".
+        limit (int): the maximum number of results.
+        available_only (bool): skips fooditems not available to customers.
+
+    Returns:
+        list: the SearchHits, best match first.
+    """
+    if menu_index.version != get_version(SEARCH):
+        rebuild_index()
+
+    return menu_index.search(query, kind=kind, limit=limit, available_only=available_only)
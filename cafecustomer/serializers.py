@@ -1,8 +1,12 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from .models import (
     Category, FoodItem, DiningTable, SpecialOffer, CartItem, Cart, 
-    Order, Notification, Review, RedemptionOption
+    Order, OrderLine, PaymentAttempt, Notification, Review, RedemptionOption
     )
+from .pricing import get_price_resolver
+from .renditions import rendition_urls
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -35,6 +39,7 @@ class FoodItemSerializer(serializers.ModelSerializer):
         name (CharField): The name of the fooditem.
         price (DecimalField): The price of the fooditem.
         image (ImageField)
+        renditions (dict): urls of the thumb, card and full size renditions of the image.
         description (TextField): Brief description for the fooditem.
         created_at (DateTimeField): Timestamp when the fooditem was created.
         updated_at (DateTimeField): Timestamp when the fooditem was updated.
@@ -44,11 +49,35 @@ class FoodItemSerializer(serializers.ModelSerializer):
     category_id = serializers.UUIDField(required=False, write_only=True)
     category = CategorySerializer(read_only=True)
     image = serializers.ImageField(required = False)
+    renditions = serializers.SerializerMethodField()
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Selects the nested category along with the fooditems,
+        avoiding a query per listed fooditem.
+        """
+        return queryset.select_related("category")
     
+    def get_renditions(self, obj):
+        """
+        Gets the urls of the resized image renditions, None until they are generated.
+        """
+        urls = rendition_urls(obj.image_hash)
+        request = self.context.get("request")
+
+        if urls and request is not None:
+            urls = {
+                size: {extension: request.build_absolute_uri(url) for extension, url in formats.items()}
+                for size, formats in urls.items()
+            }
+
+        return urls
+
     class Meta:
         model = FoodItem
         fields = [
-            "id", "name", "description", "price","image", "is_available", "created_at", "updated_at", "category", "category_id"
+            "id", "name", "description", "price","image", "renditions", "is_available", "created_at", "updated_at", "category", "category_id"
         ]
         read_only_fields = ["id", "created_at", "updated_at"]
 
@@ -80,6 +109,25 @@ class FoodItemSerializer(serializers.ModelSerializer):
             return super().update(instance, validated_data)
         
 
+class FoodItemImportSerializer(serializers.Serializer):
+    """
+    Serializer validating a single row of a bulk menu import.
+
+    Fields:
+        name (CharField): The name of the fooditem, existing fooditems are updated.
+        category (CharField): The name of the category the fooditem belongs to.
+        price (DecimalField): The price of the fooditem.
+        description (CharField): Brief description for the fooditem.
+        is_available (BooleanField): Availability of the fooditem.
+    """
+
+    name = serializers.CharField(max_length=250)
+    category = serializers.CharField(max_length=250)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=Decimal("0"))
+    description = serializers.CharField(required=False, allow_blank=True, default="")
+    is_available = serializers.BooleanField(required=False, default=False)
+
+
 class DinningTableSerializer(serializers.ModelSerializer):
     """
     Serializer for the dinningtable model.
@@ -146,7 +194,7 @@ class CartItemSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """
         Create and return a new CartItem instance.
-        Updates the cart's total price.
+        The cart's stored totals are updated by the post_save signal.
         """
 
         cart = validated_data.get("cart")
@@ -158,10 +206,19 @@ class CartItemSerializer(serializers.ModelSerializer):
             cart=cart, fooditem=fooditem, quantity=quantity
         )
 
-        # updates the carts total price
-        cart.save()
-
         return cartitem
+
+    def to_representation(self, instance):
+        """
+        Prices the cartitem with the request's resolver so the offers
+        resolved for the request are reused.
+        """
+        request = self.context.get("request")
+
+        if request is not None and not hasattr(instance, "_price_resolver"):
+            get_price_resolver(request).bind([instance])
+
+        return super().to_representation(instance)
     
 class CartSerializer(serializers.ModelSerializer):
     """
@@ -183,6 +240,24 @@ class CartSerializer(serializers.ModelSerializer):
         ]
 
 
+class OrderLineSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the OrderLine model.
+
+    Fields:
+        fooditem (FoodItem): the fooditem ordered.
+        name (CharField): the name of the fooditem when ordered.
+        unit_price (DecimalField): the fooditem price before special offers.
+        discount (DecimalField): the amount taken off the line by special offers.
+        quantity (PositiveIntegerField): the quantity ordered.
+        line_total (DecimalField): the amount charged for the line.
+    """
+
+    class Meta:
+        model = OrderLine
+        fields = ['fooditem', 'name', 'unit_price', 'discount', 'quantity', 'line_total']
+
+
 class OrderSerializer(serializers.ModelSerializer):
     """
     Serializer for the Order model.
@@ -191,6 +266,7 @@ class OrderSerializer(serializers.ModelSerializer):
         id (UUIDField): Unique identifier for the order.
         user(User): the user to whom the order belongs to.
         order_items(CartItem): orderitems 
+        lines (OrderLine): the snapshot of the ordered cartitems
         total_price (DecimalField): the total price for the order
         is_paid (BooleanField): indicates if an order has been paid for.
         estimated_time (IntegerField): estimated delivery time for the order
@@ -198,9 +274,79 @@ class OrderSerializer(serializers.ModelSerializer):
         created_at (DateTimeField): Timestamp when the order was created.
         updated_at (DateTimeField): Timestamp when the order was updated.
     """
+    lines = OrderLineSerializer(many=True, read_only=True)
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Prefetches the order items and lines of all the listed orders in one query each.
+        """
+        return queryset.prefetch_related("order_items", "lines")
+
     class Meta:
         model = Order
-        fields = ['id', 'user', 'total_price', 'is_paid', 'order_items', 'dining_table','estimated_time', 'status', 'created_at', 'updated_at']
+        fields = ['id', 'user', 'total_price', 'is_paid', 'order_items', 'lines', 'dining_table','estimated_time', 'status', 'created_at', 'updated_at']
+
+
+class PaymentAttemptSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the PaymentAttempt model.
+
+    Fields:
+        id (UUIDField): Unique identifier for the payment attempt.
+        order (Order): the order being paid for.
+        amount (DecimalField): the amount charged.
+        status (CharField): the status of the attempt.
+        gateway_reference (CharField): the reference of the charge at the gateway.
+        error (CharField): why the attempt failed.
+        created_at (DateTimeField): Timestamp when the attempt was created.
+        updated_at (DateTimeField): Timestamp when the attempt was updated.
+    """
+
+    class Meta:
+        model = PaymentAttempt
+        fields = ['id', 'order', 'amount', 'status', 'gateway_reference', 'error', 'created_at', 'updated_at']
+
+
+class PaymentCallbackSerializer(serializers.Serializer):
+    """
+    Serializer validating the outcome of a charge reported by the gateway.
+
+    Fields:
+        attempt (UUIDField): the id of the payment attempt.
+        succeeded (BooleanField): whether the charge went through.
+        reference (CharField): the reference of the charge at the gateway.
+        error (CharField): why the charge failed.
+    """
+
+    attempt = serializers.UUIDField()
+    succeeded = serializers.BooleanField()
+    reference = serializers.CharField(max_length=250, required=False, allow_blank=True, default="")
+    error = serializers.CharField(max_length=250, required=False, allow_blank=True, default="")
+
+
+class TableClaimSerializer(serializers.Serializer):
+    """
+    Serializer validating the claim of a dining table.
+
+    Fields:
+        dining_table (UUIDField): the id of the table to claim.
+    """
+
+    dining_table = serializers.UUIDField()
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+    """
+    Serializer validating a bulk order status transition.
+
+    Fields:
+        orders (ListField): the ids of the orders to move.
+        status (ChoiceField): the status to move the orders to.
+    """
+
+    orders = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=200)
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
 
 
 class NotificationSerializer(serializers.ModelSerializer):
@@ -243,13 +389,21 @@ class RedemptionOptionSerializer(serializers.ModelSerializer):
     Serializer for the RedemptioOption model.
 
     Fields:
+        id (UUIDField): the id to redeem the option with.
         foodItem(foodItem): the fooditem to be redeemed.
         points_required(PositiveIntegerField):points required to redeem this option
         description(TextField): the redemption option brief description
     """
     fooditem = FoodItemSerializer()
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Selects the nested fooditem and its category along with the options.
+        """
+        return queryset.select_related("fooditem__category")
+
     class Meta:
         model = RedemptionOption
-        fields = ['fooditem', 'points_required', 'description']
+        fields = ['id', 'fooditem', 'points_required', 'description']
         
\ No newline at end of file
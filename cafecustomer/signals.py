@@ -1,12 +1,174 @@
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from .models import CartItem
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import Signal, receiver
+from .caching import FLOOR, MENU, REDEMPTIONS, bump_version
+from cafebackend.events import KITCHEN, publish, user_channel
+from .models import (Cart, CartItem, Category, DiningTable, FoodItem, Notification, Order, RedemptionOption,
+                     SpecialOffer)
+from .pricing import record_cartitem_change, record_cartitem_removal, expire_cart_totals
+from . import search
+from .renditions import schedule_renditions
+
+
+# sent after orders are moved to a new status in bulk, with the `orders`
+# as (id, previous status) pairs and the new `status`
+order_status_changed = Signal()
+
+# sent once per order after payments are handled by the outbox, with the
+# `orders` as (id, total price) pairs
+order_paid = Signal()
+
+# sent after tables are claimed or released with a conditional update,
+# with the `tables` as (id, is_occupied) pairs
+table_occupancy_changed = Signal()
+
 
 @receiver(post_save, sender=CartItem)
+def update_cart_total(sender, instance, created, **kwargs):
+    """
+    Signal to apply a saved CartItem to the cart's stored totals.
+    """
+    record_cartitem_change(instance, created)
+
+
 @receiver(post_delete, sender=CartItem)
-def update_cart_total(sender, instance, **kwargs):
+def remove_from_cart_total(sender, instance, **kwargs):
+    """
+    Signal to remove a deleted CartItem from the cart's stored totals.
+    """
+    record_cartitem_removal(instance)
+
+
+@receiver(post_save, sender=SpecialOffer)
+@receiver(post_delete, sender=SpecialOffer)
+@receiver(post_save, sender=FoodItem)
+def expire_affected_cart_totals(sender, instance, **kwargs):
+    """
+    Signal to expire the stored totals of carts holding a fooditem whose
+    price or special offers changed.
+    """
+    if sender is FoodItem and kwargs.get("created"):
+        return
+
+    fooditem_id = instance.id if sender is FoodItem else instance.fooditem_id
+    expire_cart_totals(Cart.objects.filter(cartitems__fooditem_id=fooditem_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=FoodItem)
+@receiver(post_delete, sender=FoodItem)
+@receiver(post_save, sender=SpecialOffer)
+@receiver(post_delete, sender=SpecialOffer)
+def bump_menu_version(sender, instance, **kwargs):
+    """
+    Signal to invalidate the cached menu once a change to it commits.
+    """
+    transaction.on_commit(lambda: bump_version(MENU))
+
+
+@receiver(post_save, sender=RedemptionOption)
+@receiver(post_delete, sender=RedemptionOption)
+@receiver(post_save, sender=FoodItem)
+@receiver(post_delete, sender=FoodItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_redemptions_version(sender, instance, **kwargs):
+    """
+    Signal to invalidate the cached redemption options once a change to
+    them or the fooditems they serialize commits.
+    """
+    transaction.on_commit(lambda: bump_version(REDEMPTIONS))
+
+
+@receiver(post_save, sender=DiningTable)
+@receiver(post_delete, sender=DiningTable)
+@receiver(table_occupancy_changed)
+def bump_floor_version(sender, **kwargs):
+    """
+    Signal to invalidate the cached floor map once a table change commits.
+    """
+    transaction.on_commit(lambda: bump_version(FLOOR))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=FoodItem)
+def update_search_index(sender, instance, **kwargs):
+    """
+    Signal to index a saved Category or FoodItem once the save commits.
+    """
+    transaction.on_commit(lambda: search.record_change(instance))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=FoodItem)
+def remove_from_search_index(sender, instance, **kwargs):
+    """
+    Signal to remove a deleted Category or FoodItem from the search index
+    once the delete commits.
+    """
+    transaction.on_commit(lambda: search.record_change(instance, deleted=True))
+
+
+@receiver(pre_save, sender=FoodItem)
+def detect_new_image(sender, instance, **kwargs):
+    """
+    Signal to drop the renditions of a replaced FoodItem image.
+    """
+    instance._image_changed = bool(instance.image) and instance.image.name != instance._loaded_image
+
+    if instance._image_changed:
+        instance.image_hash = ""
+
+
+@receiver(post_save, sender=FoodItem)
+def generate_image_renditions(sender, instance, **kwargs):
+    """
+    Signal to generate the renditions of a new FoodItem image in the background.
+    """
+    if instance._image_changed:
+        schedule_renditions(instance)
+        instance._loaded_image = instance.image.name
+
+
+@receiver(post_save, sender=Order)
+def publish_new_order(sender, instance, created, **kwargs):
+    """
+    Signal to push a new Order to the kitchen.
+    """
+    if created:
+        publish([KITCHEN], "order.created", {
+            "id": instance.id,
+            "status": instance.status,
+            "total_price": instance.total_price,
+            "dining_table": instance.dining_table_id,
+            "created_at": instance.created_at,
+        })
+
+
+@receiver(order_status_changed, sender=Order)
+def publish_order_status(sender, orders, status, **kwargs):
+    """
+    Signal to push the new status of orders to their customers and the kitchen.
+    """
+    users = dict(Order.objects.filter(id__in=[order_id for order_id, _ in orders]).values_list("id", "user_id"))
+
+    for order_id, previous_status in orders:
+        publish([user_channel(users[order_id]), KITCHEN], "order.status", {
+            "id": order_id,
+            "status": status,
+            "previous_status": previous_status,
+        })
+
+
+@receiver(post_save, sender=Notification)
+def publish_notification(sender, instance, created, **kwargs):
     """
-    Signal to update the cart's total price when CartItem is saved or deleted.
+    Signal to push a new Notification to its user.
     """
-    cart = instance.cart
-    cart.save()  # Triggers the @property total_price to update
\ No newline at end of file
+    if created:
+        publish([user_channel(instance.user_id)], "notification", {
+            "id": instance.id,
+            "message": instance.message,
+            "created_at": instance.created_at,
+        })
@@ -0,0 +1,134 @@
+"""
+Dining table sessions.
+
+A customer claims a free table before ordering at it and releases it when
+leaving, the table they hold is kept in their UserDinningTable. Claiming
+is a conditional UPDATE of the table row (`WHERE is_occupied = false`),
+so of two customers claiming the same table exactly one wins, without
+holding any lock between requests.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DiningTable, UserDinningTable
+from .signals import table_occupancy_changed
+
+
+def claim_table(user, table_id):
+    """
+    Claims a free table for a user, releasing the table they held before.
+
+    Args:
+        user (User): the customer claiming the table.
+        table_id (UUID): the id of the table.
+
+    Raises:
+        DiningTable.DoesNotExist: if there is no such table.
+
+    Returns:
+        bool: whether the user holds the table, False if someone else does.
+    """
+    with transaction.atomic():
+        session, _ = UserDinningTable.objects.select_for_update().get_or_create(user=user)
+        previous_id = session.dinning_table_id
+
+        if previous_id is not None and str(previous_id) == str(table_id):
+            return True
+
+        claimed = DiningTable.objects.filter(id=table_id, is_occupied=False).update(
+            is_occupied=True, updated_at=timezone.now()
+        )
+
+        if not claimed:
+            if not DiningTable.objects.filter(id=table_id).exists():
+                raise DiningTable.DoesNotExist
+            return False
+
+        changes = [(table_id, True)]
+
+        if previous_id is not None:
+            DiningTable.objects.filter(id=previous_id, is_occupied=True).update(
+                is_occupied=False, updated_at=timezone.now()
+            )
+            changes.append((previous_id, False))
+
+        session.dinning_table_id = table_id
+        session.save(update_fields=["dinning_table"])
+
+        table_occupancy_changed.send(sender=DiningTable, tables=changes)
+
+    return True
+
+
+def release_table(user):
+    """
+    Releases the table a user holds.
+
+    Returns:
+        UUID: the id of the released table, None if the user held none.
+    """
+    with transaction.atomic():
+        session = (
+            UserDinningTable.objects.select_for_update()
+            .filter(user=user, dinning_table__isnull=False).first()
+        )
+
+        if session is None:
+            return None
+
+        table_id = session.dinning_table_id
+        DiningTable.objects.filter(id=table_id, is_occupied=True).update(is_occupied=False, updated_at=timezone.now())
+
+        session.dinning_table = None
+        session.save(update_fields=["dinning_table"])
+
+        table_occupancy_changed.send(sender=DiningTable, tables=[(table_id, False)])
+
+    return table_id
+
+
+def clear_table(table_id):
+    """
+    Releases a table whoever holds it, e.g once the host cleared it.
+
+    Returns:
+        bool: whether the table was occupied.
+    """
+    with transaction.atomic():
+        released = DiningTable.objects.filter(id=table_id, is_occupied=True).update(
+            is_occupied=False, updated_at=timezone.now()
+        )
+        UserDinningTable.objects.filter(dinning_table_id=table_id).update(dinning_table=None)
+
+        if released:
+            table_occupancy_changed.send(sender=DiningTable, tables=[(table_id, False)])
+
+    return bool(released)
+
+
+def claimed_table_id(user):
+    """
+    Returns the id of the table a user holds, None if they hold none.
+    """
+    return (
+        UserDinningTable.objects.filter(user=user, dinning_table__isnull=False)
+        .values_list("dinning_table_id", flat=True).first()
+    )
+
+
+def floor_map():
+    """
+    Lists every table with its occupancy, by table number.
+
+    Returns:
+        dict: the tables and the number of occupied and available tables.
+    """
+    tables = list(DiningTable.objects.order_by("table_number").values("id", "table_number", "is_occupied"))
+    occupied = sum(table["is_occupied"] for table in tables)
+
+    return {
+        "tables": tables,
+        "occupied": occupied,
+        "available": len(tables) - occupied,
+    }
@@ -1,3 +1,1260 @@
-from django.test import TestCase
+import asyncio
+import copy
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from PIL import Image
+
+from account.tokens import RoleRefreshToken
+from cafebackend.events import KITCHEN, LocalBroker, get_broker, user_channel
+from cafebackend.replicas import ReplicaRouter, reads_from_replica
+from cafebackend.workers import PoolSaturated
+
+from .models import (
+    Category, FoodItem, SpecialOffer, Cart, CartItem, DiningTable, Order, OrderLine, RedemptionOption, CustomerPoint,
+    IdempotencyRecord, Notification, OutboxEvent, PaymentAttempt, PointsEntry, RedemptionTransaction, Transaction,
+    UserDinningTable,
+)
+from .caching import FLOOR, MENU, REDEMPTIONS, bump_version, get_version
+from .myutils import ledger_balance, ledger_mismatches, open_ledgers, redeem_points
+from .outbox import ORDER_PAID, _handlers, award_points, drain_outbox, record_event
+from .payments import FakeGateway, GatewayResult, finalize_payment, sign_callback
+from .pricing import OfferPriceResolver, price_cart
+from .redemptions import redemption_index
+from .renditions import RENDITION_SIZES, RENDITIONS_DIR, rendition_path, serve_rendition
+from .search import SEARCH, menu_index
+from .serializers import FoodItemSerializer
+from .signals import order_status_changed
+from .tables import claim_table
+
+User = get_user_model()
+
+
+class CafeTestMixin:
+    """
+    Helpers for building menu and cart fixtures.
+    """
+
+    def create_fooditems(self, count, price="100.00", category=None):
+        if category is None:
+            category = Category.objects.create(name=f"Category {Category.objects.count()}", description="test")
+
+        start = FoodItem.objects.count()
+        return [
+            FoodItem.objects.create(
+                category=category,
+                name=f"Food {start + i}",
+                price=Decimal(price),
+                description="test",
+                is_available=True,
+            )
+            for i in range(count)
+        ]
+
+    def create_offer(self, fooditem, discount, start_delta=timedelta(days=-1), end_delta=timedelta(days=1)):
+        now = timezone.now()
+        return SpecialOffer.objects.create(
+            fooditem=fooditem,
+            discount_percentage=Decimal(discount),
+            start_date=now + start_delta,
+            end_date=now + end_delta,
+        )
+
+    def fill_cart(self, user, fooditems, quantity=1):
+        cart, created = Cart.objects.get_or_create(user=user)
+        for fooditem in fooditems:
+            CartItem.objects.create(cart=cart, fooditem=fooditem, quantity=quantity)
+        return cart
+
+    def award_points(self, order):
+        # what the outbox does with the order.paid event of the order
+        payload = {"order": str(order.id), "user": str(order.user_id), "total_price": str(order.total_price)}
+        with transaction.atomic():
+            award_points([OutboxEvent(topic=ORDER_PAID, payload=payload)])
+
+
+class OfferPriceResolverTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+
+    def test_active_offer_is_applied(self):
+        fooditem, = self.create_fooditems(1, price="200.00")
+        self.create_offer(fooditem, "10.00")
+
+        self.assertEqual(OfferPriceResolver().price_for(fooditem), Decimal("180.00"))
+
+    def test_inactive_offers_are_ignored(self):
+        fooditem, = self.create_fooditems(1, price="200.00")
+        self.create_offer(fooditem, "10.00", start_delta=timedelta(days=1), end_delta=timedelta(days=2))
+        self.create_offer(fooditem, "20.00", start_delta=timedelta(days=-3), end_delta=timedelta(days=-2))
+
+        self.assertEqual(OfferPriceResolver().price_for(fooditem), Decimal("200.00"))
+
+    def test_resolves_many_fooditems_in_one_query(self):
+        fooditems = self.create_fooditems(5)
+        for fooditem in fooditems:
+            self.create_offer(fooditem, "50.00")
+
+        resolver = OfferPriceResolver()
+        with self.assertNumQueries(1):
+            resolver.prime(fooditem.id for fooditem in fooditems)
+            prices = [resolver.price_for(fooditem) for fooditem in fooditems]
+
+        self.assertEqual(prices, [Decimal("50.00")] * 5)
+
+    def test_cart_listing_queries_do_not_grow_with_cart_size(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("cartitems"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries), response
+
+        fooditems = self.create_fooditems(2, price="100.00")
+        self.create_offer(fooditems[0], "25.00")
+        cart = self.fill_cart(self.customer, fooditems[:1], quantity=2)
+        small_cart_queries, response = count_queries()
+
+        self.assertEqual(response.data["total_price"], Decimal("150.00"))
+
+        self.fill_cart(self.customer, fooditems[1:] + self.create_fooditems(10))
+        large_cart_queries, response = count_queries()
+
+        self.assertEqual(small_cart_queries, large_cart_queries)
+        cart.refresh_from_db()
+        self.assertEqual(response.data["total_price"], cart.total_price)
+
+
+class CartPricingTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+
+    def test_prices_lines_and_totals(self):
+        fooditems = self.create_fooditems(2, price="80.00")
+        self.create_offer(fooditems[0], "12.50")
+        cart = self.fill_cart(self.customer, fooditems, quantity=3)
+
+        pricing = price_cart(cart)
+
+        first, second = pricing.lines
+        self.assertEqual(first.price, Decimal("70.00"))
+        self.assertEqual(first.discount, Decimal("30.00"))
+        self.assertEqual(first.line_total, Decimal("210.00"))
+        self.assertEqual(second.line_total, Decimal("240.00"))
+        self.assertEqual(pricing.subtotal, Decimal("480.00"))
+        self.assertEqual(pricing.discount, Decimal("30.00"))
+        self.assertEqual(pricing.total, Decimal("450.00"))
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_price, pricing.total)
+
+    def test_query_count_stays_flat_from_1_to_200_lines(self):
+        fooditems = self.create_fooditems(200)
+        for fooditem in fooditems[::2]:
+            self.create_offer(fooditem, "10.00")
+
+        cart = self.fill_cart(self.customer, fooditems[:1])
+        self.assertEqual(price_cart(cart).query_count, 1)
+
+        self.fill_cart(self.customer, fooditems[1:])
+        pricing = price_cart(cart)
+
+        self.assertEqual(len(pricing.lines), 200)
+        self.assertEqual(pricing.query_count, 1)
+
+        # the line properties reuse the resolved discounts
+        with self.assertNumQueries(0):
+            self.assertEqual(sum(line.cartitem.total_price for line in pricing.lines), pricing.total)
+
+
+class CartTotalsTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.fooditems = self.create_fooditems(3, price="100.00")
+        self.create_offer(self.fooditems[0], "20.00")
+        self.cart = self.fill_cart(self.customer, self.fooditems[:2], quantity=2)
+
+    def assertStoredTotals(self, subtotal, discount, item_count):
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.subtotal, Decimal(subtotal))
+        self.assertEqual(self.cart.discount, Decimal(discount))
+        self.assertEqual(self.cart.item_count, item_count)
+
+        # the stored totals always agree with a full repricing
+        pricing = price_cart(self.cart)
+        self.assertEqual(self.cart.subtotal, pricing.subtotal)
+        self.assertEqual(self.cart.discount, pricing.discount)
+
+    def test_lines_added_changed_and_removed_update_totals(self):
+        self.assertStoredTotals("400.00", "40.00", 4)
+
+        cartitem = CartItem.objects.get(cart=self.cart, fooditem=self.fooditems[0])
+        cartitem.quantity = 5
+        cartitem.save()
+        self.assertStoredTotals("700.00", "100.00", 7)
+
+        cartitem.delete()
+        self.assertStoredTotals("200.00", "0.00", 2)
+
+        self.cart.clear()
+        self.assertStoredTotals("0.00", "0.00", 0)
+
+    def test_offer_changes_expire_and_recompute_totals(self):
+        self.create_offer(self.fooditems[1], "50.00")
+        self.cart.refresh_from_db()
+
+        self.assertEqual(self.cart.get_totals()["total_price"], Decimal("260.00"))
+        self.assertStoredTotals("400.00", "140.00", 4)
+
+    def test_totals_recomputed_once_an_offer_boundary_passes(self):
+        offer = self.create_offer(self.fooditems[2], "10.00", start_delta=timedelta(hours=1), end_delta=timedelta(hours=2))
+        CartItem.objects.create(cart=self.cart, fooditem=self.fooditems[2], quantity=1)
+
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.totals_expire_at, offer.start_date)
+
+        # the offer starts
+        SpecialOffer.objects.filter(id=offer.id).update(start_date=timezone.now() - timedelta(minutes=1))
+        Cart.objects.filter(id=self.cart.id).update(totals_expire_at=timezone.now() - timedelta(minutes=1))
+        self.cart.refresh_from_db()
+
+        self.assertEqual(self.cart.total_price, Decimal("450.00"))
+        self.assertStoredTotals("500.00", "50.00", 5)
+
+    def test_total_price_is_read_without_a_query(self):
+        self.cart.refresh_from_db()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cart.total_price, Decimal("360.00"))
+
+    def test_cart_listing_reads_totals_from_the_cart_row(self):
+        self.client.force_authenticate(user=self.customer)
+
+        response = self.client.get(reverse("cartitems"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total_price"], Decimal("360.00"))
+        self.assertEqual(response.data["item_count"], 4)
+
+
+class CheckoutTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+        self.table = DiningTable.objects.create(table_number=1)
+        claim_table(self.customer, self.table.id)
+
+    def checkout(self):
+        return self.client.post(reverse("create-order"), {"dining_table": self.table.id})
+
+    def test_checkout_snapshots_priced_lines(self):
+        fooditems = self.create_fooditems(2, price="80.00")
+        self.create_offer(fooditems[0], "12.50")
+        self.fill_cart(self.customer, fooditems, quantity=3)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(user=self.customer)
+        self.assertEqual(order.total_price, Decimal("450.00"))
+        self.assertEqual(len(response.data["order"]["lines"]), 2)
+
+        first = OrderLine.objects.get(order=order, fooditem=fooditems[0])
+        self.assertEqual((first.unit_price, first.discount, first.quantity), (Decimal("80.00"), Decimal("30.00"), 3))
+        self.assertEqual(first.line_total, Decimal("210.00"))
+
+        # later price changes don't rewrite the order
+        fooditems[0].price = Decimal("99.00")
+        fooditems[0].save()
+        first.refresh_from_db()
+        self.assertEqual(first.unit_price, Decimal("80.00"))
+        self.assertFalse(CartItem.objects.filter(cart__user=self.customer).exists())
+
+    def test_double_submit_creates_one_order(self):
+        self.fill_cart(self.customer, self.create_fooditems(2))
+
+        first = self.checkout()
+        second = self.checkout()
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+        self.assertEqual(OrderLine.objects.count(), 2)
+
+    def test_checkout_queries_do_not_grow_with_lines(self):
+        def count_checkout_queries(lines):
+            self.fill_cart(self.customer, self.create_fooditems(lines))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.checkout().status_code, status.HTTP_201_CREATED)
+            return len(queries)
+
+        self.assertEqual(count_checkout_queries(1), count_checkout_queries(20))
+
+
+class IdempotencyTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+        self.table = DiningTable.objects.create(table_number=1)
+        self.fill_cart(self.customer, self.create_fooditems(2))
+
+    def checkout(self, key, **data):
+        data = {"dining_table": str(self.table.id), **data}
+        return self.client.post(reverse("create-order"), data, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_replay_the_stored_response(self):
+        first = self.checkout("checkout-1")
+
+        with self.assertNumQueries(1):
+            retry = self.checkout("checkout-1")
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json()["order"]["id"], first.json()["order"]["id"])
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.checkout("checkout-1")
+
+        response = self.checkout("checkout-1", note="different")
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_request_in_progress_returns_409(self):
+        self.checkout("checkout-1")
+        IdempotencyRecord.objects.update(status_code=None, response_body=None)
+
+        response = self.checkout("checkout-1")
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_expired_keys_run_the_view_again(self):
+        self.checkout("checkout-1")
+        IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.checkout("checkout-1")
+
+        # the cart was emptied by the first checkout
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn("Idempotent-Replayed", response)
+
+    def test_purge_deletes_expired_records(self):
+        self.checkout("checkout-1")
+        self.checkout("checkout-2")
+        IdempotencyRecord.objects.filter(key="checkout-1").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        call_command("purge_idempotency_records", batch_size=1, stdout=StringIO())
+
+        self.assertEqual(list(IdempotencyRecord.objects.values_list("key", flat=True)), ["checkout-2"])
+
+
+class ListingQueryCountTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def create_redemption_options(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            for fooditem in self.create_fooditems(count):
+                RedemptionOption.objects.create(fooditem=fooditem, points_required=10, description="test")
+
+    def test_redemption_option_queries_are_constant(self):
+        CustomerPoint.objects.create(user=self.customer, points=10)
+        self.create_redemption_options(1)
+        few_options = self.count_queries(reverse("customer-points"))
+
+        self.create_redemption_options(15)
+        many_options = self.count_queries(reverse("customer-points"))
+
+        self.assertEqual(few_options, many_options)
+
+    def test_order_history_queries_are_constant(self):
+        Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+        few_orders = self.count_queries(reverse("order-history"))
+
+        for i in range(15):
+            Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+        many_orders = self.count_queries(reverse("order-history"))
+
+        self.assertEqual(few_orders, many_orders)
+
+
+class OrderHistoryPaginationTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+
+        for i in range(10):
+            Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+
+        # ties on updated_at are broken by the id
+        tied = Order.objects.filter(user=self.customer).values_list("id", flat=True)[:4]
+        Order.objects.filter(id__in=list(tied)).update(updated_at=timezone.now())
+        self.expected = [
+            str(order_id) for order_id in
+            Order.objects.filter(user=self.customer).order_by("-updated_at", "id").values_list("id", flat=True)
+        ]
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(str(order["id"]) for order in response.data["results"])
+            url = response.data[link]
+        return ids
+
+    def test_pages_cover_every_order_once_in_order(self):
+        ids = self.walk(f"{reverse('order-history')}?page_size=3", "next")
+
+        self.assertEqual(ids, self.expected)
+
+    def test_previous_links_walk_back(self):
+        url = f"{reverse('order-history')}?page_size=4"
+        last_page = self.client.get(self.client.get(self.client.get(url).data["next"]).data["next"])
+        self.assertIsNone(last_page.data["next"])
+
+        ids = self.walk(last_page.data["previous"], "previous")
+
+        self.assertEqual(ids, self.expected[4:8] + self.expected[:4])
+
+    def test_page_queries_do_not_depend_on_depth(self):
+        url = f"{reverse('order-history')}?page_size=2"
+
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(url)
+        for i in range(3):
+            response = self.client.get(response.data["next"])
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(response.data["next"])
+
+        self.assertEqual(len(first), len(deep))
+        self.assertNotIn("OFFSET", deep.captured_queries[-1]["sql"])
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse("order-history"), {"cursor": "not-a-cursor"})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MenuSearchTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+
+        self.drinks = Category.objects.create(name="Drinks", description="Hot and cold beverages")
+        self.chai = FoodItem.objects.create(
+            category=self.drinks, name="Masala Chai", price=Decimal("80.00"),
+            description="Spiced milk tea", is_available=True,
+        )
+        self.juice = FoodItem.objects.create(
+            category=self.drinks, name="Mango Juice", price=Decimal("120.00"),
+            description="Fresh juice, goes well with masala fries", is_available=True,
+        )
+
+    def search(self, query, **params):
+        response = self.client.get(reverse("menu-search"), {"q": query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(result["type"], result[result["type"]]["name"]) for result in response.data["results"]]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search("masala"), [("fooditem", "Masala Chai"), ("fooditem", "Mango Juice")])
+
+    def test_prefix_and_typo_matching(self):
+        self.assertEqual(self.search("mang"), [("fooditem", "Mango Juice")])
+        self.assertEqual(self.search("bevrages"), [("category", "Drinks")])
+        self.assertEqual(self.search("chai masla"), [("fooditem", "Masala Chai")])
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chai.name = "Ginger Tea"
+            self.chai.save()
+            self.juice.delete()
+
+        self.assertEqual(self.search("masala"), [])
+        self.assertEqual(self.search("ginger"), [("fooditem", "Ginger Tea")])
+
+    def test_unavailable_fooditems_are_hidden(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.juice.is_available = False
+            self.juice.save()
+
+        self.assertEqual(self.search("juice"), [])
+
+    def test_rolled_back_saves_are_not_indexed(self):
+        self.assertEqual(self.search("chai"), [("fooditem", "Masala Chai")])
+
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            self.chai.name = "Ginger Tea"
+            self.chai.save()
+            transaction.set_rollback(True)
+
+        self.assertEqual(self.search("ginger"), [])
+
+    def test_index_is_rebuilt_after_a_change_it_did_not_see(self):
+        # e.g a write handled by another worker
+        FoodItem.objects.filter(id=self.chai.id).update(name="Dawa")
+        bump_version(SEARCH)
+
+        self.assertEqual(self.search("dawa"), [("fooditem", "Dawa")])
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class ImageRenditionTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+        self.fooditem, = self.create_fooditems(1)
+
+    def make_image(self, color="red", size=(2000, 1500)):
+        buffer = BytesIO()
+        Image.new("RGB", size, color).save(buffer, format="PNG")
+        return SimpleUploadedFile("photo.png", buffer.getvalue(), content_type="image/png")
+
+    def upload(self, fooditem, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            fooditem.image = image
+            fooditem.save()
+        fooditem.refresh_from_db()
+
+    def test_renditions_are_generated_on_upload(self):
+        with mock.patch("cafecustomer.renditions.bump_version") as bump:
+            self.upload(self.fooditem, self.make_image())
+
+        self.assertEqual(len(self.fooditem.image_hash), 64)
+
+        for size, box in RENDITION_SIZES.items():
+            path = rendition_path(self.fooditem.image_hash, size, "jpg")
+            with default_storage.open(path) as file, Image.open(file) as rendition:
+                self.assertLessEqual(rendition.width, box[0])
+                self.assertLessEqual(rendition.height, box[1])
+
+        renditions = FoodItemSerializer(self.fooditem).data["renditions"]
+        self.assertEqual(set(renditions), set(RENDITION_SIZES))
+        self.assertTrue(renditions["thumb"]["jpg"].endswith(rendition_path(self.fooditem.image_hash, "thumb", "jpg")))
+        # the redemption options embed the renditions too
+        bump.assert_has_calls([mock.call(MENU), mock.call(REDEMPTIONS)])
+
+    def test_duplicate_uploads_share_renditions(self):
+        self.upload(self.fooditem, self.make_image())
+        duplicate, = self.create_fooditems(1)
+
+        with mock.patch("cafecustomer.renditions.render") as render:
+            self.upload(duplicate, self.make_image())
+
+        render.assert_not_called()
+        self.assertEqual(duplicate.image_hash, self.fooditem.image_hash)
+
+    def test_replacing_the_image_drops_the_old_renditions(self):
+        self.upload(self.fooditem, self.make_image())
+        first_hash = self.fooditem.image_hash
+
+        self.upload(self.fooditem, self.make_image(color="blue"))
+
+        self.assertNotEqual(self.fooditem.image_hash, first_hash)
+
+    def test_renditions_are_served_with_long_lived_cache_headers(self):
+        self.upload(self.fooditem, self.make_image())
+        path = rendition_path(self.fooditem.image_hash, "card", "jpg")
+
+        request = RequestFactory().get(f"/media/{path}")
+        response = serve_rendition(request, path.removeprefix(f"{RENDITIONS_DIR}/"), document_root=Path(settings.MEDIA_ROOT) / RENDITIONS_DIR)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("immutable", response["Cache-Control"])
+
+
+class OrderEventTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+
+    def test_broker_delivers_events_published_from_other_threads(self):
+        broker = LocalBroker(max_queue=2)
+
+        async def listen():
+            events = broker.listen("orders", timeout=1)
+            pending = asyncio.ensure_future(anext(events))
+            while not broker.subscriber_count("orders"):
+                await asyncio.sleep(0)
+
+            await asyncio.to_thread(broker.publish, "orders", {"n": 0})
+            received = [await pending]
+
+            # a slow subscriber keeps the latest events
+            await asyncio.to_thread(lambda: [broker.publish("orders", {"n": n}) for n in range(1, 4)])
+            received += [await anext(events), await anext(events)]
+            await events.aclose()
+            return received
+
+        self.assertEqual(asyncio.run(listen()), [{"n": 0}, {"n": 2}, {"n": 3}])
+        self.assertEqual(broker.subscriber_count("orders"), 0)
+
+    def test_stream_rejects_invalid_tokens(self):
+        response = self.client.get(reverse("order-events"), {"token": "invalid"})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_stream_sends_the_user_events(self):
+        token = await asyncio.to_thread(lambda: str(AccessToken.for_user(self.customer)))
+        channel = user_channel(self.customer.id)
+
+        response = await self.async_client.get(reverse("order-events"), {"token": token})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b": connected\n\n")
+
+        pending = asyncio.ensure_future(anext(stream))
+        while not get_broker().subscriber_count(channel):
+            await asyncio.sleep(0)
+        get_broker().publish(channel, {"type": "order.status", "data": {"status": "READY"}})
+
+        self.assertEqual(await pending, b'id: 1\nevent: order.status\ndata: {"status": "READY"}\n\n')
+        await stream.aclose()
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_status_changes_payments_and_notifications_are_published(self):
+        order = Order.objects.create(user=self.customer, total_price=Decimal("50.00"))
+
+        with mock.patch("cafebackend.events.get_broker") as get_broker_mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                order_status_changed.send(sender=Order, orders=[(order.id, "PENDING")], status="READY")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse("make-payment"), {"order_id": order.id})
+
+        published = [(channel, event["type"]) for (channel, event), _ in get_broker_mock.return_value.publish.call_args_list]
+        channel = user_channel(self.customer.id)
+
+        self.assertEqual(published, [
+            (channel, "order.status"), (KITCHEN, "order.status"),
+            (channel, "order.paid"), (KITCHEN, "order.paid"),
+            (channel, "notification"),
+        ])
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class PaymentTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+        self.order = Order.objects.create(user=self.customer, total_price=Decimal("250.00"))
+
+    def pay(self):
+        # runs the outbox drain scheduled once the payment commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("make-payment"), {"order_id": self.order.id})
+
+    def use_gateway(self, gateway):
+        patcher = mock.patch("cafecustomer.payments.get_gateway", return_value=gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_payment_is_accepted_and_settled_by_the_worker(self):
+        self.use_gateway(FakeGateway())
+
+        response = self.pay()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        attempt = PaymentAttempt.objects.get(order=self.order)
+        self.assertEqual(response["Location"], reverse("payment-status", kwargs={"attempt_id": attempt.id}))
+        self.assertEqual(attempt.status, PaymentAttempt.SUCCEEDED)
+        self.assertTrue(attempt.gateway_reference.startswith("FAKE-"))
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+        self.assertEqual(CustomerPoint.objects.get(user=self.customer).points, 2)
+        self.assertTrue(Notification.objects.filter(user=self.customer).exists())
+
+        status_response = self.client.get(response["Location"])
+        self.assertEqual(status_response.data["status"], PaymentAttempt.SUCCEEDED)
+        self.assertEqual(self.pay().status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retried_payment_requests_get_the_status_url_back(self):
+        self.use_gateway(FakeGateway())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(reverse("make-payment"), {"order_id": self.order.id}, HTTP_IDEMPOTENCY_KEY="pay-1")
+        retry = self.client.post(reverse("make-payment"), {"order_id": self.order.id}, HTTP_IDEMPOTENCY_KEY="pay-1")
+
+        self.assertEqual(retry.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry["Location"], first["Location"])
+
+    def test_declined_payment_can_be_retried(self):
+        self.use_gateway(FakeGateway(failure_rate=1))
+
+        self.assertEqual(self.pay().status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.pay().status_code, status.HTTP_202_ACCEPTED)
+
+        self.assertEqual(
+            list(PaymentAttempt.objects.filter(order=self.order).values_list("status", flat=True)),
+            [PaymentAttempt.FAILED, PaymentAttempt.FAILED],
+        )
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+
+    def test_gateway_callback_finalizes_the_payment(self):
+        gateway = mock.Mock()
+        gateway.charge.return_value = None
+        self.use_gateway(gateway)
+
+        self.pay()
+        # the attempt waits for the gateway, a retry doesn't charge again
+        response = self.pay()
+        attempt = PaymentAttempt.objects.get(order=self.order)
+        self.assertEqual(response.data["payment"]["id"], str(attempt.id))
+        self.assertEqual(attempt.status, PaymentAttempt.PROCESSING)
+        self.assertEqual(gateway.charge.call_count, 1)
+
+        body = json.dumps({"attempt": str(attempt.id), "succeeded": True, "reference": "GW-1"}).encode()
+
+        def callback(signature):
+            self.client.force_authenticate(user=None)
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.generic(
+                    "POST", reverse("payment-callback"), body,
+                    content_type="application/json", HTTP_X_GATEWAY_SIGNATURE=signature,
+                )
+
+        self.assertEqual(callback("forged").status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(callback(sign_callback(body)).data, {"recorded": True})
+        self.assertEqual(callback(sign_callback(body)).data, {"recorded": False})
+
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.gateway_reference), (PaymentAttempt.SUCCEEDED, "GW-1"))
+        self.assertEqual(Notification.objects.filter(user=self.customer).count(), 1)
+
+    def test_saturated_payment_pool_returns_503(self):
+        with mock.patch("cafecustomer.views.schedule_payment", side_effect=PoolSaturated):
+            response = self.pay()
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "5")
+        self.assertEqual(PaymentAttempt.objects.get(order=self.order).status, PaymentAttempt.FAILED)
+
+    def test_attempts_lost_by_the_pool_are_recovered(self):
+        self.use_gateway(FakeGateway())
+        stale = timezone.now() - timedelta(hours=1)
+
+        # queued when the process stopped
+        lost = PaymentAttempt.objects.create(order=self.order, amount=self.order.total_price)
+        PaymentAttempt.objects.filter(id=lost.id).update(updated_at=stale)
+        # being charged when the process stopped
+        other = Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+        charging = PaymentAttempt.objects.create(order=other, amount=other.total_price, status=PaymentAttempt.PROCESSING)
+        PaymentAttempt.objects.filter(id=charging.id).update(updated_at=stale)
+        # still fresh, left alone
+        fresh_order = Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+        fresh = PaymentAttempt.objects.create(order=fresh_order, amount=fresh_order.total_price)
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("recover_payments", stdout=out)
+
+        self.assertIn("Scheduled 1 payments again, settled 1", out.getvalue())
+        self.assertEqual(PaymentAttempt.objects.get(id=lost.id).status, PaymentAttempt.SUCCEEDED)
+        self.assertEqual(PaymentAttempt.objects.get(id=charging.id).status, PaymentAttempt.FAILED)
+        self.assertEqual(PaymentAttempt.objects.get(id=fresh.id).status, PaymentAttempt.PENDING)
+
+        # the order whose charge was lost can be paid again
+        self.order = other
+        self.assertEqual(self.pay().status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(Order.objects.get(id=other.id).is_paid)
+
+
+class OutboxTests(APITestCase):
+
+    def setUp(self):
+        self.customers = [
+            User.objects.create_user(username=f"customer{i}", password="customerpass", role="customer")
+            for i in range(3)
+        ]
+
+    def record_paid_orders(self, total_price="250.00"):
+        orders = []
+        for customer in self.customers:
+            order = Order.objects.create(user=customer, total_price=Decimal(total_price), is_paid=True)
+            record_event(ORDER_PAID, {"order": order.id, "user": customer.id, "total_price": order.total_price})
+            orders.append(order)
+        return orders
+
+    def test_successful_payment_only_writes_the_attempt_order_and_event(self):
+        order = Order.objects.create(user=self.customers[0], total_price=Decimal("250.00"))
+        attempt = PaymentAttempt.objects.create(order=order, amount=order.total_price)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(finalize_payment(attempt.id, GatewayResult(True, "GW-1", "")))
+
+        writes = [query["sql"].split()[0] for query in queries if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))]
+        self.assertEqual(writes, ["UPDATE", "UPDATE", "INSERT"])
+        self.assertEqual(OutboxEvent.objects.get().payload["order"], str(order.id))
+        self.assertFalse(Notification.objects.exists())
+
+    def test_events_are_drained_in_batches(self):
+        orders = self.record_paid_orders()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(drain_outbox(batch_size=10), 3)
+
+        # the batch is handled with bulk writes whatever its size
+        self.assertLess(len(queries), 30)
+        self.assertEqual(
+            sorted(CustomerPoint.objects.values_list("points", flat=True)), [2, 2, 2]
+        )
+        self.assertEqual(set(Transaction.objects.values_list("order_id", flat=True)), {order.id for order in orders})
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_small_orders_get_no_points(self):
+        self.record_paid_orders(total_price="50.00")
+
+        drain_outbox()
+
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_replayed_events_award_points_once(self):
+        orders = self.record_paid_orders()
+        drain_outbox()
+
+        # the same payments recorded again, e.g by a retried callback
+        for order in orders:
+            record_event(ORDER_PAID, {"order": order.id, "user": order.user_id, "total_price": order.total_price})
+        drain_outbox()
+
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(sorted(CustomerPoint.objects.values_list("points", flat=True)), [2, 2, 2])
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_failing_batch_is_rolled_back_and_retried(self):
+        self.record_paid_orders()
+
+        handlers = [*_handlers[ORDER_PAID], mock.Mock(side_effect=RuntimeError("handler down"))]
+        with mock.patch.dict(_handlers, {ORDER_PAID: handlers}), self.assertLogs("cafecustomer.outbox", "ERROR"):
+            self.assertEqual(drain_outbox(), 0)
+
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(CustomerPoint.objects.exists())
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list("attempts", "processed_at")), [(1, None)] * 3
+        )
+        self.assertIn("handler down", OutboxEvent.objects.first().last_error)
+
+        self.assertEqual(drain_outbox(), 3)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_only_the_failing_event_of_a_batch_counts_an_attempt(self):
+        orders = self.record_paid_orders()
+        failing = str(orders[1].id)
+
+        def handler(events):
+            if any(event.payload["order"] == failing for event in events):
+                raise RuntimeError("bad order")
+
+        with mock.patch.dict(_handlers, {ORDER_PAID: [*_handlers[ORDER_PAID], handler]}), \
+                self.assertLogs("cafecustomer.outbox", "ERROR"):
+            self.assertEqual(drain_outbox(), 2)
+
+        self.assertEqual(
+            set(Notification.objects.values_list("order_id", flat=True)), {orders[0].id, orders[2].id}
+        )
+        pending = OutboxEvent.objects.get(processed_at__isnull=True)
+        self.assertEqual((pending.payload["order"], pending.attempts), (failing, 1))
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=False, attempts__gt=0).exists())
+
+    def test_drain_outbox_command(self):
+        self.record_paid_orders()
+        out = StringIO()
+
+        call_command("drain_outbox", "--batch-size", "2", stdout=out)
+
+        self.assertIn("Handled 3 outbox events.", out.getvalue())
+
+
+class TableTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.other = User.objects.create_user(username="other", password="otherpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+        self.tables = [DiningTable.objects.create(table_number=number) for number in (1, 2)]
+
+    def claim(self, table):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("table-claim"), {"dining_table": table.id})
+
+    def test_a_table_is_claimed_by_a_single_customer(self):
+        self.assertEqual(self.claim(self.tables[0]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.claim(self.tables[0]).status_code, status.HTTP_200_OK)
+
+        self.assertFalse(claim_table(self.other, self.tables[0].id))
+
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.claim(self.tables[0]).status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            self.client.post(reverse("table-claim"), {"dining_table": str(uuid.uuid4())}).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_claiming_another_table_releases_the_first(self):
+        self.claim(self.tables[0])
+        self.claim(self.tables[1])
+
+        self.assertEqual(
+            list(DiningTable.objects.order_by("table_number").values_list("is_occupied", flat=True)), [False, True]
+        )
+        self.assertEqual(UserDinningTable.objects.get(user=self.customer).dinning_table, self.tables[1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse("table-claim"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(DiningTable.objects.filter(is_occupied=True).exists())
+        self.assertEqual(self.client.delete(reverse("table-claim")).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_floor_map_is_served_from_the_cache_until_a_table_changes(self):
+        first = self.client.get(reverse("floor-map"))
+        self.assertEqual(first.data["available"], 2)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse("floor-map"))
+        self.assertEqual(cached.data, first.data)
+        self.assertEqual(
+            self.client.get(reverse("floor-map"), HTTP_IF_NONE_MATCH=first["ETag"]).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+
+        version = get_version(FLOOR)
+        self.claim(self.tables[0])
+        self.assertNotEqual(get_version(FLOOR), version)
+
+        response = self.client.get(reverse("floor-map"))
+        self.assertEqual((response.data["occupied"], response.data["available"]), (1, 1))
+        self.assertEqual([table["is_occupied"] for table in response.data["tables"]], [True, False])
+
+    def test_checkout_orders_at_the_claimed_table(self):
+        self.claim(self.tables[1])
+        self.fill_cart(self.customer, self.create_fooditems(1))
+
+        response = self.client.post(reverse("create-order"))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.get(user=self.customer).dining_table, self.tables[1])
+
+    def test_checkout_at_a_table_held_by_someone_else_is_rejected(self):
+        claim_table(self.other, self.tables[0].id)
+        self.fill_cart(self.customer, self.create_fooditems(1))
+
+        response = self.client.post(reverse("create-order"), {"dining_table": self.tables[0].id})
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(
+            self.client.post(reverse("create-order")).status_code, status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_checkout_with_an_empty_cart_does_not_claim_the_table(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("create-order"), {"dining_table": self.tables[0].id})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.tables[0].refresh_from_db()
+        self.assertFalse(self.tables[0].is_occupied)
+        self.assertFalse(UserDinningTable.objects.filter(user=self.customer, dinning_table__isnull=False).exists())
+
+
+class PointsLedgerTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+        self.option = RedemptionOption.objects.create(
+            fooditem=self.create_fooditems(1)[0], points_required=3, description="test"
+        )
+
+    def award(self, total_price="500.00"):
+        self.award_points(Order.objects.create(user=self.customer, total_price=Decimal(total_price), is_paid=True))
+
+    def test_redemptions_never_overspend(self):
+        self.award()
+
+        self.assertIsNotNone(redeem_points(self.customer, self.option))
+        self.assertIsNone(redeem_points(self.customer, self.option))
+
+        self.assertEqual(CustomerPoint.objects.get(user=self.customer).points, 2)
+        self.assertEqual(
+            list(PointsEntry.objects.values_list("kind", "points")),
+            [(PointsEntry.EARN, 5), (PointsEntry.REDEEM, -3)],
+        )
+
+        response = self.client.post(reverse("redeem-points", kwargs={"pk": self.option.id}))
+        self.assertEqual(response.data, {"message": "Sorry, insufficient points."})
+
+    def test_checkpoints_bound_the_ledger_read(self):
+        with mock.patch("cafecustomer.myutils.CHECKPOINT_INTERVAL", 4):
+            for _ in range(5):
+                self.award()
+            redeem_points(self.customer, self.option)
+
+        checkpoint = PointsEntry.objects.get(kind=PointsEntry.CHECKPOINT)
+        self.assertEqual(checkpoint.balance, 20)
+        self.assertEqual(PointsEntry.objects.filter(id__gt=checkpoint.id).count(), 2)
+        self.assertEqual(CustomerPoint.objects.get(user=self.customer).unchecked_entries, 2)
+        self.assertEqual(ledger_balance(self.customer.id), 22)
+        self.assertEqual(ledger_mismatches(), {})
+
+    def test_points_from_before_the_ledger_are_opened(self):
+        CustomerPoint.objects.create(user=self.customer, points=7)
+        self.assertEqual(ledger_mismatches(), {self.customer.id: (7, 0)})
+
+        self.assertEqual(open_ledgers(), 1)
+        self.assertEqual(open_ledgers(), 0)
+
+        self.award()
+        self.assertEqual(ledger_balance(self.customer.id), 12)
+        self.assertEqual(ledger_mismatches(), {})
+
+
+class PointsConcurrencyTests(CafeTestMixin, TransactionTestCase):
+    """
+    Awards and redeems points from many threads at once, every thread on
+    its own database connection.
+    """
+
+    THREADS = 8
+
+    def run_concurrently(self, tasks):
+        errors = []
+
+        def run(task):
+            try:
+                # SQLite reports a busy database instead of waiting, retry like a client would
+                for attempt in range(50):
+                    try:
+                        return task()
+                    except OperationalError:
+                        time.sleep(0.01 * (attempt + 1))
+                raise AssertionError("database stayed busy")
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(task,)) for task in tasks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def test_no_lost_or_negative_balances(self):
+        customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        option = RedemptionOption.objects.create(
+            fooditem=self.create_fooditems(1)[0], points_required=5, description="test"
+        )
+        orders = [
+            Order.objects.create(user=customer, total_price=Decimal("300.00"), is_paid=True)
+            for _ in range(self.THREADS * 2)
+        ]
+
+        self.run_concurrently([lambda order=order: self.award_points(order) for order in orders])
+        self.assertEqual(CustomerPoint.objects.get(user=customer).points, 3 * len(orders))
+
+        # twice as many redemptions as the points can pay for
+        self.run_concurrently([lambda: redeem_points(customer, option)] * (len(orders) * 3 * 2 // 5))
+
+        self.assertEqual(RedemptionTransaction.objects.filter(customer=customer).count(), len(orders) * 3 // 5)
+        self.assertEqual(CustomerPoint.objects.get(user=customer).points, len(orders) * 3 % 5)
+        self.assertEqual(ledger_mismatches(), {})
+
+
+class RedemptionIndexTests(CafeTestMixin, APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        redemption_index.version = None
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.force_authenticate(user=self.customer)
+        self.options = [
+            RedemptionOption.objects.create(fooditem=fooditem, points_required=points, description="test")
+            for fooditem, points in zip(self.create_fooditems(6), (25, 5, 10, 40, 10, 60))
+        ]
+
+    def points(self):
+        response = self.client.get(reverse("customer-points"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_only_affordable_options_and_next_targets_are_listed(self):
+        CustomerPoint.objects.create(user=self.customer, points=10)
+
+        data = self.points()
+
+        self.assertEqual([option["points_required"] for option in data["redemption_options"]], [5, 10, 10])
+        self.assertEqual([option["points_required"] for option in data["next_options"]], [25, 40, 60])
+        self.assertIn("id", data["redemption_options"][0])
+
+    def test_options_are_serialized_once_per_version(self):
+        CustomerPoint.objects.create(user=self.customer, points=30)
+        self.points()
+
+        # the balance and the version are all a refresh reads
+        with self.assertNumQueries(1):
+            data = self.points()
+        self.assertEqual(len(data["redemption_options"]), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.options[3].points_required = 30
+            self.options[3].save()
+        self.assertEqual(len(self.points()["redemption_options"]), 5)
+
+        fooditem = self.options[0].fooditem
+        with self.captureOnCommitCallbacks(execute=True):
+            fooditem.name = "Renamed"
+            fooditem.save()
+        names = [option["fooditem"]["name"] for option in self.points()["redemption_options"]]
+        self.assertIn("Renamed", names)
+
+
+@override_settings(REPLICA_DATABASES=["replica"], REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingTests(CafeTestMixin, APITestCase):
+    """
+    Routes against a second in-memory SQLite database standing in for a
+    replica that hasn't caught up: rows written to the default database
+    are missing from it.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # the stand-in is added once the test runner has set up the declared
+        # databases, and stays empty since nothing is written to it
+        replica = copy.deepcopy(connections.settings[DEFAULT_DB_ALIAS])
+        replica["NAME"] = ""
+        replica["TEST"] = {**replica["TEST"], "NAME": None}
+        connections.settings["replica"] = replica
+        connections["replica"].creation.create_test_db(verbosity=0, serialize=False)
+        cls.databases = {DEFAULT_DB_ALIAS, "replica"}
+
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+        connections["replica"].creation.destroy_test_db(connections["replica"].settings_dict["NAME"], verbosity=0)
+        del connections["replica"]
+        del connections.settings["replica"]
+        del cls.databases
+
+    def setUp(self):
+        cache.clear()
+        self.customer = User.objects.create_user(username="customer", password="customerpass", role="customer")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RoleRefreshToken.for_user(self.customer).access_token}")
+        Order.objects.create(user=self.customer, total_price=Decimal("100.00"))
+
+    def order_count(self):
+        response = self.client.get(reverse("order-history"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(response.data.get("results", []))
+
+    def test_safe_requests_read_from_the_replica(self):
+        self.assertEqual(self.order_count(), 0)
+
+        with override_settings(REPLICA_DATABASES=[]):
+            self.assertEqual(self.order_count(), 1)
+
+    def test_users_read_their_own_writes(self):
+        fooditem = self.create_fooditems(1)[0]
+
+        response = self.client.post(reverse("add-to-cart"), {"fooditem": fooditem.id, "quantity": 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.order_count(), 1)
+
+        # the window is kept per user
+        other = User.objects.create_user(username="other", password="otherpass", role="customer")
+        Order.objects.create(user=other, total_price=Decimal("100.00"))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RoleRefreshToken.for_user(other).access_token}")
+        self.assertEqual(self.order_count(), 0)
+
+        # and ends after REPLICA_STICKY_SECONDS
+        cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RoleRefreshToken.for_user(self.customer).access_token}")
+        self.assertEqual(self.order_count(), 0)
+
+    def test_cached_payloads_and_indexes_are_built_from_the_default_database(self):
+        admin = User.objects.create_user(username="admin", password="adminpass", role="admin")
+        fooditem = self.create_fooditems(1)[0]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RoleRefreshToken.for_user(admin).access_token}")
+
+        # the replica hasn't caught up with the new fooditem yet
+        for _ in range(2):
+            response = self.client.get(reverse("fooditems"))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([item["id"] for item in response.data["results"]], [str(fooditem.id)])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RoleRefreshToken.for_user(self.customer).access_token}")
+        menu_index.version = None
+        self.client.get(reverse("menu-search"), {"q": fooditem.name})
+        self.assertIn(fooditem.id, [hit.id for hit in menu_index.search(fooditem.name)])
+
+    def test_writes_and_reads_outside_requests_use_the_default_database(self):
+        router = ReplicaRouter()
+        token = reads_from_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Order), "replica")
+            self.assertEqual(Order.objects.count(), 0)
+            self.assertEqual(Order.objects.select_for_update().count(), 1)
+
+            stale = Order.objects.using("replica").model(user=self.customer, total_price=Decimal("50.00"))
+            stale._state.db = "replica"
+            self.assertEqual(router.db_for_write(Order, instance=stale), DEFAULT_DB_ALIAS)
+        finally:
+            reads_from_replica.reset(token)
+
+        self.assertEqual(router.db_for_read(Order), DEFAULT_DB_ALIAS)
+        self.assertEqual(Order.objects.count(), 1)
@@ -1,18 +1,34 @@
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from .permissions import IsCustomer
+from cafebackend.events import authenticate_stream, event_stream, unauthorized, user_channel
+from cafebackend.pagination import KeysetPagination
+from cafebackend.workers import PoolSaturated
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
 from django.shortcuts import get_object_or_404
 
-from .models import (Cart, CartItem, Order, FoodItem, DiningTable,
-                     Notification, Review, CustomerPoint, RedemptionOption)
+from .models import (Cart, CartItem, Order, OrderLine, PaymentAttempt, FoodItem, DiningTable,
+                     Notification, Review, CustomerPoint, RedemptionOption, Category)
 from .serializers import (CartItemSerializer, CartSerializer, OrderSerializer,
-                          NotificationSerializer, ReviewSerializer, RedemptionOptionSerializer)
-
-from .myutils import assign_points, redeem_points
+                          ReviewSerializer,
+                          CategorySerializer, FoodItemSerializer, PaymentAttemptSerializer,
+                          PaymentCallbackSerializer, TableClaimSerializer)
+
+from .caching import FLOOR, versioned_response
+from .idempotency import idempotent
+from .myutils import redeem_points
+from .payments import GatewayResult, finalize_payment, schedule_payment, verify_callback
+from .pricing import get_price_resolver, price_cart
+from .redemptions import redemption_options
+from .search import CATEGORY, FOODITEM, search_menu
+from .tables import claim_table, claimed_table_id, floor_map, release_table
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, IsCustomer])
@@ -65,7 +81,7 @@ class AddToCartAPIView(APIView):
             }
 
             # cartitem data passed to the serializer,it will be created in serializer create method
-            serializer = CartItemSerializer(data=cartitem_data)
+            serializer = CartItemSerializer(data=cartitem_data, context={"request": request})
 
             if serializer.is_valid():
                 serializer.save()
@@ -95,13 +111,18 @@ class CartItemsAPIView(APIView):
 
         # fetches or creates a cart for the user
         cart, created = Cart.objects.get_or_create(user=user)
-        cart_items = cart.cartitems.all()
 
-        if cart_items:
-            serializer = CartItemSerializer(cart_items, many=True)
+        # prices every cartitem with a single query
+        resolver = get_price_resolver(request)
+        pricing = price_cart(cart, resolver)
+
+        if pricing.lines:
+            cart_items = [line.cartitem for line in pricing.lines]
+            serializer = CartItemSerializer(cart_items, many=True, context={"request": request})
             response = {
                 "cartitems": serializer.data,
-                "total_price":cart.total_price
+                # the totals are read from the cart row fetched above
+                **cart.get_totals(resolver),
             }
             return Response(response, status=status.HTTP_200_OK)
 
@@ -131,17 +152,19 @@ class CartItemUpdateAPIView(APIView):
         cartitem_id = kwargs.get("cartitem_id") # passed in the url
         quantity = request.data.get("quantity")
 
-        # validates the cartitem belongs to the user
-        cartitem = get_object_or_404(CartItem, id=cartitem_id, cart__user=user)
+        with transaction.atomic():
+            # validates the cartitem belongs to the user, the row is locked so
+            # concurrent updates apply their change to the cart totals one at a time
+            cartitem = get_object_or_404(CartItem.objects.select_for_update(), id=cartitem_id, cart__user=user)
 
-        # updates the quantity if provided:
-        if quantity and int(quantity) > 0:
-            cartitem.quantity = int(quantity)
-            cartitem.save()
-        else:
-          return Response({"detail":"Invalid quantity"}, status=status.HTTP_400_BAD_REQUEST)
+            # updates the quantity if provided:
+            if quantity and int(quantity) > 0:
+                cartitem.quantity = int(quantity)
+                cartitem.save()
+            else:
+              return Response({"detail":"Invalid quantity"}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = CartItemSerializer(cartitem)
+        serializer = CartItemSerializer(cartitem, context={"request": request})
         return Response(serializer.data, status=status.HTTP_200_OK)
     
     def delete(self, request, *args,  **kwargs):
@@ -153,11 +176,12 @@ class CartItemUpdateAPIView(APIView):
 
         cartitem_id = kwargs.get("cartitem_id")
 
-        # validates the cartitem belongs to the user
-        cartitem = get_object_or_404(CartItem, id=cartitem_id, cart__user=user)
+        with transaction.atomic():
+            # validates the cartitem belongs to the user, locked as in patch
+            cartitem = get_object_or_404(CartItem.objects.select_for_update(), id=cartitem_id, cart__user=user)
 
-        # deletes the cartitem
-        cartitem.delete()
+            # deletes the cartitem
+            cartitem.delete()
 
         return Response({"detail":"Item removed from Cart"}, status=status.HTTP_200_OK)
     
@@ -175,13 +199,19 @@ class CreateOrderAPIView(APIView):
 
     permission_classes = [IsAuthenticated, IsCustomer] 
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         """
         Handles post requests to create an order from the user's cart.
+        - Orders at the `dining_table` given, claiming it for the user, or
+          at the table the user already claimed.
         - Ensures that the cart is not empty.
-        - Fetches the total price from the cart.
+        - Snapshots the priced cartitems into order lines.
         - Clears the cart once the order has been created.
 
+        The cart row is locked for the whole checkout, so a concurrent
+        double-submit waits and then finds the cart empty.
+
         Returns:
         - A success message with the created order details and totalprice
         - A message if the cart is empty.
@@ -189,42 +219,60 @@ class CreateOrderAPIView(APIView):
 
 
         user = request.user
-        # fetches the dinning table 
-        dinning_table_id = request.data.get("dining_table")
+        # the dinning table given, or the one the user claimed before
+        dinning_table_id = request.data.get("dining_table") or claimed_table_id(user)
+        serializer = TableClaimSerializer(data={"dining_table": dinning_table_id})
 
-        try:
-            dinning_table = DiningTable.objects.get(id=dinning_table_id)
-        except DiningTable.DoesNotExist:
+        if not serializer.is_valid():
             return Response({"detail":"Please indicate the dinning table."}, status=status.HTTP_400_BAD_REQUEST)
 
+        dinning_table_id = serializer.validated_data["dining_table"]
 
-        cart, created = Cart.objects.get_or_create(user=user)
-        cartitems = cart.cartitems.all()
+        with transaction.atomic():
+            try:
+                claimed = claim_table(user, dinning_table_id)
+            except DiningTable.DoesNotExist:
+                return Response({"detail":"Please indicate the dinning table."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # if cart is empty
-        if not cartitems.exists():
-            response = {
-                "message": "Your cart is empty. Please add items to cart before placing an order"
-            }
+            if not claimed:
+                return Response({"detail": "This table is occupied."}, status=status.HTTP_409_CONFLICT)
 
-            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+            cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+            pricing = price_cart(cart, get_price_resolver(request))
 
-        # gets the total price from the cart
-        total_price = cart.total_price
+            # if cart is empty
+            if not pricing.lines:
+                response = {
+                    "message": "Your cart is empty. Please add items to cart before placing an order"
+                }
 
-        # creates a new order
-        order = Order.objects.create(
-            user = user,
-            total_price = total_price,
-            dining_table= dinning_table
-        )
+                # no order, so the table claimed for it is not kept either
+                transaction.set_rollback(True)
+                return Response(response, status=status.HTTP_400_BAD_REQUEST)
 
-        # add the cart items to the order
-        # order.order_items.add(cartitems)
-        # order.save()
+            # creates a new order
+            order = Order.objects.create(
+                user = user,
+                total_price = pricing.total,
+                dining_table_id= dinning_table_id
+            )
 
-        # cleares the cart after creating the order
-        cartitems.delete()
+            # snapshots the priced cartitems so the order keeps its prices
+            OrderLine.objects.bulk_create([
+                OrderLine(
+                    order=order,
+                    fooditem=line.cartitem.fooditem,
+                    name=line.cartitem.fooditem.name,
+                    unit_price=line.unit_price,
+                    discount=line.discount,
+                    quantity=line.cartitem.quantity,
+                    line_total=line.line_total,
+                )
+                for line in pricing.lines
+            ])
+
+            # cleares the cart after creating the order
+            cart.clear()
 
         serializer = OrderSerializer(order)
 
@@ -235,6 +283,85 @@ class CreateOrderAPIView(APIView):
         return Response(response, status=status.HTTP_201_CREATED)
 
 
+class FloorMapAPIView(APIView):
+    """
+    API view listing the dining tables and their occupancy.
+
+    The floor map is cached until a table changes, so refreshing it costs
+    no database query.
+
+    Methods:
+        get: lists the tables.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handle GET requests to list the tables.
+
+        Returns:
+            - The tables by number and the number of occupied and available tables.
+        """
+
+        return versioned_response(request, FLOOR, lambda: (floor_map(), status.HTTP_200_OK))
+
+
+class TableClaimAPIView(APIView):
+    """
+    API view for claiming and leaving a dining table.
+
+    The user must be authenticated.
+
+    Methods:
+        post: claims a free table, releasing the table held before.
+        delete: releases the table held.
+    """
+
+    permission_classes = [IsAuthenticated, IsCustomer]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handle POST requests to claim the `dining_table`.
+
+        Returns:
+            - The claimed table.
+            - 409 if someone else holds the table.
+        """
+
+        serializer = TableClaimSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        table_id = serializer.validated_data["dining_table"]
+
+        try:
+            claimed = claim_table(request.user, table_id)
+        except DiningTable.DoesNotExist:
+            return Response({"detail": "Dining table not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        if not claimed:
+            return Response({"detail": "This table is occupied."}, status=status.HTTP_409_CONFLICT)
+
+        return Response({"dining_table": table_id}, status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        """
+        Handle DELETE requests to release the table held.
+
+        Returns:
+            - The released table, 404 if the user held none.
+        """
+
+        table_id = release_table(request.user)
+
+        if table_id is None:
+            return Response({"detail": "You are not seated at a table."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({"dining_table": table_id}, status=status.HTTP_200_OK)
+
+
 class PaymentAPIView(APIView):
     """
     API view for handling payment after an order has been created.
@@ -247,15 +374,16 @@ class PaymentAPIView(APIView):
 
     permission_classes = [IsAuthenticated, IsCustomer] 
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         """
         Handle POST requests for processing payments.
-        - The user will provide payment information.
+        - Creates a payment attempt, charged by a background worker through the gateway.
         - Once the payment is successful, the order will be updated, and the user will receive a notification.
 
         Returns:
-            - A success message if payment is processed successfully.
-            - An error message if something goes wrong.
+            - The pending payment attempt, its status is available from the payment-status endpoint.
+            - An error message if the order is already paid or payments are busy.
         """
         
         order_id = request.data.get('order_id')
@@ -268,45 +396,102 @@ class PaymentAPIView(APIView):
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # if order is not paid for, payment processing goes here
-        # implement daraja api
 
-        # simulate payment is paid for now
-        payment_successful = True
+        try:
+            with transaction.atomic():
+                attempt = PaymentAttempt.objects.create(order=order, amount=order.total_price)
+        except IntegrityError:
+            # the order already has an attempt being processed
+            attempt = PaymentAttempt.objects.filter(
+                order=order, status__in=PaymentAttempt.ACTIVE_STATUSES
+            ).first()
+
+            if attempt is None:
+                return Response({"message": "Payment failed. Please try again."}, status=status.HTTP_409_CONFLICT)
+        else:
+            try:
+                schedule_payment(attempt)
+            except PoolSaturated:
+                PaymentAttempt.objects.filter(id=attempt.id).update(
+                    status=PaymentAttempt.FAILED, error="Payments are busy."
+                )
+                return Response(
+                    {"message": "Payments are busy. Please try again shortly."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={"Retry-After": "5"},
+                )
+
+            attempt.refresh_from_db()
 
-        if payment_successful:
-            order.is_paid = True
-            order.save()
+        return Response(
+            {
+                "message": "Payment is being processed.",
+                "payment": PaymentAttemptSerializer(attempt).data,
+            },
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": reverse("payment-status", kwargs={"attempt_id": attempt.id})},
+        )
 
-            # assigns points only if order's total_price is >= to 100
-            if order.total_price >= 100:
-                assign_points(order)
 
-            # send a payment notification to the cafeadmin
+class PaymentStatusAPIView(APIView):
+    """
+    API view for checking the status of a payment attempt.
 
+    The user must be authenticated.
 
-            # sends an in app notification to  the customer
-            notification = Notification.objects.create(
-                user = request.user,
-                message = f"Your payment for Order {order.id} has been processed sucessfully"
-            )
+    Methods:
+        get: retrieves a payment attempt of the user.
+    """
 
-            notification_serializer = NotificationSerializer(notification)
+    permission_classes = [IsAuthenticated, IsCustomer] 
 
-            return Response(
-                {
-                    "message": "Payment processed successfully.",
-                    "order": OrderSerializer(order).data,
-                    "notification": notification_serializer.data
-                },
-                status=status.HTTP_200_OK
-            )
+    def get(self, request, attempt_id, *args, **kwargs):
+        """
+        Handle GET requests to retrieve a payment attempt.
 
-        return Response(
-            {"message": "Payment failed. Please try again."},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+        Returns:
+            - The payment attempt and its status.
+        """
+
+        attempt = get_object_or_404(PaymentAttempt, id=attempt_id, order__user=request.user)
+
+        return Response(PaymentAttemptSerializer(attempt).data, status=status.HTTP_200_OK)
+
+
+class PaymentCallbackAPIView(APIView):
+    """
+    API view receiving the outcome of charges from the payment gateway.
+
+    Requests are authenticated by the X-Gateway-Signature header, the
+    HMAC-SHA256 of the body with the PAYMENT_CALLBACK_SECRET.
+
+    Methods:
+        post: records the outcome of a charge.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Handle POST requests reporting the outcome of a charge.
+
+        Returns:
+            - Whether the outcome was recorded, outcomes of finalized attempts are ignored.
+        """
+
+        if not verify_callback(request.body, request.headers.get("X-Gateway-Signature")):
+            return Response({"detail": "Invalid signature."}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = PaymentCallbackSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        recorded = finalize_payment(data["attempt"], GatewayResult(data["succeeded"], data["reference"], data["error"]))
+
+        return Response({"recorded": recorded}, status=status.HTTP_200_OK)
 
 
 class OrderHistoryAPIView(APIView):
@@ -320,20 +505,25 @@ class OrderHistoryAPIView(APIView):
     """
 
     permission_classes = [IsAuthenticated, IsCustomer] 
+    pagination_class = KeysetPagination
+    ordering = ("-updated_at", "id")
 
     def get(self, request, *args, **kwargs):
         """
         Handle GET requests to retrieve all past orders for the authenticated user.
 
         Returns:
-            - A list of the user's past orders.
+            - A page of the user's past orders, most recent first.
         """
 
-        orders = Order.objects.filter(user=request.user)
+        paginator = self.pagination_class()
+        orders = paginator.paginate_queryset(
+            OrderSerializer.setup_eager_loading(Order.objects.filter(user=request.user)), request, view=self
+        )
 
-        if orders:
+        if orders or paginator.cursor:
             serializer = OrderSerializer(orders, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return paginator.get_paginated_response(serializer.data)
 
         return Response({"message":"You have no past orders."}, status=status.HTTP_200_OK)
 
@@ -350,6 +540,8 @@ class ReviewAPIView(APIView):
     """
 
     permission_classes = [IsAuthenticated, IsCustomer] 
+    pagination_class = KeysetPagination
+    ordering = ("-created_at", "id")
 
     def post(self, request, *args, **kwargs):
         """
@@ -379,12 +571,14 @@ class ReviewAPIView(APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        Retrieve all reviews for the authenticated user.
+        Retrieve a page of the reviews of the authenticated user, most recent first.
         """
-        reviews = Review.objects.filter(user=request.user)
-        if reviews:
+        paginator = self.pagination_class()
+        reviews = paginator.paginate_queryset(Review.objects.filter(user=request.user), request, view=self)
+
+        if reviews or paginator.cursor:
             serializer = ReviewSerializer(reviews, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return paginator.get_paginated_response(serializer.data)
         
         response = {
                 "detail":"You have made no reviews for your orders."
@@ -395,7 +589,7 @@ class ReviewAPIView(APIView):
 
 class CustomerPointAPIView(APIView):
     """
-    API view for viewing customerpoints and all the available redemption options.
+    API view for viewing customerpoints and the redemption options they afford.
 
     The user must be authenticated.
 
@@ -407,18 +601,18 @@ class CustomerPointAPIView(APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        Gets the customer's current points
+        Gets the customer's current points, the redemption options they
+        afford and the next options out of reach.
         """
         customerpoints, created = CustomerPoint.objects.get_or_create(user=request.user)
 
-        redemption_options = RedemptionOption.objects.all()
-
-        if redemption_options:
-            serializer = RedemptionOptionSerializer(redemption_options, many=True)
+        affordable, next_options = redemption_options(customerpoints.points)
 
+        if affordable or next_options:
             response = {
                 "points":customerpoints.points,
-                "redemption_options":serializer.data
+                "redemption_options":affordable,
+                "next_options":next_options,
             }
             return Response(response, status=status.HTTP_200_OK)
         
@@ -442,6 +636,7 @@ class CustomerRedeemPointAPIView(APIView):
     permission_classes = [IsAuthenticated, IsCustomer] 
 
     
+    @idempotent
     def post(self, request, pk):
         """
         Handles POST request for redeeming an option.
@@ -460,4 +655,93 @@ class CustomerRedeemPointAPIView(APIView):
             )
             return Response({"message":"Points redeemed successfully"}, status=status.HTTP_200_OK)
 
-        return Response({"message":"Sorry, insufficient points."}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({"message":"Sorry, insufficient points."}, status=status.HTTP_200_OK)
+    
+
+class MenuSearchAPIView(APIView):
+    """
+    API view for searching the menu.
+
+    Matches categories and available fooditems by name and description,
+    tolerating partial words and small typos.
+
+    The user must be authenticated.
+
+    Methods:
+        get: searches the menu.
+    """
+
+    permission_classes = [IsAuthenticated, IsCustomer]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handle GET requests for searching the menu.
+
+        The search text is passed as `q`, and `type` optionally restricts
+        the results to `category` or `fooditem`.
+
+        Returns:
+            - The ranked categories and fooditems matching the search.
+        """
+        query = request.query_params.get("q", "").strip()
+        kind = request.query_params.get("type")
+
+        if not query:
+            return Response({"detail":"Please provide a search query."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if kind not in (None, CATEGORY, FOODITEM):
+            return Response({"detail":"Invalid search type."}, status=status.HTTP_400_BAD_REQUEST)
+
+        hits = search_menu(query, kind=kind, available_only=True)
+
+        # fetches the matched categories and fooditems with one query each
+        found = {
+            CATEGORY: Category.objects.in_bulk([hit.id for hit in hits if hit.kind == CATEGORY]),
+            FOODITEM: FoodItemSerializer.setup_eager_loading(FoodItem.objects.all()).in_bulk(
+                [hit.id for hit in hits if hit.kind == FOODITEM]
+            ),
+        }
+        serializers = {
+            CATEGORY: CategorySerializer,
+            FOODITEM: FoodItemSerializer,
+        }
+
+        results = []
+        for hit in hits:
+            instance = found[hit.kind].get(hit.id)
+
+            # skips anything deleted since it was indexed
+            if instance is None:
+                continue
+
+            results.append({
+                "type": hit.kind,
+                "score": hit.score,
+                hit.kind: serializers[hit.kind](instance).data,
+            })
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+@require_GET
+async def order_events(request):
+    """
+    Streams the order status changes, payment confirmations and
+    notifications of the authenticated customer as server-sent events.
+
+    The access token can be passed as `?token=` since browsers can't set
+    headers on an EventSource.
+
+    Returns:
+        StreamingHttpResponse: the event stream, or an error if the user
+        is not an authenticated customer.
+    """
+    user = await authenticate_stream(request)
+
+    if user is None:
+        return unauthorized()
+
+    if user.role != "customer":
+        return JsonResponse({"detail": IsCustomer.message}, status=403)
+
+    return event_stream(user_channel(user.id))